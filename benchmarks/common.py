@@ -0,0 +1,47 @@
+import modes
+import os
+import random
+import time
+
+# Benchmarks import the application in test mode, the same as the automated tests
+os.environ.setdefault(modes.ENVIRONMENT_VARIABLE, modes.TEST)
+
+BENCHMARKS_ROOT = os.path.dirname(os.path.realpath(__file__))
+MAP_TEST_DATA_DIR = os.path.join(BENCHMARKS_ROOT, os.pardir, "tests", "data", "maps")
+
+# Created once by get_app, and shared by all benchmarks in the process
+app = None
+
+def get_app():
+  global app
+
+  if app is None:
+    from mrt_file_server import create_app
+    app = create_app()
+
+  return app
+
+def read_map_test_data_file(filename):
+  with open(os.path.join(MAP_TEST_DATA_DIR, filename), "rb") as file:
+    return file.read()
+
+def create_synthetic_map_buffer(seed):
+  from mrt_file_server.utils.nbt_utils import load_compressed_nbt_buffer, save_compressed_nbt_buffer, get_nbt_tag
+
+  # Start from a real map and fill it with pseudo-random colors, so decompression and parsing do realistic work
+  nbt_file = load_compressed_nbt_buffer(read_map_test_data_file("map_1500.dat"))
+  colors = get_nbt_tag(get_nbt_tag(nbt_file, "data"), "colors")
+  rng = random.Random(seed)
+  colors.value = bytearray(rng.randrange(4, 248) for _ in range(len(colors.value)))
+  return save_compressed_nbt_buffer(nbt_file)
+
+def time_call(function, repeat = 5, number = 1):
+  # Returns the best time in seconds for a single call, out of the given number of repeats
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for _ in range(number):
+      function()
+    elapsed = (time.perf_counter() - start) / number
+    best = elapsed if best is None else min(best, elapsed)
+  return best
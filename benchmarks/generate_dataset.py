@@ -0,0 +1,204 @@
+"""
+Generates a synthetic instance tree at production scale, for benchmarks and scaling tests of the directory scanning code:
+
+  <instance dir>/<mode>/downloads/maps/map_#.dat         Valid gzip NBT maps, with a mix of locked and unlocked maps
+  <instance dir>/<mode>/downloads/maps/idcounts.dat      Last map ID matching the generated maps
+  <instance dir>/<mode>/downloads/schematics/*.schematic MCEdit schematics of varied sizes
+  <instance dir>/<mode>/config.py                        Created with a SECRET_KEY if it does not exist
+
+The same seed and arguments always produce byte-identical files with the same modification times.
+Point the application at the generated tree with the MRT_FILE_SERVER_INSTANCE_PATH environment variable.
+
+Usage: python -m benchmarks.generate_dataset INSTANCE_DIR [--maps N] [--locked-fraction F] [--schematics M] [--seed N] [--mode MODE]
+"""
+
+from nbt.nbt import NBTFile, TAG_Byte, TAG_Byte_Array, TAG_Compound, TAG_Int, TAG_List, TAG_Short, TAG_String
+
+import argparse
+import gzip
+import io
+import json
+import modes
+import os
+import random
+import time
+
+# Minecraft 1.15, the same as the fixtures in tests/data/maps
+DATA_VERSION = 2230
+
+MAP_SIZE = 128
+NUMBER_OF_MAP_BASE_COLORS = 62
+
+# Modification time of the first generated file, so that repeated runs produce identical directory trees
+BASE_MTIME = 1600000000
+
+SCHEMATIC_NAME_PARTS = [
+  ["mrt_v5_final", "mrt_v4", "station", "bridge", "depot", "tunnel"],
+  ["elevated", "ground", "subground", "underground", "viaduct"],
+  ["centre_station", "side_station", "single_track", "double_track", "double_curve", "split1", "split2", "junction", "buffer_stop"]
+]
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("instance_dir", help = "Instance directory to generate the dataset in")
+  parser.add_argument("--maps", type = int, default = 10000, help = "Number of maps to generate (default: 10000)")
+  parser.add_argument("--first-map-id", type = int, default = 0, help = "ID of the first generated map (default: 0)")
+  parser.add_argument("--locked-fraction", type = float, default = 0.5, help = "Fraction of the maps that are locked (default: 0.5)")
+  parser.add_argument("--schematics", type = int, default = 1000, help = "Number of schematics to generate (default: 1000)")
+  parser.add_argument("--seed", type = int, default = 0, help = "Seed for all generated content (default: 0)")
+  parser.add_argument("--mode", default = modes.TEST, help = "Application mode subdirectory to generate (default: test)")
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  mode_dir = os.path.join(os.path.realpath(args.instance_dir), args.mode)
+  map_downloads_dir = os.path.join(mode_dir, "downloads", "maps")
+  schematic_downloads_dir = os.path.join(mode_dir, "downloads", "schematics")
+
+  for directory in [map_downloads_dir, schematic_downloads_dir]:
+    os.makedirs(directory, exist_ok = True)
+
+  write_config_file(mode_dir)
+
+  last_map_id = args.first_map_id + args.maps - 1
+  locked_count = generate_maps(map_downloads_dir, args.first_map_id, args.maps, args.locked_fraction, args.seed)
+  write_nbt_file(os.path.join(map_downloads_dir, "idcounts.dat"), create_idcounts_nbt(last_map_id), BASE_MTIME + args.maps)
+
+  schematic_size = generate_schematics(schematic_downloads_dir, args.schematics, args.seed)
+
+  manifest = {
+    "seed": args.seed,
+    "maps": args.maps,
+    "first_map_id": args.first_map_id,
+    "last_map_id": last_map_id,
+    "locked_maps": locked_count,
+    "schematics": args.schematics,
+    "schematic_bytes": schematic_size
+  }
+  with open(os.path.join(mode_dir, "dataset.json"), "w") as file:
+    json.dump(manifest, file, indent = 2)
+
+  print("Generated {} maps ({} locked, last map ID {}) and {} schematics ({} bytes) in {} in {:.1f} s".format(
+    args.maps, locked_count, last_map_id, args.schematics, schematic_size, mode_dir, time.perf_counter() - start))
+
+def write_config_file(mode_dir):
+  config_file_path = os.path.join(mode_dir, "config.py")
+  if not os.path.isfile(config_file_path):
+    with open(config_file_path, "w") as file:
+      file.write("SECRET_KEY = \"generated-dataset\"\n")
+
+def generate_maps(map_downloads_dir, first_map_id, count, locked_fraction, seed):
+  rng = random.Random("maps-{}".format(seed))
+  locked_count = 0
+
+  for index in range(count):
+    map_id = first_map_id + index
+    locked = rng.random() < locked_fraction
+    locked_count += locked
+
+    map_file_path = os.path.join(map_downloads_dir, "map_{}.dat".format(map_id))
+    write_nbt_file(map_file_path, create_map_nbt(rng, locked), BASE_MTIME + index)
+
+    if (index + 1) % 1000 == 0:
+      print("  {} / {} maps".format(index + 1, count))
+
+  return locked_count
+
+def create_map_nbt(rng, locked):
+  scale = rng.choice([0, 0, 0, 1, 2, 3, 4])
+  map_width_in_blocks = MAP_SIZE << scale
+
+  nbt_file = NBTFile()
+  nbt_file.tags.append(TAG_Int(name = "DataVersion", value = DATA_VERSION))
+
+  data = TAG_Compound()
+  data.name = "data"
+  data.tags.extend([
+    TAG_Byte_Array(name = "colors"),
+    TAG_Byte(name = "dimension", value = rng.choice([0, 0, 0, 0, -1, 1])),
+    TAG_Short(name = "height", value = MAP_SIZE),
+    TAG_Byte(name = "locked", value = int(locked)),
+    TAG_Byte(name = "scale", value = scale),
+    TAG_Byte(name = "trackingPosition", value = 1),
+    TAG_Short(name = "width", value = MAP_SIZE),
+    # Maps are aligned to a grid of their own size, the same as the maps made by Minecraft
+    TAG_Int(name = "xCenter", value = rng.randint(-64, 64) * map_width_in_blocks + map_width_in_blocks // 2 - 64),
+    TAG_Int(name = "zCenter", value = rng.randint(-64, 64) * map_width_in_blocks + map_width_in_blocks // 2 - 64)
+  ])
+  data["colors"].value = create_map_colors(rng)
+  nbt_file.tags.append(data)
+
+  return nbt_file
+
+def create_map_colors(rng):
+  # Runs of a few colors, like terrain, which compress about as well as real maps
+  colors = bytearray(MAP_SIZE * MAP_SIZE)
+  palette = [base_color * 4 + shade for base_color in rng.sample(range(1, NUMBER_OF_MAP_BASE_COLORS), 6) for shade in range(4)]
+
+  offset = 0
+  while offset < len(colors):
+    run_length = min(rng.randint(1, 96), len(colors) - offset)
+    colors[offset:offset + run_length] = bytes([rng.choice(palette)]) * run_length
+    offset += run_length
+
+  return colors
+
+def create_idcounts_nbt(last_map_id):
+  nbt_file = NBTFile()
+  nbt_file.tags.append(TAG_Int(name = "DataVersion", value = DATA_VERSION))
+
+  data = TAG_Compound()
+  data.name = "data"
+  data.tags.append(TAG_Int(name = "map", value = last_map_id))
+  nbt_file.tags.append(data)
+
+  return nbt_file
+
+def generate_schematics(schematic_downloads_dir, count, seed):
+  rng = random.Random("schematics-{}".format(seed))
+  total_size = 0
+
+  for index in range(count):
+    filename = "{}_{}_{}_{:05d}.schematic".format(*[rng.choice(parts) for parts in SCHEMATIC_NAME_PARTS], index)
+    schematic_file_path = os.path.join(schematic_downloads_dir, filename)
+    total_size += write_nbt_file(schematic_file_path, create_schematic_nbt(rng), BASE_MTIME + index)
+
+  return total_size
+
+def create_schematic_nbt(rng):
+  # Sizes are skewed towards small pieces of track, with a few large stations
+  width, height, length = [max(1, int(rng.lognormvariate(2.2, 0.7))) for _ in range(3)]
+  volume = width * height * length
+
+  nbt_file = NBTFile()
+  nbt_file.name = "Schematic"
+  nbt_file.tags.extend([
+    TAG_Short(name = "Width", value = width),
+    TAG_Short(name = "Height", value = height),
+    TAG_Short(name = "Length", value = length),
+    TAG_String(name = "Materials", value = "Alpha"),
+    TAG_Byte_Array(name = "Blocks"),
+    TAG_Byte_Array(name = "Data"),
+    TAG_List(name = "Entities", type = TAG_Compound),
+    TAG_List(name = "TileEntities", type = TAG_Compound)
+  ])
+
+  block_ids = [0, 0, 0, 1, 4, 5, 20, 35, 43, 44, 66, 98, 101, 102]
+  nbt_file["Blocks"].value = bytearray(rng.choice(block_ids) for _ in range(volume))
+  nbt_file["Data"].value = bytearray(rng.choice([0, 0, 0, 1, 2, 3]) for _ in range(volume))
+
+  return nbt_file
+
+def write_nbt_file(file_path, nbt_file, mtime):
+  # The gzip header's timestamp is fixed, so the same content is always written as the same bytes
+  uncompressed_buffer = io.BytesIO()
+  nbt_file.write_file(buffer = uncompressed_buffer)
+  compressed_buffer = gzip.compress(uncompressed_buffer.getvalue(), mtime = 0)
+
+  with open(file_path, "wb") as file:
+    file.write(compressed_buffer)
+  os.utime(file_path, (mtime, mtime))
+
+  return len(compressed_buffer)
+
+if __name__ == "__main__":
+  main()
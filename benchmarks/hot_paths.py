@@ -0,0 +1,201 @@
+"""
+Times the NBT parsing and map validation hot paths, up to and including the full upload_single_map path.
+Fixture maps from tests/data/maps are used alongside synthetic maps filled with pseudo-random colors.
+
+Results can be written to a JSON file, and compared with an earlier results file to flag regressions:
+
+  python -m benchmarks.hot_paths --output baseline.json
+  (make a change)
+  python -m benchmarks.hot_paths --compare baseline.json --threshold 0.1
+
+With --compare, the exit status is 1 if any benchmark is slower than the baseline by more than the threshold.
+
+The application always runs in test mode, against a scratch instance directory that is removed afterwards, or against
+the instance directory given with --instance-dir, such as one created by generate_dataset. Existing files in a given
+instance directory are never removed or replaced.
+
+Usage: python -m benchmarks.hot_paths [--instance-dir DIR] [--output FILE] [--compare FILE] [--threshold FRACTION] [--min-time SECONDS] [--filter TEXT]
+"""
+
+from benchmarks.common import create_synthetic_map_buffer, get_app, read_map_test_data_file, time_call, MAP_TEST_DATA_DIR
+
+from io import BytesIO
+
+import argparse
+import json
+import modes
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# Maps used by the benchmarks: a fixture from tests/data/maps, and a synthetic map whose colors do not compress well
+FIXTURE_MAP_FILENAME = "map_1500.dat"
+SYNTHETIC_MAP_FILENAME = "map_1501.dat"
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--output", help = "Write the results to this JSON file")
+  parser.add_argument("--compare", help = "Compare the results with this earlier JSON results file")
+  parser.add_argument("--threshold", type = float, default = 0.1, help = "Fraction by which a benchmark may be slower than the baseline before it is flagged (default: 0.1)")
+  parser.add_argument("--min-time", type = float, default = 0.05, help = "Minimum duration in seconds of each timed repeat (default: 0.05)")
+  parser.add_argument("--repeat", type = int, default = 5, help = "Number of timed repeats, the best is reported (default: 5)")
+  parser.add_argument("--filter", default = "", help = "Only run benchmarks whose name contains this text")
+  parser.add_argument("--instance-dir", help = "Instance directory to run against (default: a scratch directory)")
+  args = parser.parse_args()
+
+  instance_dir = args.instance_dir or tempfile.mkdtemp(prefix = "mrt-file-server-hot-paths-")
+  results = {}
+
+  try:
+    # Test mode is forced, so that an exported MRT_FILE_SERVER_MODE never points the benchmark at a live instance
+    prepare_instance_directories(instance_dir)
+    os.environ[modes.INSTANCE_PATH_ENVIRONMENT_VARIABLE] = instance_dir
+    os.environ[modes.ENVIRONMENT_VARIABLE] = modes.TEST
+
+    for name, function in create_benchmarks():
+      if args.filter not in name:
+        continue
+      number = calibrate_number(function, args.min_time)
+      results[name] = { "seconds": time_call(function, repeat = args.repeat, number = number), "number": number }
+  finally:
+    if not args.instance_dir:
+      shutil.rmtree(instance_dir, ignore_errors = True)
+
+  report = {
+    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "results": results
+  }
+
+  if args.output:
+    with open(args.output, "w") as file:
+      json.dump(report, file, indent = 2)
+
+  if args.compare:
+    with open(args.compare) as file:
+      baseline = json.load(file)
+    regressions = print_comparison(results, baseline["results"], args.threshold)
+    sys.exit(1 if regressions else 0)
+  else:
+    print_results(results)
+
+def create_benchmarks():
+  from mrt_file_server.blueprints.map import get_last_map_id, is_existing_map_file_locked, upload_single_map
+  from mrt_file_server.utils.map_utils import get_file_map_id, is_invalid_map_format
+  from mrt_file_server.utils.nbt_utils import decompress_nbt_buffer, load_compressed_nbt_buffer, set_compressed_nbt_map_byte_value
+  from werkzeug.datastructures import FileStorage
+
+  map_buffers = {
+    "fixture": read_map_test_data_file(FIXTURE_MAP_FILENAME),
+    "synthetic": create_synthetic_map_buffer(0)
+  }
+  uncompressed_map_buffers = { kind: decompress_nbt_buffer(map_buffer) for kind, map_buffer in map_buffers.items() }
+
+  app = get_app()
+
+  # Functions such as get_last_map_id read the configuration of the current application
+  app.app_context().push()
+
+  def upload_map(filename, map_buffer):
+    with app.test_request_context("/map/upload", method = "POST"):
+      upload_single_map("benchmark", FileStorage(stream = BytesIO(map_buffer), filename = filename))
+
+    # Remove the uploaded map, so the next upload is not rejected as already uploaded. In a generated dataset, the
+    # upload may be rejected instead, for example if the map ID is outside the dataset's uploadable range.
+    uploaded_file_path = os.path.join(app.config["MAP_UPLOADS_DIR"], filename)
+    if os.path.exists(uploaded_file_path):
+      os.remove(uploaded_file_path)
+
+  benchmarks = [("get_file_map_id", lambda: get_file_map_id(FIXTURE_MAP_FILENAME))]
+
+  for kind, map_buffer in map_buffers.items():
+    benchmarks.append(("load_compressed_nbt_buffer[{}]".format(kind), lambda map_buffer = map_buffer: load_compressed_nbt_buffer(map_buffer)))
+
+  for kind, uncompressed_map_buffer in uncompressed_map_buffers.items():
+    benchmarks.append(("is_invalid_map_format[{}]".format(kind), lambda uncompressed_map_buffer = uncompressed_map_buffer: is_invalid_map_format(uncompressed_map_buffer)))
+
+  for kind, map_buffer in map_buffers.items():
+    benchmarks.append(("set_compressed_nbt_map_byte_value[{}]".format(kind), lambda map_buffer = map_buffer: set_compressed_nbt_map_byte_value(map_buffer, "locked", 1)))
+
+  benchmarks.append(("is_existing_map_file_locked", lambda: is_existing_map_file_locked(FIXTURE_MAP_FILENAME)))
+  benchmarks.append(("get_last_map_id", get_last_map_id))
+
+  client = app.test_client()
+  benchmarks.append(("maps_status_api[100 maps]", lambda: client.get("/api/maps/status", query_string = { "ids": "1001-1100" })))
+
+  for kind, filename in [("fixture", FIXTURE_MAP_FILENAME), ("synthetic", SYNTHETIC_MAP_FILENAME)]:
+    benchmarks.append(("upload_single_map[{}]".format(kind), lambda filename = filename, map_buffer = map_buffers[kind]: upload_map(filename, map_buffer)))
+
+  return benchmarks
+
+def prepare_instance_directories(instance_dir):
+  # Existing maps with the same IDs are in the downloads directory, as they would be on a live server
+  mode_dir = os.path.join(instance_dir, modes.TEST)
+  map_downloads_dir = os.path.join(mode_dir, "downloads", "maps")
+
+  for directory in [map_downloads_dir, os.path.join(mode_dir, "uploads", "maps")]:
+    os.makedirs(directory, exist_ok = True)
+
+  copy_if_missing(os.path.join(MAP_TEST_DATA_DIR, "idcounts.dat"), os.path.join(map_downloads_dir, "idcounts.dat"))
+  for filename in [FIXTURE_MAP_FILENAME, SYNTHETIC_MAP_FILENAME]:
+    copy_if_missing(os.path.join(MAP_TEST_DATA_DIR, "existing_unlocked.dat"), os.path.join(map_downloads_dir, filename))
+
+  config_file_path = os.path.join(mode_dir, "config.py")
+  if not os.path.isfile(config_file_path):
+    with open(config_file_path, "w") as file:
+      file.write("SECRET_KEY = \"hot-paths\"\n")
+
+def copy_if_missing(src_path, dest_path):
+  if not os.path.exists(dest_path):
+    shutil.copyfile(src_path, dest_path)
+
+def calibrate_number(function, min_time):
+  # Doubles the number of calls per repeat until a repeat takes at least min_time seconds
+  number = 1
+  while True:
+    start = time.perf_counter()
+    for _ in range(number):
+      function()
+    if time.perf_counter() - start >= min_time:
+      return number
+    number *= 2
+
+def print_results(results):
+  print("{:40} {:>14}".format("Benchmark", "Time"))
+  for name, result in results.items():
+    print("{:40} {:>14}".format(name, format_seconds(result["seconds"])))
+
+def print_comparison(results, baseline_results, threshold):
+  regressions = []
+
+  print("{:40} {:>14} {:>14} {:>9}".format("Benchmark", "Baseline", "Time", "Change"))
+  for name, result in results.items():
+    baseline_result = baseline_results.get(name)
+    if baseline_result is None:
+      print("{:40} {:>14} {:>14} {:>9}".format(name, "-", format_seconds(result["seconds"]), "new"))
+      continue
+
+    change = result["seconds"] / baseline_result["seconds"] - 1
+    flag = ""
+    if change > threshold:
+      regressions.append(name)
+      flag = "  REGRESSION"
+
+    print("{:40} {:>14} {:>14} {:>+8.1%}{}".format(name, format_seconds(baseline_result["seconds"]), format_seconds(result["seconds"]), change, flag))
+
+  if regressions:
+    print("{} benchmark(s) slower than the baseline by more than {:.0%}.".format(len(regressions), threshold))
+
+  return regressions
+
+def format_seconds(seconds):
+  if seconds < 0.001:
+    return "{:.2f} us".format(seconds * 1000000)
+  return "{:.3f} ms".format(seconds * 1000)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,223 @@
+"""
+Drives the WSGI application directly from many threads of test clients, without a network, to measure how many
+requests per second a single worker can sustain for a mix of scenarios.
+
+The application runs against a scratch instance directory, which is populated with maps, schematics and a world
+file, and removed afterwards unless --instance-dir is given.
+
+Scenarios and their relative weights are set with --mix, for example:
+
+  python -m benchmarks.load_test --threads 8 --requests 2000 --mix map_upload=1,map_download_link=4,schematic_download=4,world_page=1
+
+Usage: python -m benchmarks.load_test [--threads N] [--requests N] [--mix SCENARIO=WEIGHT,...] [--upload-batch-size N] [--instance-dir DIR] [--seed N]
+"""
+
+from benchmarks.common import get_app, MAP_TEST_DATA_DIR, BENCHMARKS_ROOT
+
+from io import BytesIO
+
+import argparse
+import glob
+import itertools
+import modes
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+SCHEMATIC_TEST_DATA_DIR = os.path.join(BENCHMARKS_ROOT, os.pardir, "tests", "data", "schematics")
+
+# Map IDs that exist in the scratch downloads directory, within the upload range allowed by the fixture idcounts.dat (last map ID 2000)
+EXISTING_MAP_IDS = range(1001, 1101)
+
+# Map IDs that are uploaded, cycled through so that concurrent uploads do not collide
+UPLOAD_MAP_IDS = range(1101, 2001)
+
+DEFAULT_MIX = "map_upload=1,map_download_link=4,schematic_download=4,world_page=1"
+
+WORLD_FILENAME = "load-test-world.7z"
+WORLD_FILE_SIZE = 1024 * 1024
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--threads", type = int, default = 8, help = "Number of concurrent client threads (default: 8)")
+  parser.add_argument("--requests", type = int, default = 1000, help = "Total number of requests to send (default: 1000)")
+  parser.add_argument("--mix", default = DEFAULT_MIX, help = "Scenarios and their relative weights (default: {})".format(DEFAULT_MIX))
+  parser.add_argument("--upload-batch-size", type = int, default = 5, help = "Number of maps in each map upload (default: 5)")
+  parser.add_argument("--instance-dir", help = "Scratch instance directory to use and keep, instead of a temporary one")
+  parser.add_argument("--seed", type = int, default = 0, help = "Seed for the scenario choices (default: 0)")
+  args = parser.parse_args()
+
+  mix = parse_mix(args.mix)
+  instance_dir = args.instance_dir or tempfile.mkdtemp(prefix = "mrt-file-server-load-test-")
+
+  try:
+    prepare_scratch_instance(instance_dir)
+    os.environ[modes.INSTANCE_PATH_ENVIRONMENT_VARIABLE] = instance_dir
+    os.environ[modes.ENVIRONMENT_VARIABLE] = modes.TEST
+
+    app = get_app()
+    app.testing = True
+
+    scenarios = create_scenarios(app, args.upload_batch_size)
+    unknown_scenarios = [name for name in mix if name not in scenarios]
+    if unknown_scenarios:
+      parser.error("Unknown scenarios: {}. Choose from: {}".format(", ".join(unknown_scenarios), ", ".join(scenarios)))
+
+    samples, elapsed = run_load(app, scenarios, mix, args.threads, args.requests, args.seed)
+    print_report(samples, elapsed, args.threads)
+  finally:
+    if not args.instance_dir:
+      shutil.rmtree(instance_dir, ignore_errors = True)
+
+def parse_mix(mix_text):
+  mix = {}
+  for item in mix_text.split(","):
+    name, weight = item.split("=")
+    mix[name.strip()] = float(weight)
+  return mix
+
+def prepare_scratch_instance(instance_dir):
+  mode_dir = os.path.join(instance_dir, modes.TEST)
+  map_downloads_dir = os.path.join(mode_dir, "downloads", "maps")
+  schematic_downloads_dir = os.path.join(mode_dir, "downloads", "schematics")
+  world_downloads_dir = os.path.join(mode_dir, "downloads", "worlds")
+
+  for directory in [map_downloads_dir, schematic_downloads_dir, world_downloads_dir, os.path.join(mode_dir, "uploads", "maps")]:
+    os.makedirs(directory, exist_ok = True)
+
+  config_file_path = os.path.join(mode_dir, "config.py")
+  if not os.path.isfile(config_file_path):
+    with open(config_file_path, "w") as file:
+      file.write("SECRET_KEY = \"load-test\"\n")
+
+  shutil.copyfile(os.path.join(MAP_TEST_DATA_DIR, "idcounts.dat"), os.path.join(map_downloads_dir, "idcounts.dat"))
+  for map_id in EXISTING_MAP_IDS:
+    shutil.copyfile(os.path.join(MAP_TEST_DATA_DIR, "existing_unlocked.dat"), os.path.join(map_downloads_dir, "map_{}.dat".format(map_id)))
+
+  for schematic_file_path in glob.glob(os.path.join(SCHEMATIC_TEST_DATA_DIR, "mrt_*.schem*")):
+    shutil.copy(schematic_file_path, schematic_downloads_dir)
+
+  with open(os.path.join(world_downloads_dir, WORLD_FILENAME), "wb") as file:
+    file.truncate(WORLD_FILE_SIZE)
+
+def create_scenarios(app, upload_batch_size):
+  # Each scenario sends one request with the given client, and returns the response and whether it succeeded
+  with open(os.path.join(MAP_TEST_DATA_DIR, "map_1500.dat"), "rb") as file:
+    map_buffer = file.read()
+
+  schematic_filenames = sorted(os.listdir(app.config["SCHEMATIC_DOWNLOADS_DIR"]))
+  upload_map_ids = itertools.cycle(UPLOAD_MAP_IDS)
+  upload_map_ids_lock = threading.Lock()
+
+  def map_upload(client, rng):
+    with upload_map_ids_lock:
+      filenames = ["map_{}.dat".format(next(upload_map_ids)) for _ in range(upload_batch_size)]
+
+    data = { "userName": "LoadTest", "map": [(BytesIO(map_buffer), filename) for filename in filenames] }
+    response = client.post("/map/upload", content_type = "multipart/form-data", data = data)
+    succeeded = response.status_code == 200 and b"flash-failure" not in response.data
+
+    # Uploaded maps are removed, as an admin would move them, so that their IDs can be uploaded again
+    for filename in filenames:
+      remove_file(os.path.join(app.config["MAP_UPLOADS_DIR"], filename))
+
+    return response, succeeded
+
+  def map_download_link(client, rng):
+    response = client.post("/map/download", data = { "mapId": str(rng.choice(EXISTING_MAP_IDS)) })
+    return response, response.status_code == 200 and b"flash-success" in response.data
+
+  def schematic_download(client, rng):
+    response = client.get("/schematic/download/{}".format(rng.choice(schematic_filenames)))
+    return response, response.status_code == 200
+
+  def world_page(client, rng):
+    response = client.get("/world/download")
+    return response, response.status_code == 200
+
+  def world_download(client, rng):
+    response = client.get("/world/download/{}".format(WORLD_FILENAME))
+    return response, response.status_code == 200
+
+  return {
+    "map_upload": map_upload,
+    "map_download_link": map_download_link,
+    "schematic_download": schematic_download,
+    "world_page": world_page,
+    "world_download": world_download
+  }
+
+def remove_file(file_path):
+  try:
+    os.remove(file_path)
+  except FileNotFoundError:
+    pass
+
+def run_load(app, scenarios, mix, thread_count, request_count, seed):
+  names = list(mix)
+  weights = [mix[name] for name in names]
+  remaining_requests = itertools.count()
+  samples = []
+  samples_lock = threading.Lock()
+
+  def run_client(thread_index):
+    client = app.test_client()
+    rng = random.Random(seed * 1000 + thread_index)
+    thread_samples = []
+
+    while next(remaining_requests) < request_count:
+      name = rng.choices(names, weights)[0]
+      start = time.perf_counter()
+      try:
+        response, succeeded = scenarios[name](client, rng)
+        # The whole body is read, as a real client would
+        response.get_data()
+        response.close()
+      except Exception as e:
+        succeeded = False
+      thread_samples.append((name, time.perf_counter() - start, succeeded))
+
+    with samples_lock:
+      samples.extend(thread_samples)
+
+  threads = [threading.Thread(target = run_client, args = (index,)) for index in range(thread_count)]
+
+  start = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.perf_counter() - start
+
+  return samples, elapsed
+
+def percentile(sorted_values, fraction):
+  # Nearest-rank percentile of an already sorted list
+  index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+  return sorted_values[index]
+
+def print_report(samples, elapsed, thread_count):
+  print("{} requests from {} threads in {:.2f} s ({:.1f} requests/s)".format(len(samples), thread_count, elapsed, len(samples) / elapsed))
+  print("{:20} {:>8} {:>10} {:>10} {:>10} {:>10} {:>8}".format("Scenario", "Requests", "Req/s", "p50 ms", "p95 ms", "p99 ms", "Errors"))
+
+  samples_by_name = {}
+  for name, latency, succeeded in samples:
+    samples_by_name.setdefault(name, []).append((latency, succeeded))
+
+  for name in sorted(samples_by_name):
+    latencies = sorted(latency for latency, succeeded in samples_by_name[name])
+    error_count = sum(1 for latency, succeeded in samples_by_name[name] if not succeeded)
+    print("{:20} {:>8} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>7.1%}".format(
+      name,
+      len(latencies),
+      len(latencies) / elapsed,
+      percentile(latencies, 0.50) * 1000,
+      percentile(latencies, 0.95) * 1000,
+      percentile(latencies, 0.99) * 1000,
+      error_count / len(latencies)))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,68 @@
+"""
+Measures the cost of a log call on the request thread when records are written to the log file directly,
+and when they are placed on a queue and written in batches by a background thread.
+
+Use --flush-latency to simulate a slow or busy disk, where each flush of the log file blocks for the given time.
+
+Usage: python -m benchmarks.log_queue [--number N] [--batch-size N] [--flush-latency MICROSECONDS]
+"""
+
+import benchmarks.common
+
+import argparse
+import logging
+import tempfile
+import time
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--number", type = int, default = 2000, help = "Number of log calls per timed repeat (default: 2000)")
+  parser.add_argument("--batch-size", type = int, default = 64, help = "Batch size of the queued mode (default: 64)")
+  parser.add_argument("--flush-latency", type = float, default = 0, help = "Simulated time in microseconds that each flush of the log file blocks for (default: 0)")
+  args = parser.parse_args()
+
+  from mrt_file_server.log_queue import BatchedRotatingFileHandler, create_log_queue
+
+  class SlowFlushFileHandler(BatchedRotatingFileHandler):
+    def flush(self):
+      if not self.flush_deferred and args.flush_latency:
+        time.sleep(args.flush_latency / 1000000)
+      BatchedRotatingFileHandler.flush(self)
+
+  print("Log call cost on the request thread")
+  print("  {:10} {:>14} {:>22}".format("", "Per call", "Until written to disk"))
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for name in ["Direct", "Queued"]:
+      logger = logging.getLogger("benchmark_{}".format(name.lower()))
+      logger.setLevel(logging.INFO)
+      logger.propagate = False
+
+      file_handler = SlowFlushFileHandler("{}/{}.log".format(temp_dir, name.lower()))
+      file_handler.setFormatter(logging.Formatter(fmt = "{asctime} {name:12} {levelname:8} {message}", style = "{"))
+
+      listener = None
+      if name == "Queued":
+        queue_handler, listener = create_log_queue([file_handler], args.batch_size)
+        logger.addHandler(queue_handler)
+      else:
+        logger.addHandler(file_handler)
+
+      def log_call():
+        logger.info("Map upload successful: '%s' (Username: '%s')", "map_1500.dat", "benchmark")
+
+      start = time.perf_counter()
+      for _ in range(args.number):
+        log_call()
+      elapsed = (time.perf_counter() - start) / args.number
+
+      # Includes the time for the background thread to catch up, which is spent off the request thread
+      if listener is not None:
+        listener.stop()
+      total_elapsed = (time.perf_counter() - start) / args.number
+
+      file_handler.close()
+      print("  {:10} {:>11.2f} us {:>19.2f} us".format(name, elapsed * 1000000, total_elapsed * 1000000))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,52 @@
+"""
+Compares preparing a full batch of map uploads serially with preparing it in the MapPreparationPool that map uploads use
+when MAP_UPLOAD_PROCESS_POOL_WORKERS is set. The first batch, which starts the forkserver and the worker processes,
+is reported separately from the best of the following batches.
+
+Usage: python -m benchmarks.map_batch [--workers N] [--files N] [--repeat N]
+"""
+
+from benchmarks.common import create_synthetic_map_buffer, time_call
+
+import argparse
+import os
+import time
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--files", type = int, default = 10, help = "Number of maps in the batch (default: 10)")
+  parser.add_argument("--workers", type = int, default = min(os.cpu_count() or 1, 10), help = "Number of worker processes (default: CPU count, at most 10)")
+  parser.add_argument("--repeat", type = int, default = 5, help = "Number of timed repeats, the best is reported (default: 5)")
+  args = parser.parse_args()
+
+  from mrt_file_server.default_config import MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE
+  from mrt_file_server.map_preparation import MapPreparationPool
+  from mrt_file_server.utils.map_utils import prepare_map_buffer
+
+  map_buffers = [create_synthetic_map_buffer(seed) for seed in range(args.files)]
+
+  serial_time = time_call(lambda: [prepare_map_buffer(map_buffer, MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE) for map_buffer in map_buffers], repeat = args.repeat)
+
+  # The same calls as submit_map_preparations and get_prepared_map_buffer make for each file of an upload
+  def prepare_batch_in_pool():
+    map_futures = [map_preparation_pool.submit(prepare_map_buffer, map_buffer, MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE) for map_buffer in map_buffers]
+    return [map_future.result() for map_future in map_futures]
+
+  map_preparation_pool = MapPreparationPool(args.workers)
+  try:
+    start = time.perf_counter()
+    prepare_batch_in_pool()
+    first_pool_time = time.perf_counter() - start
+
+    pool_time = time_call(prepare_batch_in_pool, repeat = args.repeat)
+  finally:
+    map_preparation_pool.shutdown()
+
+  print("Batch of {} maps, {} worker processes".format(args.files, args.workers))
+  print("  Serial:                    {:8.2f} ms".format(serial_time * 1000))
+  print("  Pool, first batch:         {:8.2f} ms".format(first_pool_time * 1000))
+  print("  Pool, started:             {:8.2f} ms".format(pool_time * 1000))
+  print("  Speedup of started pool:   {:8.2f}x".format(serial_time / pool_time))
+
+if __name__ == "__main__":
+  main()
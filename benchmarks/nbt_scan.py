@@ -0,0 +1,46 @@
+"""
+Compares validating an uploaded map by building the full NBT tree with the nbt library
+against validating it with the streaming NBT scanner.
+
+Usage: python -m benchmarks.nbt_scan [--number N]
+"""
+
+from benchmarks.common import create_synthetic_map_buffer, time_call
+
+import argparse
+import io
+import tracemalloc
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--number", type = int, default = 200, help = "Number of validations per timed repeat (default: 200)")
+  args = parser.parse_args()
+
+  from mrt_file_server.utils.map_utils import is_invalid_map_format
+  from mrt_file_server.utils.nbt_utils import decompress_nbt_buffer, load_uncompressed_nbt_buffer, get_nbt_map_value
+
+  uncompressed_buffer = decompress_nbt_buffer(create_synthetic_map_buffer(0))
+
+  def validate_with_tree():
+    nbt_file = load_uncompressed_nbt_buffer(io.BytesIO(uncompressed_buffer))
+    return any(get_nbt_map_value(nbt_file, tag_name) is None for tag_name in ["dimension", "locked", "colors", "scale", "trackingPosition", "xCenter", "zCenter"])
+
+  def validate_with_scan():
+    return is_invalid_map_format(uncompressed_buffer)
+
+  print("Map validation ({} byte uncompressed map)".format(len(uncompressed_buffer)))
+  print("  {:14} {:>12} {:>16}".format("", "Time", "Peak allocated"))
+
+  for name, validate in [("NBT tree", validate_with_tree), ("Streaming scan", validate_with_scan)]:
+    elapsed = time_call(validate, number = args.number)
+    print("  {:14} {:>9.1f} us {:>14} B".format(name, elapsed * 1000000, measure_peak_allocation(validate)))
+
+def measure_peak_allocation(function):
+  tracemalloc.start()
+  function()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,93 @@
+"""
+Measures the cold start of the application: the time to import the mrt_file_server package, the time for
+create_app to build a ready application, and the time of the first map status request, which syncs the map catalog,
+each in a fresh Python process the same as a newly spawned uWSGI worker.
+
+With --maps, the application runs against a scratch instance generated by generate_dataset with that many maps.
+The first process starts without a map catalog database, the same as a new deployment, and is reported separately.
+Without --maps, the instance directory in MRT_FILE_SERVER_INSTANCE_PATH (or the default one) is used as it is.
+
+The modules with the largest cumulative import times are listed, from Python's -X importtime report of the first run.
+
+Usage: python -m benchmarks.startup [--maps N] [--repeat N] [--top N]
+"""
+
+import benchmarks.common
+
+import argparse
+import modes
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Run in each fresh process. Prints the import, create_app and first map status request times in seconds.
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import mrt_file_server
+imported = time.perf_counter()
+app = mrt_file_server.create_app()
+created = time.perf_counter()
+app.test_client().get("/api/maps/status?ids=0")
+requested = time.perf_counter()
+print(imported - start, created - imported, requested - created)
+"""
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--maps", type = int, help = "Number of maps to generate in a scratch instance directory (default: use the existing instance)")
+  parser.add_argument("--repeat", type = int, default = 10, help = "Number of fresh processes to time, the median is reported (default: 10)")
+  parser.add_argument("--top", type = int, default = 15, help = "Number of modules to list by cumulative import time (default: 15)")
+  args = parser.parse_args()
+
+  if args.maps is None:
+    run_benchmark(args, os.environ.copy())
+    return
+
+  with tempfile.TemporaryDirectory(prefix = "mrt-file-server-startup-") as instance_dir:
+    subprocess.run([sys.executable, "-m", "benchmarks.generate_dataset", instance_dir, "--maps", str(args.maps), "--schematics", "0"], check = True)
+    run_benchmark(args, dict(os.environ, **{ modes.INSTANCE_PATH_ENVIRONMENT_VARIABLE: instance_dir }))
+
+def run_benchmark(args, env):
+  # The first run is timed on its own, since it may have to build the map catalog from scratch
+  first_result = run_startup_script(env, import_time = True)
+  import_report = first_result.stderr
+  first_times = parse_times(first_result)
+
+  times = [parse_times(run_startup_script(env)) for index in range(args.repeat)]
+
+  print("{:34} {:>16} {:>16}".format("", "First run", "Median of {}".format(args.repeat)))
+  for index, label in enumerate(["import mrt_file_server", "create_app()", "First map status request"]):
+    print("  {:32} {:>13.1f} ms {:>13.1f} ms".format(label, first_times[index] * 1000, statistics.median(run[index] for run in times) * 1000))
+  print("  {:32} {:>13.1f} ms {:>13.1f} ms".format("Ready to serve (import + create)", sum(first_times[:2]) * 1000, statistics.median(sum(run[:2]) for run in times) * 1000))
+
+  # Times from -X importtime are inflated by the reporting itself, so are only useful relative to each other
+  print()
+  print("Slowest imports (cumulative, first run with -X importtime)")
+  for module, cumulative_time in parse_import_report(import_report)[:args.top]:
+    print("  {:48} {:>10.1f} ms".format(module, cumulative_time / 1000))
+
+def parse_times(result):
+  return [float(value) for value in result.stdout.split()[-3:]]
+
+def run_startup_script(env, import_time = False):
+  command = [sys.executable] + (["-X", "importtime"] if import_time else []) + ["-c", STARTUP_SCRIPT]
+  return subprocess.run(command, capture_output = True, text = True, check = True, env = env)
+
+def parse_import_report(report):
+  # Lines look like "import time:       self [us] |  cumulative | imported package", with nested imports indented
+  modules = []
+  for line in report.splitlines():
+    if not line.startswith("import time:"):
+      continue
+    fields = line[len("import time:"):].split("|")
+    if len(fields) != 3 or not fields[1].strip().isdigit():
+      continue
+    modules.append((fields[2].strip(), int(fields[1])))
+
+  return sorted(modules, key = lambda module: module[1], reverse = True)
+
+if __name__ == "__main__":
+  main()
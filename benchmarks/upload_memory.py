@@ -0,0 +1,208 @@
+"""
+Measures the peak memory used by a map upload of a full batch of maximum-size files, through the whole request path.
+
+Each scenario uploads MAP_UPLOAD_MAX_NUMBER_OF_FILES valid maps, padded with an extra byte array so that each file is:
+
+  incompressible  As large as MAP_UPLOAD_MAX_FILE_SIZE, padded with random bytes
+  expanding       Small, but padded with zeros to decompress to MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE
+  bomb            As large as MAP_UPLOAD_MAX_FILE_SIZE, padded with zeros to decompress to about 1000 times that size
+
+Every scenario runs in a fresh process against a scratch instance directory. The peak resident set size (RSS) of the
+batch is measured from the process's RSS just before the upload, and the peak of Python's own allocations is
+measured separately with tracemalloc.
+
+Usage: python -m benchmarks.upload_memory [--scenarios NAME,...]
+"""
+
+from benchmarks.common import get_app, read_map_test_data_file, MAP_TEST_DATA_DIR
+
+from io import BytesIO
+from werkzeug.datastructures import MultiDict
+
+import argparse
+import gc
+import json
+import modes
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import zlib
+
+SCENARIOS = ["incompressible", "expanding", "bomb"]
+
+# Map IDs of the uploaded files, within the upload range allowed by the fixture idcounts.dat (last map ID 2000)
+FIRST_MAP_ID = 1500
+
+# Ratio that runs of zeros are compressed by with gzip
+ZERO_COMPRESSION_RATIO = 1000
+
+PADDING_TAG_NAME = b"padding"
+GENERATE_CHUNK_SIZE = 1024 * 1024
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--scenarios", default = ",".join(SCENARIOS), help = "Scenarios to run (default: {})".format(",".join(SCENARIOS)))
+  parser.add_argument("--run-scenario", help = argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run_scenario:
+    print(json.dumps(run_scenario(args.run_scenario)))
+    return
+
+  print("{:16} {:>7} {:>16} {:>18} {:>9} {:>14} {:>14}".format("Scenario", "Files", "Compressed/file", "Uncompressed/file", "Accepted", "Peak RSS", "Python peak"))
+
+  for scenario in args.scenarios.split(","):
+    with tempfile.TemporaryDirectory(prefix = "mrt-file-server-upload-memory-") as instance_dir:
+      prepare_scratch_instance(instance_dir)
+      env = dict(os.environ, **{ modes.INSTANCE_PATH_ENVIRONMENT_VARIABLE: instance_dir, modes.ENVIRONMENT_VARIABLE: modes.TEST })
+      output = subprocess.run([sys.executable, "-m", "benchmarks.upload_memory", "--run-scenario", scenario], env = env, capture_output = True, text = True, check = True).stdout
+      result = json.loads(output.splitlines()[-1])
+
+    print("{:16} {:>7} {:>16} {:>18} {:>9} {:>14} {:>14}".format(
+      scenario, result["files"], format_size(result["compressed_size"]), format_size(result["uncompressed_size"]),
+      result["accepted"], format_size(result["peak_rss_growth"]), format_size(result["python_peak"])))
+
+def prepare_scratch_instance(instance_dir):
+  mode_dir = os.path.join(instance_dir, modes.TEST)
+  map_downloads_dir = os.path.join(mode_dir, "downloads", "maps")
+  os.makedirs(map_downloads_dir)
+  os.makedirs(os.path.join(mode_dir, "uploads", "maps"))
+
+  with open(os.path.join(mode_dir, "config.py"), "w") as file:
+    file.write("SECRET_KEY = \"upload-memory\"\n")
+
+  shutil.copyfile(os.path.join(MAP_TEST_DATA_DIR, "idcounts.dat"), os.path.join(map_downloads_dir, "idcounts.dat"))
+
+def run_scenario(scenario):
+  app = get_app()
+  app.testing = True
+  client = app.test_client()
+  uploads_dir = app.config["MAP_UPLOADS_DIR"]
+  number_of_files = app.config["MAP_UPLOAD_MAX_NUMBER_OF_FILES"]
+
+  map_buffer, uncompressed_size = create_padded_map_buffer(scenario, app.config["MAP_UPLOAD_MAX_FILE_SIZE"], app.config["MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE"])
+  filenames = ["map_{}.dat".format(FIRST_MAP_ID + index) for index in range(number_of_files)]
+
+  def upload_batch():
+    data = MultiDict([("userName", "benchmark")] + [("map", (BytesIO(map_buffer), filename)) for filename in filenames])
+    response = client.post("/map/upload", content_type = "multipart/form-data", data = data)
+    accepted = sum(os.path.isfile(os.path.join(uploads_dir, filename)) for filename in filenames)
+    for filename in filenames:
+      if os.path.isfile(os.path.join(uploads_dir, filename)):
+        os.remove(os.path.join(uploads_dir, filename))
+    return accepted
+
+  # The first request imports and initializes everything that a request uses
+  client.get("/map/upload")
+  gc.collect()
+
+  reset_peak_rss()
+  rss_before = get_current_rss()
+  accepted = upload_batch()
+  peak_rss_growth = max(0, get_peak_rss() - rss_before)
+
+  gc.collect()
+  tracemalloc.start()
+  upload_batch()
+  python_peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return {
+    "files": number_of_files,
+    "compressed_size": len(map_buffer),
+    "uncompressed_size": uncompressed_size,
+    "accepted": accepted,
+    "peak_rss_growth": peak_rss_growth,
+    "python_peak": python_peak
+  }
+
+def create_padded_map_buffer(scenario, max_file_size, max_uncompressed_size):
+  # Returns the compressed map and its uncompressed size. Room is left for the multipart headers of each file.
+  target_file_size = max_file_size - 1024
+
+  if scenario == "incompressible":
+    padding_size = target_file_size - len(read_map_test_data_file("map_1500.dat")) - 1024
+    rng = random.Random(0)
+    return compress_padded_map(padding_size, lambda size: rng.randbytes(size))
+  elif scenario == "expanding":
+    padding_size = max_uncompressed_size - len(create_map_prefix_and_suffix(0)[0]) - len(create_map_prefix_and_suffix(0)[1])
+    return compress_padded_map(padding_size, bytes)
+  elif scenario == "bomb":
+    padding_size = target_file_size * ZERO_COMPRESSION_RATIO
+    return compress_padded_map(padding_size, bytes)
+
+  raise ValueError("Unknown scenario: {}".format(scenario))
+
+def compress_padded_map(padding_size, create_padding):
+  # The padding is compressed a chunk at a time, so even the largest map is never in memory uncompressed
+  prefix, suffix = create_map_prefix_and_suffix(padding_size)
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  chunks = [compressor.compress(prefix)]
+
+  remaining_size = padding_size
+  while remaining_size:
+    chunk_size = min(GENERATE_CHUNK_SIZE, remaining_size)
+    chunks.append(compressor.compress(create_padding(chunk_size)))
+    remaining_size -= chunk_size
+
+  chunks.append(compressor.compress(suffix))
+  chunks.append(compressor.flush())
+  return b"".join(chunks), len(prefix) + padding_size + len(suffix)
+
+def create_map_prefix_and_suffix(padding_size):
+  # The uncompressed fixture map with an empty byte array added to its data compound, split where the array's payload goes
+  from mrt_file_server.utils.nbt_utils import decompress_nbt_buffer, scan_nbt_buffer
+
+  uncompressed_buffer = decompress_nbt_buffer(read_map_test_data_file("map_1500.dat"))
+  data_end_offset = get_data_compound_end_offset(uncompressed_buffer, scan_nbt_buffer)
+  padding_header = b"\x07" + len(PADDING_TAG_NAME).to_bytes(2, "big") + PADDING_TAG_NAME + padding_size.to_bytes(4, "big")
+
+  return uncompressed_buffer[:data_end_offset] + padding_header, uncompressed_buffer[data_end_offset:]
+
+def get_data_compound_end_offset(uncompressed_buffer, scan_nbt_buffer):
+  # The data compound is the last tag of fixture maps, so it ends just before the end of the root compound
+  assert uncompressed_buffer[-2:] == b"\x00\x00"
+  assert "data/colors" in scan_nbt_buffer(uncompressed_buffer, ["data/colors"])
+  return len(uncompressed_buffer) - 2
+
+def reset_peak_rss():
+  # On Linux, the peak RSS can be reset to the current RSS, so that earlier peaks such as creating the files do not hide the batch's peak
+  try:
+    with open("/proc/self/clear_refs", "w") as file:
+      file.write("5")
+  except OSError:
+    pass
+
+def get_current_rss():
+  return read_proc_status_size("VmRSS")
+
+def get_peak_rss():
+  peak_rss = read_proc_status_size("VmHWM")
+  if peak_rss is None:
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+  return peak_rss
+
+def read_proc_status_size(field):
+  # Returns the size in bytes of a field of /proc/self/status, or 0 for the current RSS where there is no /proc
+  try:
+    with open("/proc/self/status") as file:
+      for line in file:
+        if line.startswith(field + ":"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  return None if field == "VmHWM" else 0
+
+def format_size(size):
+  if size >= 1024 * 1024:
+    return "{:.1f} MB".format(size / (1024 * 1024))
+  return "{:.1f} KB".format(size / 1024)
+
+if __name__ == "__main__":
+  main()
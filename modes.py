@@ -1,5 +1,8 @@
 ENVIRONMENT_VARIABLE = "MRT_FILE_SERVER_MODE"
 
+# Optional absolute path of the instance directory, used instead of the instance directory in the project root
+INSTANCE_PATH_ENVIRONMENT_VARIABLE = "MRT_FILE_SERVER_INSTANCE_PATH"
+
 DEVELOPMENT = "development"
 TEST = "test"
 PRODUCTION = "production"
\ No newline at end of file
@@ -1,22 +1,85 @@
-from flask import Flask, render_template, request
-from flask_uploads import UploadSet, configure_uploads
+from flask import Flask, current_app, render_template
 from flask_basicauth import BasicAuth
 
-from mrt_file_server.request_log_adapter import RequestLogAdapter
-
+from mrt_file_server.log_queue import BatchedRotatingFileHandler, create_log_queue
+from mrt_file_server.map_catalog import MapCatalog
+from mrt_file_server.map_preparation import MapPreparationPool
+from mrt_file_server.metrics import MetricsSpool, registry as metrics_registry
+from mrt_file_server.utils.cache_utils import LRUCache
+from mrt_file_server.schematic_index import SchematicIndex
+from mrt_file_server.schematic_storage import SchematicBlobStore
+from mrt_file_server.upload_jobs import UploadJobQueue
+from mrt_file_server.upload_request import UploadRequest
+
+import atexit
 import logging
 import modes
 import os
+import time
+
+logger = logging.getLogger(__name__)
 
 class FlashMessage:
   def __init__(self, message, category):
     self.message = message
     self.category = category
 
+class AppState:
+  """Objects shared by every request of one application, created by create_app."""
+
+  def __init__(self, map_catalog, map_preparation_pool, metrics_spool, upload_job_queue, schematic_blob_store, schematic_index, map_preview_cache):
+    self.map_catalog = map_catalog
+    self.map_preparation_pool = map_preparation_pool
+    self.metrics_spool = metrics_spool
+    self.upload_job_queue = upload_job_queue
+    self.schematic_blob_store = schematic_blob_store
+    self.schematic_index = schematic_index
+    self.map_preview_cache = map_preview_cache
+
+def get_app_state():
+  return current_app.extensions["mrt_file_server"]
+
+def create_app(mode = None):
+  """
+  Create and configure the application for the given mode, or for the mode in the MRT_FILE_SERVER_MODE environment variable.
+  Modules only needed by some requests, such as the NumPy map preview renderer, are imported when they are first used.
+  """
+  start = time.perf_counter()
+  mode = mode or os.environ.get(modes.ENVIRONMENT_VARIABLE, modes.DEVELOPMENT)
+
+  app = Flask(__name__, instance_path = get_instance_path(), instance_relative_config = True)
+  app.request_class = UploadRequest
+  app.config.from_object("mrt_file_server.default_config")
+
+  load_environment_config(app, mode)
+  configure_logger(app, mode)
+  configure_log_messages(app)
+  configure_flash_messages(app)
+  configure_instance_folders(app, mode)
+
+  app.extensions["mrt_file_server"] = AppState(
+    configure_map_catalog(app),
+    configure_map_preparation_pool(app),
+    configure_metrics(app),
+    configure_upload_job_queue(app),
+    SchematicBlobStore(app.config["SCHEMATIC_BLOBS_DIR"]),
+    SchematicIndex(app.config["SCHEMATIC_DOWNLOADS_DIR"]),
+    LRUCache(app.config["MAP_PREVIEW_CACHE_SIZE"]))
+
+  BasicAuth(app)
+  register_blueprints(app)
+  register_commands(app)
+
+  logger.info("Application ready in %.0f ms.", (time.perf_counter() - start) * 1000)
+  return app
+
 def configure_logger(app, mode):
-  logger = logging.getLogger(__name__)
+  # Handlers of an application created earlier in this process are replaced
+  for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+    handler.close()
 
-  if mode is modes.PRODUCTION:
+  if mode == modes.PRODUCTION:
     logger.setLevel(logging.INFO)
   else:
     logger.setLevel(logging.DEBUG)
@@ -26,20 +89,48 @@ def configure_logger(app, mode):
     datefmt = "%y-%m-%d %H:%M",
     style = "{")
 
-  log_file_path = prepare_log_file(app, mode)
-  file_handler = logging.FileHandler(log_file_path)
-  file_handler.setFormatter(formatter)
-  logger.addHandler(file_handler)
+  # Each process would rotate the shared log file on its own, losing records or writing them to a rotated file,
+  # so rotation is only done by a single process
+  max_bytes = app.config["LOG_FILE_MAX_BYTES"]
+  worker_process_count = get_worker_process_count()
+  if worker_process_count > 1:
+    max_bytes = 0
 
-  if mode is not modes.TEST:
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+  log_file_path = prepare_log_file(app, mode)
+  file_handler = BatchedRotatingFileHandler(log_file_path,
+    maxBytes = max_bytes,
+    backupCount = app.config["LOG_FILE_BACKUP_COUNT"])
+  handlers = [file_handler]
+
+  if mode != modes.TEST:
+    handlers.append(logging.StreamHandler())
+
+  for handler in handlers:
+    handler.setFormatter(formatter)
+
+  # In queue mode, requests only put records on a queue, and a background thread writes them to the log file in batches
+  if app.config["LOG_QUEUE_ENABLED"]:
+    # The listener is stopped when the queue handler is replaced by another application, or when the process exits
+    queue_handler = create_log_queue(handlers, app.config["LOG_QUEUE_BATCH_SIZE"])[0]
+    logger.addHandler(queue_handler)
+  else:
+    for handler in handlers:
+      logger.addHandler(handler)
 
   logger.info("Logging configured.")
   logger.info("Application mode is set to: '%s'", mode)
+  logger.info("Environment config loaded from: '%s'", get_environment_config_file_path(mode))
 
-  return logger
+  if max_bytes != app.config["LOG_FILE_MAX_BYTES"]:
+    logger.warning("LOG_FILE_MAX_BYTES is ignored, since %d worker processes write to the same log file. Rotate it with an external tool instead.", worker_process_count)
+
+def get_worker_process_count():
+  # The number of uWSGI worker processes, or 1 if the application is not running in uWSGI
+  try:
+    import uwsgi
+  except ImportError:
+    return 1
+  return uwsgi.numproc
 
 def prepare_log_file(app, mode):
   instance_path = app.instance_path
@@ -61,6 +152,7 @@ def configure_log_messages(app):
     "SCHEMATIC_UPLOAD_FILE_EXISTS":                         "Schematic upload failed. File already exists: '%s' (Username: '%s')",
     "SCHEMATIC_UPLOAD_FILENAME_WHITESPACE":                 "Schematic upload failed. Filename contains whitespace: '%s' (Username: '%s')",
     "SCHEMATIC_UPLOAD_FILENAME_EXTENSION":                  "Schematic upload failed. Filename has invalid extension: '%s' (Username: '%s')",
+    "SCHEMATIC_UPLOAD_QUEUED":                              "Schematic upload queued: job '%s', %d file(s) (Username: '%s')",
 
     "SCHEMATIC_DOWNLOAD_SUCCESS":                           "Schematic download initiated: '%s'",
     "SCHEMATIC_DOWNLOAD_LINK_CREATION_SUCCESS":             "Schematic download link created: '%s'",
@@ -71,6 +163,7 @@ def configure_log_messages(app):
 
     "MAP_UPLOAD_SUCCESS":                                   "Map upload successful: '%s' (Username: '%s')",
     "MAP_UPLOAD_FAILURE":                                   "Map upload failed: '%s' (Username: '%s', Exception: '%s')",
+    "MAP_UPLOAD_PREPARATION_FAILURE":                       "Map preparation worker failed, preparing in the request instead: '%s' (Username: '%s', Exception: '%s')",
     "MAP_UPLOAD_USERNAME_EMPTY":                            "Map upload failed. Username is empty.",
     "MAP_UPLOAD_USERNAME_WHITESPACE":                       "Map upload failed. Username contains whitespace: '%s'",
     "MAP_UPLOAD_NO_FILES":                                  "Map upload failed. No files specified. (Username: '%s')",
@@ -81,9 +174,13 @@ def configure_log_messages(app):
     "MAP_UPLOAD_MAP_FORMAT_INVALID":                        "Map upload failed. File is not a valid map format: '%s' (Username: '%s')",
     "MAP_UPLOAD_EXISTING_MAP_LOCKED":                       "Map upload failed. Existing map file is locked. '%s' (Username: '%s')",
     "MAP_UPLOAD_MAP_ALREADY_UPLOADED":                      "Map upload failed. Map already uploaded. '%s' (Username: '%s')",
+    "MAP_UPLOAD_QUEUED":                                    "Map upload queued: job '%s', %d file(s) (Username: '%s')",
 
     "MAP_DOWNLOAD_SUCCESS":                                 "Map download initiated: '%s'",
     "MAP_DOWNLOAD_FORBIDDEN":                               "Map download forbidden: '%s'",
+    "MAP_DOWNLOAD_RANGE_SUCCESS":                           "Map range download initiated: '%s'",
+    "MAP_DOWNLOAD_RANGE_INVALID":                           "Map range download failed. Map ID range is invalid: '%s' to '%s'",
+    "MAP_DOWNLOAD_RANGE_NOT_FOUND":                         "Map range download failed. No map files exist in range: '%s' to '%s'",
     "MAP_DOWNLOAD_LINK_CREATION_SUCCESS":                   "Map download link created: '%s'",
     "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_EMPTY":              "Map download link creation failed. Map ID is empty.",
     "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_INVALID":            "Map download link creation failed. Map ID is invalid: '%s'",
@@ -110,6 +207,7 @@ def configure_flash_messages(app):
     "SCHEMATIC_UPLOAD_FILE_EXISTS":                         FlashMessage("Upload Failed! File with same name already exists on the server.", "failure"),
     "SCHEMATIC_UPLOAD_FILENAME_WHITESPACE":                 FlashMessage("Upload Failed! File name must not contain spaces.", "failure"),
     "SCHEMATIC_UPLOAD_FILENAME_EXTENSION":                  FlashMessage("Upload Failed! File must end with the .schematic or .schem extension.", "failure"),
+    "SCHEMATIC_UPLOAD_QUEUED":                              FlashMessage("Upload Queued! <a href=\"{}\">Click here to see the results of the upload.</a>", "success"),
 
     "SCHEMATIC_DOWNLOAD_LINK_CREATION_SUCCESS":             FlashMessage("Download Link Creation Successful! <a href=\"download/{}\">Click here to begin download.</a>", "success"),
     "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_EMPTY":      FlashMessage("Download Link Creation Failed! Filename must not be empty.", "failure"),
@@ -132,6 +230,7 @@ def configure_flash_messages(app):
     "MAP_UPLOAD_MAP_FORMAT_INVALID":                        FlashMessage("Upload Failed! File is not a valid map format.", "failure"),
     "MAP_UPLOAD_EXISTING_MAP_LOCKED":                       FlashMessage("Upload Failed! Existing map file is locked. Contact an admin for assistance.", "failure"),
     "MAP_UPLOAD_MAP_ALREADY_UPLOADED":                      FlashMessage("Upload Failed! Map file has already been uploaded.", "failure"),
+    "MAP_UPLOAD_QUEUED":                                    FlashMessage("Upload Queued! <a href=\"{}\">Click here to see the results of the upload.</a>", "success"),
 
     "MAP_DOWNLOAD_LINK_CREATION_SUCCESS":                   FlashMessage("Download Link Creation Successful! <a href=\"download/{}\">Click here to begin download.</a>", "success"),
     "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_EMPTY":              FlashMessage("Download Link Creation Failed! Map ID is empty.", "failure"),
@@ -144,9 +243,11 @@ def configure_flash_messages(app):
   logger.info("Flash messages configured.")
 
 def load_environment_config(app, mode):
-  Instance_relative_config_file_path = os.path.join(mode, "config.py")
-  app.config.from_pyfile(Instance_relative_config_file_path)
-  logger.info("Environment config loaded from: '%s'", Instance_relative_config_file_path)
+  # Loaded before the logger is configured, so that the environment config can change the logging settings
+  app.config.from_pyfile(get_environment_config_file_path(mode))
+
+def get_environment_config_file_path(mode):
+  return os.path.join(mode, "config.py")
 
 def configure_instance_folders(app, mode):
   instance_path = os.path.realpath(app.instance_path)
@@ -159,70 +260,111 @@ def configure_instance_folders(app, mode):
 
   uploads_dir = os.path.join(mode_dir, "uploads")
   schematic_uploads_dir = os.path.join(uploads_dir, "schematics")
+  schematic_blobs_dir = os.path.join(uploads_dir, "schematic_blobs")
   map_uploads_dir = os.path.join(uploads_dir, "maps")
 
+  cache_dir = os.path.join(mode_dir, "cache")
+  map_preview_cache_dir = os.path.join(cache_dir, "map_previews")
+
+  metrics_spool_dir = os.path.join(mode_dir, "metrics")
+  upload_job_spool_dir = os.path.join(mode_dir, "upload_jobs")
+  locks_dir = os.path.join(mode_dir, "locks")
+
   os.makedirs(world_downloads_dir, exist_ok = True)
   os.makedirs(schematic_downloads_dir, exist_ok = True)
   os.makedirs(schematic_uploads_dir, exist_ok = True)
-
-  set_config_variable("DOWNLOADS_DIR", downloads_dir)
-  set_config_variable("WORLD_DOWNLOADS_DIR", world_downloads_dir)
-  set_config_variable("SCHEMATIC_DOWNLOADS_DIR", schematic_downloads_dir)
-  set_config_variable("MAP_DOWNLOADS_DIR", map_downloads_dir)
-
-  set_config_variable("UPLOADS_DIR", uploads_dir)
-  set_config_variable("SCHEMATIC_UPLOADS_DIR", schematic_uploads_dir)
-  set_config_variable("MAP_UPLOADS_DIR", map_uploads_dir)
-
-  # Used by Flask-Uploads to determine where to upload files
-  set_config_variable("UPLOADED_SCHEMATICS_DEST", schematic_uploads_dir)
-  set_config_variable("UPLOADED_MAPS_DEST", map_uploads_dir)
-
-def set_config_variable(name, value):
+  os.makedirs(map_uploads_dir, exist_ok = True)
+  os.makedirs(map_preview_cache_dir, exist_ok = True)
+  os.makedirs(metrics_spool_dir, exist_ok = True)
+  os.makedirs(upload_job_spool_dir, exist_ok = True)
+  os.makedirs(locks_dir, exist_ok = True)
+
+  set_config_variable(app, "DOWNLOADS_DIR", downloads_dir)
+  set_config_variable(app, "WORLD_DOWNLOADS_DIR", world_downloads_dir)
+  set_config_variable(app, "SCHEMATIC_DOWNLOADS_DIR", schematic_downloads_dir)
+  set_config_variable(app, "MAP_DOWNLOADS_DIR", map_downloads_dir)
+
+  set_config_variable(app, "UPLOADS_DIR", uploads_dir)
+  set_config_variable(app, "SCHEMATIC_UPLOADS_DIR", schematic_uploads_dir)
+  set_config_variable(app, "SCHEMATIC_BLOBS_DIR", schematic_blobs_dir)
+  set_config_variable(app, "MAP_UPLOADS_DIR", map_uploads_dir)
+
+  set_config_variable(app, "CACHE_DIR", cache_dir)
+  set_config_variable(app, "MAP_PREVIEW_CACHE_DIR", map_preview_cache_dir)
+
+  set_config_variable(app, "METRICS_SPOOL_DIR", metrics_spool_dir)
+  set_config_variable(app, "UPLOAD_JOB_SPOOL_DIR", upload_job_spool_dir)
+  set_config_variable(app, "LOCKS_DIR", locks_dir)
+
+  set_config_variable(app, "MAP_CATALOG_FILE", os.path.join(mode_dir, "map_catalog.sqlite3"))
+  set_config_variable(app, "MAP_PROMOTION_MANIFEST_FILE", os.path.join(mode_dir, "map_promotion.json"))
+  set_config_variable(app, "UPLOAD_JOB_DATABASE_FILE", os.path.join(mode_dir, "upload_jobs.sqlite3"))
+
+def set_config_variable(app, name, value):
   app.config[name] = value
   logger.info("Config variable '%s' set to: '%s'", name, value)
 
-def configure_schematic_uploads(app):
-  schematics = UploadSet("schematics", extensions = ["schematic", "schem"])
-  configure_uploads(app, schematics)
-  logger.info("Schematic uploads configured.")
-  return schematics
-
-def configure_map_uploads(app):
-  maps = UploadSet("maps", extensions = ["dat"])
-  configure_uploads(app, maps)
-  logger.info("Map uploads configured.")
-  return maps
-
-app = Flask(__name__, instance_relative_config = True)
-app.config.from_object("mrt_file_server.default_config")
-
-mode = os.environ.get(modes.ENVIRONMENT_VARIABLE, modes.DEVELOPMENT)
+def configure_map_catalog(app):
+  # The catalog is not synced here, since scanning every map would delay each new worker. The map status API
+  # syncs it when first used, and single maps are refreshed from their files as they are looked up.
+  map_catalog = MapCatalog(app.config["MAP_CATALOG_FILE"], app.config["MAP_DOWNLOADS_DIR"])
+  logger.info("Map catalog opened: %d maps catalogued as of the last sync.", map_catalog.count())
+  return map_catalog
+
+def configure_map_preparation_pool(app):
+  # The worker processes are only started by the first map upload that uses them
+  map_preparation_pool = MapPreparationPool(app.config["MAP_UPLOAD_PROCESS_POOL_WORKERS"])
+  atexit.register(map_preparation_pool.shutdown)
+  return map_preparation_pool
+
+def configure_metrics(app):
+  metrics_spool = MetricsSpool(app.config["METRICS_SPOOL_DIR"], metrics_registry, app.config["METRICS_SPOOL_INTERVAL"])
+  metrics_spool.remove_stale_files()
+  logger.info("Metrics configured.")
+  return metrics_spool
+
+def configure_upload_job_queue(app):
+  upload_job_queue = UploadJobQueue(app,
+    app.config["UPLOAD_JOB_DATABASE_FILE"],
+    app.config["UPLOAD_JOB_SPOOL_DIR"],
+    app.config["UPLOAD_JOB_WORKERS"],
+    app.config["UPLOAD_JOB_RETENTION"])
+  logger.info("Upload job queue configured.")
+  return upload_job_queue
+
+def register_blueprints(app):
+  from .blueprints import schematic
+  from .blueprints import map
+  from .blueprints import world
+  from .blueprints import metrics
+  from .blueprints import jobs
+  from .blueprints import api
+
+  app.add_url_rule("/", "index", index)
+
+  app.register_blueprint(schematic.schematic_blueprint)
+  app.register_blueprint(map.map_blueprint)
+  app.register_blueprint(world.world_blueprint)
+  app.register_blueprint(metrics.metrics_blueprint)
+  app.register_blueprint(api.api_blueprint)
+
+  # Upload jobs only exist if uploads are queued
+  if app.config["UPLOAD_JOB_QUEUE_ENABLED"]:
+    app.register_blueprint(jobs.jobs_blueprint)
+
+  upload_job_queue = app.extensions["mrt_file_server"].upload_job_queue
+  upload_job_queue.register_processor("map", map.upload_single_map)
+  upload_job_queue.register_processor("schematic", schematic.upload_single_schematic)
+
+def register_commands(app):
+  from . import commands
+
+  app.cli.add_command(commands.schematic_cli)
+  app.cli.add_command(commands.map_cli)
 
-logger = configure_logger(app, mode)
-log_adapter = RequestLogAdapter(logger, request)
-configure_log_messages(app)
-configure_flash_messages(app)
-load_environment_config(app, mode)
-configure_instance_folders(app, mode)
-schematics = configure_schematic_uploads(app)
-maps = configure_map_uploads(app)
-
-basic_auth = BasicAuth(app)
-
-@app.route("/")
 def index():
   return render_template("index.html", home = True)
 
-from .blueprints import schematic
-from .blueprints import map
-from .blueprints import world
-
-app.register_blueprint(schematic.schematic_blueprint)
-app.register_blueprint(map.map_blueprint)
-app.register_blueprint(world.world_blueprint)
-
-if __name__ == "__main__":
-  app.run()
-
-logger.info("Application ready.")
\ No newline at end of file
+def get_instance_path():
+  instance_path = os.environ.get(modes.INSTANCE_PATH_ENVIRONMENT_VARIABLE)
+  return os.path.realpath(instance_path) if instance_path else None
@@ -0,0 +1,48 @@
+from flask import Blueprint, current_app, jsonify, request
+
+from mrt_file_server import get_app_state
+from mrt_file_server.blueprints.map import get_last_map_id
+from mrt_file_server.utils.map_utils import parse_map_id_ranges
+
+api_blueprint = Blueprint("api", __name__, url_prefix="/api")
+
+@api_blueprint.route("/maps/status", methods = ["GET", "POST"])
+def get_maps_status():
+  """
+  Existence, lock state, size and upload eligibility of many maps at once, for bots and other tools.
+  Map IDs and inclusive ranges are given as ?ids=1500,2000-2099, or as a POST body of {"ids": [1500, "2000-2099"]}.
+  """
+  if request.method == "POST":
+    body = request.get_json(silent = True)
+    ids = body.get("ids") if isinstance(body, dict) else None
+  else:
+    ids = request.args.get("ids", "").split(",") if request.args.get("ids") else None
+
+  if not isinstance(ids, list) or not ids:
+    return jsonify(error = "No map IDs were requested."), 400
+
+  try:
+    map_ids = parse_map_id_ranges(ids, current_app.config["MAP_STATUS_MAX_NUMBER_OF_MAPS"])
+  except ValueError as e:
+    return jsonify(error = str(e)), 400
+
+  # Answered from the map catalog, which is only brought up to date when the map directory has changed or the catalog is old
+  map_catalog = get_app_state().map_catalog
+  map_catalog.sync_if_stale(current_app.config["MAP_CATALOG_MAX_AGE"])
+  entries = map_catalog.get_many(map_ids)
+
+  last_map_id = get_last_map_id()
+  lowest_uploadable_map_id = last_map_id - current_app.config["MAP_UPLOAD_LAST_ALLOWED_ID_RANGE"] + 1
+
+  maps = []
+  for map_id in map_ids:
+    entry = entries.get(map_id)
+    maps.append({
+      "id": map_id,
+      "exists": entry is not None,
+      "locked": entry.locked == 1 if entry is not None else None,
+      "size": entry.size if entry is not None else None,
+      "inUploadableRange": lowest_uploadable_map_id <= map_id <= last_map_id
+    })
+
+  return jsonify(lastMapId = last_map_id, uploadableRange = { "from": max(lowest_uploadable_map_id, 0), "to": last_map_id }, maps = maps)
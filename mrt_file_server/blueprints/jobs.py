@@ -0,0 +1,16 @@
+from flask import Blueprint, abort, jsonify
+
+from mrt_file_server import get_app_state
+
+jobs_blueprint = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+@jobs_blueprint.route("/<job_id>")
+def route_upload_job(job_id):
+  job = get_app_state().upload_job_queue.get(job_id)
+
+  if job is None:
+    abort(404)
+
+  response = jsonify(job)
+  response.headers["Cache-Control"] = "no-store"
+  return response
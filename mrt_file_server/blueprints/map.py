@@ -1,99 +1,168 @@
-from flask import Blueprint, abort, render_template, request, send_from_directory
+from flask import Blueprint, Response, abort, current_app, render_template, request, url_for
 from werkzeug.utils import secure_filename
 
-from mrt_file_server import app, maps
-from mrt_file_server.utils.file_utils import get_filesize, file_exists_in_dir
-from mrt_file_server.utils.flash_utils import flash_by_key
+from mrt_file_server import get_app_state
+from mrt_file_server.metrics import timed
+from mrt_file_server.utils.cache_utils import FileStatCache
+from mrt_file_server.utils.download_utils import send_download
+from mrt_file_server.utils.file_utils import get_filesize, lock_name, open_atomic_file, open_exclusive_file, read_file
+from mrt_file_server.utils.flash_utils import flash_by_key, flash_formatted_by_key
 from mrt_file_server.utils.log_utils import log_info, log_warn, log_error
+from mrt_file_server.utils.map_utils import get_file_map_id, get_map_filename, prepare_map_buffer, prepare_map_stream
 from mrt_file_server.utils.string_utils import str_contains_whitespace
-from mrt_file_server.utils.nbt_utils import load_compressed_nbt_file, load_compressed_nbt_buffer, save_compressed_nbt_file, get_nbt_map_value, set_nbt_map_byte_value
+from mrt_file_server.utils.zip_utils import generate_stored_zip
+from mrt_file_server.utils.nbt_utils import decompress_nbt_buffer, scan_compressed_nbt_file, scan_nbt_buffer
 
+from concurrent.futures.process import BrokenProcessPool
+
+import glob
 import os
-import re
 
 map_blueprint = Blueprint("map", __name__, url_prefix="/map")
 
-@app.route("/map/upload", methods = ["GET", "POST"])
+@map_blueprint.route("/upload", methods = ["GET", "POST"])
 def route_map_upload():
+  job_id = None
+
   if request.method == "POST":
-    upload_maps()
+    job_id = upload_maps()
 
-  last_allowed_id_range = app.config["MAP_UPLOAD_LAST_ALLOWED_ID_RANGE"]
+  last_allowed_id_range = current_app.config["MAP_UPLOAD_LAST_ALLOWED_ID_RANGE"]
   last_map_id = get_last_map_id()
 
-  return render_template("map/upload/index.html", home = False, last_allowed_id_range = last_allowed_id_range, last_map_id = last_map_id)
+  page = render_template("map/upload/index.html", home = False, last_allowed_id_range = last_allowed_id_range, last_map_id = last_map_id)
+
+  # A queued upload has not been processed yet, and its results are at the location of the job
+  if job_id is not None:
+    return page, 202, { "Location": url_for("jobs.route_upload_job", job_id = job_id) }
+  return page
 
 def upload_maps():
   username = request.form["userName"] if "userName" in request.form else None
 
   if username == None or username == "":
-    flash_by_key(app, "MAP_UPLOAD_USERNAME_EMPTY")
+    flash_by_key(current_app, "MAP_UPLOAD_USERNAME_EMPTY")
     log_warn("MAP_UPLOAD_USERNAME_EMPTY")
   elif str_contains_whitespace(request.form["userName"]):
-    flash_by_key(app, "MAP_UPLOAD_USERNAME_WHITESPACE")
+    flash_by_key(current_app, "MAP_UPLOAD_USERNAME_WHITESPACE")
     log_warn("MAP_UPLOAD_USERNAME_WHITESPACE", username)
   elif "map" not in request.files:
-    flash_by_key(app, "MAP_UPLOAD_NO_FILES")
+    flash_by_key(current_app, "MAP_UPLOAD_NO_FILES")
     log_warn("MAP_UPLOAD_NO_FILES", username)
   else:
     files = request.files.getlist("map")
 
-    if len(files) > app.config["MAP_UPLOAD_MAX_NUMBER_OF_FILES"]:
-      flash_by_key(app, "MAP_UPLOAD_TOO_MANY_FILES")
+    if len(files) > current_app.config["MAP_UPLOAD_MAX_NUMBER_OF_FILES"]:
+      flash_by_key(current_app, "MAP_UPLOAD_TOO_MANY_FILES")
       log_warn("MAP_UPLOAD_TOO_MANY_FILES", username)
+    elif current_app.config["UPLOAD_JOB_QUEUE_ENABLED"]:
+      job_id = get_app_state().upload_job_queue.submit("map", username, request.remote_addr, files)
+      flash_formatted_by_key(current_app, "MAP_UPLOAD_QUEUED", url_for("jobs.route_upload_job", job_id = job_id))
+      log_info("MAP_UPLOAD_QUEUED", job_id, len(files), username)
+      return job_id
     else:
-      for file in files:
-        upload_single_map(username, file)
+      map_futures = submit_map_preparations(username, files)
 
-def upload_single_map(username, file):
-  uploads_dir = app.config["MAP_UPLOADS_DIR"]
-  last_allowed_map_id_range = app.config["MAP_UPLOAD_LAST_ALLOWED_ID_RANGE"]
+      # Results are consumed in the original file order, so flash messages and logs are the same as a serial upload
+      for file, map_future in zip(files, map_futures):
+        upload_single_map(username, file, map_future)
+
+def upload_single_map(username, file, map_future = None):
+  uploads_dir = current_app.config["MAP_UPLOADS_DIR"]
+  last_allowed_map_id_range = current_app.config["MAP_UPLOAD_LAST_ALLOWED_ID_RANGE"]
   last_map_id = get_last_map_id()
   file_map_id = get_file_map_id(file.filename)
 
   if file_map_id is None:
-    flash_by_key(app, "MAP_UPLOAD_FILENAME_INVALID", file.filename)
+    flash_by_key(current_app, "MAP_UPLOAD_FILENAME_INVALID", file.filename)
     log_warn("MAP_UPLOAD_FILENAME_INVALID", file.filename, username)
     return
   elif file_map_id <= (last_map_id - last_allowed_map_id_range) or file_map_id > last_map_id:
-    flash_by_key(app, "MAP_UPLOAD_MAP_ID_OUT_OF_RANGE", file.filename)
+    flash_by_key(current_app, "MAP_UPLOAD_MAP_ID_OUT_OF_RANGE", file.filename)
     log_warn("MAP_UPLOAD_MAP_ID_OUT_OF_RANGE", file.filename, username)
     return
 
   file.filename = secure_filename(file.filename)
   file_size = get_filesize(file)
 
-  if file_size > app.config["MAP_UPLOAD_MAX_FILE_SIZE"]:
-    flash_by_key(app, "MAP_UPLOAD_FILE_TOO_LARGE", file.filename)
+  if file_size > current_app.config["MAP_UPLOAD_MAX_FILE_SIZE"]:
+    flash_by_key(current_app, "MAP_UPLOAD_FILE_TOO_LARGE", file.filename)
     log_warn("MAP_UPLOAD_FILE_TOO_LARGE", file.filename, username)
-  elif is_invalid_map_format(file):
-    flash_by_key(app, "MAP_UPLOAD_MAP_FORMAT_INVALID", file.filename)
+    return
+
+  # The upload is decoded only once. The same NBT tree is validated and locked before it is written to disk.
+  with timed("prepare_map_buffer"):
+    map_buffer = get_prepared_map_buffer(username, file, map_future)
+
+  if map_buffer is None:
+    flash_by_key(current_app, "MAP_UPLOAD_MAP_FORMAT_INVALID", file.filename)
     log_warn("MAP_UPLOAD_MAP_FORMAT_INVALID", file.filename, username)
-  elif is_existing_map_file_locked(file.filename):
-    flash_by_key(app, "MAP_UPLOAD_EXISTING_MAP_LOCKED", file.filename)
-    log_warn("MAP_UPLOAD_EXISTING_MAP_LOCKED", file.filename, username)
-  elif is_map_already_uploaded(file.filename):
-    flash_by_key(app, "MAP_UPLOAD_MAP_ALREADY_UPLOADED", file.filename)
-    log_warn("MAP_UPLOAD_MAP_ALREADY_UPLOADED", file.filename, username)
-  else:
-    try:
-      existing_file_path = os.path.join(uploads_dir, file.filename)
+    return
 
-      # Upload the new map file
-      maps.save(file)
+  # Uploads of the same map by other threads and worker processes wait here, so only one of them can pass the checks and create the file
+  with lock_name(current_app.config["LOCKS_DIR"], "map", file.filename):
+    if is_existing_map_file_locked(file.filename):
+      flash_by_key(current_app, "MAP_UPLOAD_EXISTING_MAP_LOCKED", file.filename)
+      log_warn("MAP_UPLOAD_EXISTING_MAP_LOCKED", file.filename, username)
+    elif is_map_already_uploaded(file.filename):
+      flash_map_already_uploaded(username, file.filename)
+    else:
+      try:
+        # The map's locked tag is already set, so an unlocked copy never appears in the uploads directory
+        with timed("map_file_write"), open_exclusive_file(uploads_dir, file.filename) as uploaded_file:
+          uploaded_file.write(map_buffer)
+
+        message = flash_by_key(current_app, "MAP_UPLOAD_SUCCESS", file.filename)
+        log_info("MAP_UPLOAD_SUCCESS", file.filename, username)
+      except FileExistsError:
+        # Created by something other than an upload, such as a file copied in by an administrator
+        flash_map_already_uploaded(username, file.filename)
+      except Exception as e:
+        message = flash_by_key(current_app, "MAP_UPLOAD_FAILURE", file.filename)
+        log_info("MAP_UPLOAD_FAILURE", file.filename, username, e)
+
+def flash_map_already_uploaded(username, filename):
+  flash_by_key(current_app, "MAP_UPLOAD_MAP_ALREADY_UPLOADED", filename)
+  log_warn("MAP_UPLOAD_MAP_ALREADY_UPLOADED", filename, username)
+
+def submit_map_preparations(username, files):
+  map_preparation_pool = get_app_state().map_preparation_pool
+
+  if not map_preparation_pool.workers:
+    return [None] * len(files)
+
+  # Only submit files that will get as far as the map format check
+  map_futures = []
+  for file in files:
+    if get_file_map_id(file.filename) is not None and get_filesize(file) <= current_app.config["MAP_UPLOAD_MAX_FILE_SIZE"]:
+      try:
+        # Worker processes are sent the compressed bytes, which are at most MAP_UPLOAD_MAX_FILE_SIZE
+        map_futures.append(map_preparation_pool.submit(prepare_map_buffer, file.read(), current_app.config["MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE"]))
+      except BrokenProcessPool as e:
+        # The remaining files are prepared in the request thread, and the next upload starts a new pool
+        log_error("MAP_UPLOAD_PREPARATION_FAILURE", file.filename, username, e)
+        return map_futures + [None] * (len(files) - len(map_futures))
+    else:
+      map_futures.append(None)
 
-      # Lock the new map file
-      nbt_file = load_compressed_nbt_file(existing_file_path)
-      set_nbt_map_byte_value(nbt_file, "locked", 1)
-      save_compressed_nbt_file(nbt_file)
+  return map_futures
 
-      message = flash_by_key(app, "MAP_UPLOAD_SUCCESS", file.filename)
-      log_info("MAP_UPLOAD_SUCCESS", file.filename, username)
+def get_prepared_map_buffer(username, file, map_future):
+  if map_future is not None:
+    try:
+      return map_future.result()
+
+    # If the worker process failed, prepare the map in this process instead
     except Exception as e:
-      message = flash_by_key(app, "MAP_UPLOAD_FAILURE", file.filename)
-      log_info("MAP_UPLOAD_FAILURE", file.filename, username, e)
+      log_error("MAP_UPLOAD_PREPARATION_FAILURE", file.filename, username, e)
+      if isinstance(e, BrokenProcessPool):
+        get_app_state().map_preparation_pool.discard()
+
+  # The upload is decompressed straight from its stream, so the only full copy of the map in memory is the decompressed one
+  file.stream.seek(0)
+  return prepare_map_stream(file.stream, current_app.config["MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE"])
 
-@app.route("/map/download", methods = ["GET", "POST"])
+@map_blueprint.route("/download", methods = ["GET", "POST"])
 def route_map_download():
   response = False
 
@@ -105,34 +174,34 @@ def route_map_download():
 def create_map_download_link():
   map_id_as_str = request.form["mapId"]
   file_name = "map_{}.dat".format(map_id_as_str)
-  downloads_dir = app.config["MAP_DOWNLOADS_DIR"]
 
   if map_id_as_str == "":
-    flash_by_key(app, "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_EMPTY")
+    flash_by_key(current_app, "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_EMPTY")
     log_warn("MAP_DOWNLOAD_LINK_CREATION_MAP_ID_EMPTY")
     return
 
   map_id_as_int = parse_map_id_as_integer(map_id_as_str)
 
   if map_id_as_int is None:
-    flash_by_key(app, "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_INVALID", file_name)
+    flash_by_key(current_app, "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_INVALID", file_name)
     log_warn("MAP_DOWNLOAD_LINK_CREATION_MAP_ID_INVALID", file_name)
     return
 
   last_map_id = get_last_map_id()
 
   if map_id_as_int < 0 or map_id_as_int > last_map_id:
-    flash_by_key(app, "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_OUT_OF_RANGE", file_name)
+    flash_by_key(current_app, "MAP_DOWNLOAD_LINK_CREATION_MAP_ID_OUT_OF_RANGE", file_name)
     log_warn("MAP_DOWNLOAD_LINK_CREATION_MAP_ID_OUT_OF_RANGE", file_name)
     return
 
   secure_file_name = secure_filename(file_name)
 
-  if file_exists_in_dir(downloads_dir, secure_file_name):
-    flash_by_key(app, "MAP_DOWNLOAD_LINK_CREATION_SUCCESS", secure_file_name)
+  # Map IDs written with leading zeros or a sign do not correspond to a real map file name
+  if secure_file_name == get_map_filename(map_id_as_int) and get_app_state().map_catalog.get(map_id_as_int) is not None:
+    flash_by_key(current_app, "MAP_DOWNLOAD_LINK_CREATION_SUCCESS", secure_file_name)
     log_info("MAP_DOWNLOAD_LINK_CREATION_SUCCESS", secure_file_name)
   else:
-    flash_by_key(app, "MAP_DOWNLOAD_LINK_CREATION_FILE_NOT_FOUND", secure_file_name)
+    flash_by_key(current_app, "MAP_DOWNLOAD_LINK_CREATION_FILE_NOT_FOUND", secure_file_name)
     log_warn("MAP_DOWNLOAD_LINK_CREATION_FILE_NOT_FOUND", secure_file_name)
 
 def parse_map_id_as_integer(map_id_as_str):
@@ -141,66 +210,120 @@ def parse_map_id_as_integer(map_id_as_str):
   except ValueError:
     return None
 
-@app.route("/map/download/<path:filename>")
+@map_blueprint.route("/download/range")
+def download_map_range():
+  first_map_id_as_str = request.args.get("from", "")
+  last_map_id_in_range_as_str = request.args.get("to", "")
+  first_map_id = parse_map_id_as_integer(first_map_id_as_str)
+  last_map_id_in_range = parse_map_id_as_integer(last_map_id_in_range_as_str)
+
+  if first_map_id is None or last_map_id_in_range is None or \
+    first_map_id < 0 or last_map_id_in_range < first_map_id or last_map_id_in_range > get_last_map_id() or \
+    last_map_id_in_range - first_map_id + 1 > current_app.config["MAP_DOWNLOAD_RANGE_MAX_NUMBER_OF_MAPS"]:
+    log_warn("MAP_DOWNLOAD_RANGE_INVALID", first_map_id_as_str, last_map_id_in_range_as_str)
+    abort(400)
+
+  downloads_dir = current_app.config["MAP_DOWNLOADS_DIR"]
+  map_filenames = [get_map_filename(map_id) for map_id in range(first_map_id, last_map_id_in_range + 1)]
+  entries = [(os.path.join(downloads_dir, map_filename), map_filename) for map_filename in map_filenames if os.path.isfile(os.path.join(downloads_dir, map_filename))]
+
+  if not entries:
+    log_warn("MAP_DOWNLOAD_RANGE_NOT_FOUND", first_map_id_as_str, last_map_id_in_range_as_str)
+    abort(404)
+
+  # Map files are already compressed, so they are stored in the archive as they are, and the archive is streamed as it is built
+  archive_filename = "maps_{}-{}.zip".format(first_map_id, last_map_id_in_range)
+  response = Response(generate_stored_zip(entries), mimetype = "application/zip")
+  response.headers.set("Content-Disposition", "attachment", filename = archive_filename)
+
+  log_info("MAP_DOWNLOAD_RANGE_SUCCESS", archive_filename)
+  return response
+
+@map_blueprint.route("/download/<path:filename>")
 def download_map(filename):
-  downloads_dir = app.config["MAP_DOWNLOADS_DIR"]
+  downloads_dir = current_app.config["MAP_DOWNLOADS_DIR"]
   file_map_id = get_file_map_id(filename)
 
   if file_map_id is None:
     log_warn("MAP_DOWNLOAD_FORBIDDEN", filename)
     abort(403)
 
-  response = send_from_directory(downloads_dir, filename, as_attachment = True)
+  response = send_download(downloads_dir, filename, current_app.config["MAP_DOWNLOAD_CACHE_CONTROL"])
   log_info("MAP_DOWNLOAD_SUCCESS", filename)
   return response
 
-def get_last_map_id():
-  # idcounts.dat will be in the map downloads directory, which should map to the data directory of the Minecraft server.
-  downloads_dir = app.config["MAP_DOWNLOADS_DIR"]
-  idcounts_file_path = os.path.join(downloads_dir, "idcounts.dat")
-  idcounts_nbt = load_compressed_nbt_file(idcounts_file_path)
-  return get_nbt_map_value(idcounts_nbt, "map")
-
-def get_file_map_id(filename):
-  match = re.search(r"(?<=^map_)\d+(?=\.dat$)", filename)
-  if match:
-    return int(match.group())
-  return None
+@map_blueprint.route("/preview/<int:map_id>.png")
+def preview_map(map_id):
+  map_file_path = os.path.join(current_app.config["MAP_DOWNLOADS_DIR"], get_map_filename(map_id))
 
-def is_invalid_map_format(file):
   try:
-    # Check that all the required NBT map fields in the file exist
-    compressed_buffer = file.getvalue()
-    nbt_file = load_compressed_nbt_buffer(compressed_buffer)
+    stat = os.stat(map_file_path)
+  except FileNotFoundError:
+    abort(404)
+
+  # Previews are keyed by the map file's modification time and size, so a repeat view only costs this stat
+  preview_key = "map_{}-{:x}-{:x}".format(map_id, stat.st_mtime_ns, stat.st_size)
+  map_preview_cache = get_app_state().map_preview_cache
+  preview_png = map_preview_cache.get(preview_key)
+
+  if preview_png is None:
+    preview_png = load_map_preview(map_file_path, map_id, preview_key)
+    if preview_png is None:
+      abort(404)
+    map_preview_cache.put(preview_key, preview_png)
+
+  response = Response(preview_png, mimetype = "image/png")
+  response.set_etag(preview_key)
+  return response.make_conditional(request)
 
-    is_invalid = get_nbt_map_value(nbt_file, "dimension") is None or \
-      get_nbt_map_value(nbt_file, "locked") is None or \
-      get_nbt_map_value(nbt_file, "colors") is None or \
-      get_nbt_map_value(nbt_file, "scale") is None or \
-      get_nbt_map_value(nbt_file, "trackingPosition") is None or \
-      get_nbt_map_value(nbt_file, "xCenter") is None or \
-      get_nbt_map_value(nbt_file, "zCenter") is None
+def load_map_preview(map_file_path, map_id, preview_key):
+  preview_cache_dir = current_app.config["MAP_PREVIEW_CACHE_DIR"]
+  preview_file_path = os.path.join(preview_cache_dir, preview_key + ".png")
 
-    return is_invalid
+  if os.path.isfile(preview_file_path):
+    return read_file(preview_file_path)
 
-  # If there are any errors loading the file as an NBT, then the file is invalid
+  try:
+    uncompressed_buffer = decompress_nbt_buffer(read_file(map_file_path))
+    colors = scan_nbt_buffer(uncompressed_buffer, ["data/colors"])["data/colors"]
+    # NumPy is only imported once the first preview is rendered, so that it does not slow down application startup
+    from mrt_file_server.utils.map_preview_utils import render_map_png
+    preview_png = render_map_png(memoryview(uncompressed_buffer)[colors.offset:colors.offset + colors.length])
+
+  # Files that are not valid maps have no preview
   except Exception as e:
-    return True
+    return None
 
-def is_existing_map_file_locked(filename):
-  # The existing file should be in the map downloads directory, which should map to the actual data directory on the Minecraft server.
-  downloads_dir = app.config["MAP_DOWNLOADS_DIR"]
-  existing_file_path = os.path.join(downloads_dir, filename)
+  # Previews of older versions of this map are no longer needed
+  for stale_preview_file_path in glob.glob(os.path.join(preview_cache_dir, "map_{}-*.png".format(map_id))):
+    os.remove(stale_preview_file_path)
 
-  if os.path.isfile(existing_file_path):
-    existing_file_nbt = load_compressed_nbt_file(existing_file_path)
-    locked_value = get_nbt_map_value(existing_file_nbt, "locked")
-    return locked_value == 1
+  with open_atomic_file(preview_cache_dir, preview_key + ".png") as preview_file:
+    preview_file.write(preview_png)
 
-  return False
+  return preview_png
+
+@timed("get_last_map_id")
+def get_last_map_id():
+  # idcounts.dat will be in the map downloads directory, which should map to the data directory of the Minecraft server.
+  downloads_dir = current_app.config["MAP_DOWNLOADS_DIR"]
+  idcounts_file_path = os.path.join(downloads_dir, "idcounts.dat")
+  return last_map_id_cache.get(idcounts_file_path)
+
+def load_last_map_id(idcounts_file_path):
+  idcounts_tags = scan_compressed_nbt_file(idcounts_file_path, ["data/map"])
+  return idcounts_tags["data/map"].value
+
+# Shared by every request in this process, so idcounts.dat is only parsed again after it changes on disk.
+last_map_id_cache = FileStatCache(load_last_map_id)
+
+def is_existing_map_file_locked(filename):
+  # The existing file should be in the map downloads directory, which should map to the actual data directory on the Minecraft server.
+  existing_map = get_app_state().map_catalog.get(get_file_map_id(filename))
+  return existing_map is not None and existing_map.locked == 1
 
 def is_map_already_uploaded(filename):
-  uploads_dir = app.config["MAP_UPLOADS_DIR"]
+  uploads_dir = current_app.config["MAP_UPLOADS_DIR"]
   existing_file_path = os.path.join(uploads_dir, filename)
 
   return os.path.isfile(existing_file_path)
@@ -0,0 +1,46 @@
+from flask import Blueprint, Response, abort, current_app, g, request
+
+from mrt_file_server import get_app_state
+from mrt_file_server.metrics import format_prometheus_text, registry
+
+import time
+
+metrics_blueprint = Blueprint("metrics", __name__)
+
+@metrics_blueprint.before_app_request
+def start_request_timer():
+  g.request_start_time = time.perf_counter()
+
+@metrics_blueprint.after_app_request
+def record_request_metrics(response):
+  if not current_app.config["METRICS_ENABLED"] or "request_start_time" not in g:
+    return response
+
+  endpoint = request.endpoint or "unmatched"
+  registry.observe("mrt_http_request_duration_seconds", { "endpoint": endpoint, "method": request.method }, time.perf_counter() - g.request_start_time)
+  registry.increment("mrt_http_requests_total", { "endpoint": endpoint, "method": request.method, "status": str(response.status_code) })
+
+  # Streamed responses of unknown length, such as map range ZIP archives, are counted as their chunks are sent
+  if response.content_length is not None:
+    registry.increment("mrt_http_response_bytes_total", { "endpoint": endpoint }, response.content_length)
+  elif response.is_streamed:
+    response.response = count_response_bytes(response.response, endpoint)
+
+  get_app_state().metrics_spool.write_if_due()
+  return response
+
+def count_response_bytes(chunks, endpoint):
+  sent_size = 0
+  try:
+    for chunk in chunks:
+      sent_size += len(chunk)
+      yield chunk
+  finally:
+    registry.increment("mrt_http_response_bytes_total", { "endpoint": endpoint }, sent_size)
+
+@metrics_blueprint.route("/metrics")
+def show_metrics():
+  if not current_app.config["METRICS_ENABLED"]:
+    abort(404)
+
+  return Response(format_prometheus_text(get_app_state().metrics_spool.collect()), mimetype = "text/plain; version=0.0.4")
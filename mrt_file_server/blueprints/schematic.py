@@ -1,49 +1,64 @@
-from flask import Blueprint, render_template, request, send_from_directory
+from flask import Blueprint, abort, current_app, jsonify, render_template, request, url_for
 from werkzeug.utils import secure_filename
 
-from mrt_file_server import app, schematics
-from mrt_file_server.utils.file_utils import get_filesize, split_file_root_and_extension, file_exists_in_dir
-from mrt_file_server.utils.flash_utils import flash_by_key
+from mrt_file_server import get_app_state
+from mrt_file_server.utils.download_utils import send_download
+from mrt_file_server.utils.file_utils import get_filesize, lock_name, open_exclusive_file, split_file_root_and_extension, file_exists_in_dir
+from mrt_file_server.utils.flash_utils import flash_by_key, flash_formatted_by_key
 from mrt_file_server.utils.log_utils import log_info, log_warn, log_error
 from mrt_file_server.utils.string_utils import str_contains_whitespace
 
+import shutil
+
 schematic_blueprint = Blueprint("schematic", __name__, url_prefix="/schematic")
 
-@app.route("/schematic/upload", methods = ["GET", "POST"])
+@schematic_blueprint.route("/upload", methods = ["GET", "POST"])
 def route_schematic_upload():
+  job_id = None
+
   if request.method == "POST":
-    upload_schematics()
+    job_id = upload_schematics()
+
+  page = render_template("schematic/upload/index.html", home = False)
 
-  return render_template("schematic/upload/index.html", home = False)
+  # A queued upload has not been processed yet, and its results are at the location of the job
+  if job_id is not None:
+    return page, 202, { "Location": url_for("jobs.route_upload_job", job_id = job_id) }
+  return page
 
 def upload_schematics():
   username = request.form["userName"] if "userName" in request.form else None
 
   if username == None or username == "":
-    flash_by_key(app, "SCHEMATIC_UPLOAD_USERNAME_EMPTY")
+    flash_by_key(current_app, "SCHEMATIC_UPLOAD_USERNAME_EMPTY")
     log_warn("SCHEMATIC_UPLOAD_USERNAME_EMPTY")
   elif str_contains_whitespace(username):
-    flash_by_key(app, "SCHEMATIC_UPLOAD_USERNAME_WHITESPACE")
+    flash_by_key(current_app, "SCHEMATIC_UPLOAD_USERNAME_WHITESPACE")
     log_warn("SCHEMATIC_UPLOAD_USERNAME_WHITESPACE", username)
   elif "schematic" not in request.files:
-    flash_by_key(app, "SCHEMATIC_UPLOAD_NO_FILES")
+    flash_by_key(current_app, "SCHEMATIC_UPLOAD_NO_FILES")
     log_warn("SCHEMATIC_UPLOAD_NO_FILES", username)
   else:
     files = request.files.getlist("schematic")
 
-    if len(files) > app.config["SCHEMATIC_UPLOAD_MAX_NUMBER_OF_FILES"]:
-      flash_by_key(app, "SCHEMATIC_UPLOAD_TOO_MANY_FILES")
+    if len(files) > current_app.config["SCHEMATIC_UPLOAD_MAX_NUMBER_OF_FILES"]:
+      flash_by_key(current_app, "SCHEMATIC_UPLOAD_TOO_MANY_FILES")
       log_warn("SCHEMATIC_UPLOAD_TOO_MANY_FILES", username)
+    elif current_app.config["UPLOAD_JOB_QUEUE_ENABLED"]:
+      job_id = get_app_state().upload_job_queue.submit("schematic", username, request.remote_addr, files)
+      flash_formatted_by_key(current_app, "SCHEMATIC_UPLOAD_QUEUED", url_for("jobs.route_upload_job", job_id = job_id))
+      log_info("SCHEMATIC_UPLOAD_QUEUED", job_id, len(files), username)
+      return job_id
     else:
       for file in files:
         upload_single_schematic(username, file)
 
 def upload_single_schematic(username, file):
   file.filename = "{}-{}".format(username, file.filename)
-  uploads_dir = app.config["SCHEMATIC_UPLOADS_DIR"]
+  uploads_dir = current_app.config["SCHEMATIC_UPLOADS_DIR"]
 
   if str_contains_whitespace(file.filename):
-    flash_by_key(app, "SCHEMATIC_UPLOAD_FILENAME_WHITESPACE", file.filename)
+    flash_by_key(current_app, "SCHEMATIC_UPLOAD_FILENAME_WHITESPACE", file.filename)
     log_warn("SCHEMATIC_UPLOAD_FILENAME_WHITESPACE", file.filename, username)
     return
 
@@ -54,25 +69,42 @@ def upload_single_schematic(username, file):
   file_extension = file_pair[1]
 
   if file_extension != ".schematic" and file_extension != ".schem":
-    flash_by_key(app, "SCHEMATIC_UPLOAD_FILENAME_EXTENSION", file.filename)
+    flash_by_key(current_app, "SCHEMATIC_UPLOAD_FILENAME_EXTENSION", file.filename)
     log_warn("SCHEMATIC_UPLOAD_FILENAME_EXTENSION", file.filename, username)
-  elif file_size > app.config["SCHEMATIC_UPLOAD_MAX_FILE_SIZE"]:
-    flash_by_key(app, "SCHEMATIC_UPLOAD_FILE_TOO_LARGE", file.filename)
+  elif file_size > current_app.config["SCHEMATIC_UPLOAD_MAX_FILE_SIZE"]:
+    flash_by_key(current_app, "SCHEMATIC_UPLOAD_FILE_TOO_LARGE", file.filename)
     log_warn("SCHEMATIC_UPLOAD_FILE_TOO_LARGE", file.filename, username)
-  elif file_exists_in_dir(uploads_dir, file_root + ".schematic") or file_exists_in_dir(uploads_dir, file_root + ".schem"):
-    flash_by_key(app, "SCHEMATIC_UPLOAD_FILE_EXISTS", file.filename)
-    log_warn("SCHEMATIC_UPLOAD_FILE_EXISTS", file.filename, username)
   else:
-    try:
-      schematics.save(file)
-
-      message = flash_by_key(app, "SCHEMATIC_UPLOAD_SUCCESS", file.filename)
-      log_info("SCHEMATIC_UPLOAD_SUCCESS", file.filename, username)
-    except Exception as e:
-      message = flash_by_key(app, "SCHEMATIC_UPLOAD_FAILURE", file.filename)
-      log_error("SCHEMATIC_UPLOAD_FAILURE", file.filename, username, e)
-
-@app.route("/schematic/download", methods = ["GET", "POST"])
+    # The .schematic and .schem files of the same name are locked together, as only one of them may be uploaded
+    with lock_name(current_app.config["LOCKS_DIR"], "schematic", file_root):
+      if file_exists_in_dir(uploads_dir, file_root + ".schematic") or file_exists_in_dir(uploads_dir, file_root + ".schem"):
+        flash_schematic_file_exists(username, file.filename)
+      else:
+        save_uploaded_schematic(username, file, uploads_dir)
+
+def save_uploaded_schematic(username, file, uploads_dir):
+  try:
+    file.stream.seek(0)
+    if current_app.config["SCHEMATIC_UPLOAD_DEDUPLICATION"]:
+      get_app_state().schematic_blob_store.save_stream(file.stream, uploads_dir, file.filename, exclusive = True)
+    else:
+      # Unlike Flask-Uploads, which would save the file under a new name, an existing file is never replaced or renamed
+      with open_exclusive_file(uploads_dir, file.filename) as uploaded_file:
+        shutil.copyfileobj(file.stream, uploaded_file)
+
+    message = flash_by_key(current_app, "SCHEMATIC_UPLOAD_SUCCESS", file.filename)
+    log_info("SCHEMATIC_UPLOAD_SUCCESS", file.filename, username)
+  except FileExistsError:
+    flash_schematic_file_exists(username, file.filename)
+  except Exception as e:
+    message = flash_by_key(current_app, "SCHEMATIC_UPLOAD_FAILURE", file.filename)
+    log_error("SCHEMATIC_UPLOAD_FAILURE", file.filename, username, e)
+
+def flash_schematic_file_exists(username, filename):
+  flash_by_key(current_app, "SCHEMATIC_UPLOAD_FILE_EXISTS", filename)
+  log_warn("SCHEMATIC_UPLOAD_FILE_EXISTS", filename, username)
+
+@schematic_blueprint.route("/download", methods = ["GET", "POST"])
 def route_schematic_download():
   response = False
 
@@ -85,36 +117,55 @@ def create_schematic_download_link():
   file_root = request.form["fileRoot"]
   file_extension = request.form["fileExtension"]
   file_name = "{}.{}".format(file_root, file_extension)
-  downloads_dir = app.config["SCHEMATIC_DOWNLOADS_DIR"]
+  downloads_dir = current_app.config["SCHEMATIC_DOWNLOADS_DIR"]
 
   if file_root == "":
-    flash_by_key(app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_EMPTY")
+    flash_by_key(current_app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_EMPTY")
     log_warn("SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_EMPTY")
     return
 
   if file_extension not in ["schem", "schematic"]:
-    flash_by_key(app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_INVALID_EXTENSION", file_name)
+    flash_by_key(current_app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_INVALID_EXTENSION", file_name)
     log_warn("SCHEMATIC_DOWNLOAD_LINK_CREATION_INVALID_EXTENSION", file_name)
     return
 
   if str_contains_whitespace(file_root):
-    flash_by_key(app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_WHITESPACE", file_name)
+    flash_by_key(current_app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_WHITESPACE", file_name)
     log_warn("SCHEMATIC_DOWNLOAD_LINK_CREATION_FILENAME_WHITESPACE", file_name)
     return
 
   secure_file_name = "{}.{}".format(secure_filename(file_root), file_extension)
 
   if file_exists_in_dir(downloads_dir, secure_file_name):
-    flash_by_key(app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_SUCCESS", secure_file_name)
+    flash_by_key(current_app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_SUCCESS", secure_file_name)
     log_info("SCHEMATIC_DOWNLOAD_LINK_CREATION_SUCCESS", secure_file_name)
   else:
-    flash_by_key(app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILE_NOT_FOUND", secure_file_name)
+    flash_by_key(current_app, "SCHEMATIC_DOWNLOAD_LINK_CREATION_FILE_NOT_FOUND", secure_file_name)
     log_warn("SCHEMATIC_DOWNLOAD_LINK_CREATION_FILE_NOT_FOUND", secure_file_name)
 
-@app.route("/schematic/download/<path:filename>")
+@schematic_blueprint.route("/download/<path:filename>")
 def download_schematic(filename):
-  downloads_dir = app.config["SCHEMATIC_DOWNLOADS_DIR"]
+  downloads_dir = current_app.config["SCHEMATIC_DOWNLOADS_DIR"]
 
-  response = send_from_directory(downloads_dir, filename, as_attachment = True)
+  response = send_download(downloads_dir, filename, current_app.config["SCHEMATIC_DOWNLOAD_CACHE_CONTROL"])
   log_info("SCHEMATIC_DOWNLOAD_SUCCESS", filename)
   return response
+
+@schematic_blueprint.route("/search")
+def search_schematics():
+  query = request.args.get("q", "").strip()
+  page = request.args.get("page", "1")
+  results_per_page = current_app.config["SCHEMATIC_SEARCH_RESULTS_PER_PAGE"]
+
+  if not page.isdigit() or int(page) < 1:
+    abort(400)
+
+  page = int(page)
+  total, filenames = get_app_state().schematic_index.search(query, (page - 1) * results_per_page, results_per_page) if query else (0, [])
+
+  results = []
+  for filename in filenames:
+    file_root, file_extension = split_file_root_and_extension(filename)
+    results.append({ "fileName": filename, "fileRoot": file_root, "fileExtension": file_extension.lstrip(".") })
+
+  return jsonify(query = query, page = page, resultsPerPage = results_per_page, total = total, results = results)
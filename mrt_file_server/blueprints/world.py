@@ -1,19 +1,19 @@
-from flask import Blueprint, render_template, send_from_directory
+from flask import Blueprint, current_app, render_template
 
-from mrt_file_server import app
+from mrt_file_server.utils.download_utils import send_download
 from mrt_file_server.utils.log_utils import log_info
 
 world_blueprint = Blueprint("world", __name__, url_prefix="/world")
 
-@app.route("/world/download/terms")
+@world_blueprint.route("/download/terms")
 def show_world_downloads_terms():
   return render_template("world/download/terms.html", home = False)
 
-@app.route("/world/download")
+@world_blueprint.route("/download")
 def list_world_downloads():
   return render_template("world/download/index.html", home = False)
 
-@app.route("/world/download/<path:filename>")
+@world_blueprint.route("/download/<path:filename>")
 def download_world(filename):
   log_info("WORLD_DOWNLOAD_SUCCESS", filename)
-  return send_from_directory(app.config["WORLD_DOWNLOADS_DIR"], filename, as_attachment = True)
\ No newline at end of file
+  return send_download(current_app.config["WORLD_DOWNLOADS_DIR"], filename, current_app.config["WORLD_DOWNLOAD_CACHE_CONTROL"])
\ No newline at end of file
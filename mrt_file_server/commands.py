@@ -0,0 +1,153 @@
+from flask import current_app
+from flask.cli import AppGroup
+
+from mrt_file_server import get_app_state
+from mrt_file_server.map_promotion import MapPromotion, PROMOTED, REJECTED
+from mrt_file_server.schematic_storage import find_duplicate_groups, get_reclaimable_size
+from mrt_file_server.utils.map_utils import get_file_map_id, get_map_filename, parse_map_id_ranges, set_map_file_locked
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import os
+
+# Administration commands, run with the flask command, e.g. "flask schematic dedupe-report"
+
+schematic_cli = AppGroup("schematic", help = "Manage uploaded schematic files.")
+
+@schematic_cli.command("dedupe-report")
+@click.option("--directory", help = "Directory to report on. Defaults to the schematic uploads directory.")
+def report_duplicate_schematics(directory):
+  """Report groups of schematic files with identical content."""
+  directory = directory or current_app.config["SCHEMATIC_UPLOADS_DIR"]
+  duplicate_groups = find_duplicate_groups(directory)
+
+  for group in duplicate_groups:
+    click.echo("{} ({} bytes, {} on disk): {}".format(group.content_hash[:16], group.size, pluralize(group.inode_count, "copy", "copies"), ", ".join(group.filenames)))
+
+  click.echo("{} with duplicates, {} in total. {} bytes can be reclaimed.".format(
+    pluralize(len(duplicate_groups), "content", "contents"),
+    pluralize(sum(len(group.filenames) for group in duplicate_groups), "file", "files"),
+    get_reclaimable_size(duplicate_groups)))
+
+@schematic_cli.command("dedupe-reclaim")
+@click.option("--directory", help = "Directory to deduplicate. Defaults to the schematic uploads directory. Must be on the same filesystem as the blob directory.")
+@click.option("--dry-run", is_flag = True, help = "Only report what would be reclaimed.")
+def reclaim_duplicate_schematics(directory, dry_run):
+  """Replace duplicate schematic files with hardlinks to a single stored copy, and remove unused stored copies."""
+  directory = directory or current_app.config["SCHEMATIC_UPLOADS_DIR"]
+  duplicate_groups = find_duplicate_groups(directory)
+  reclaimable_size = get_reclaimable_size(duplicate_groups)
+
+  if dry_run:
+    click.echo("{} bytes would be reclaimed from {}.".format(reclaimable_size, pluralize(len(duplicate_groups), "duplicated content", "duplicated contents")))
+    return
+
+  schematic_blob_store = get_app_state().schematic_blob_store
+  linked_count = 0
+  for group in duplicate_groups:
+    for filename in group.filenames:
+      linked_count += schematic_blob_store.adopt_file(os.path.join(directory, filename), group.content_hash)
+
+  removed_blob_count, removed_blob_size = schematic_blob_store.remove_orphaned_blobs()
+
+  click.echo("Replaced {} with links, reclaiming {} bytes. Removed {} no longer in use ({} bytes).".format(
+    pluralize(linked_count, "file", "files"), reclaimable_size, pluralize(removed_blob_count, "stored copy", "stored copies"), removed_blob_size))
+
+map_cli = AppGroup("map", help = "Manage uploaded map files.")
+
+@map_cli.command("promote-maps")
+@click.option("--target", help = "Directory to move the maps to. Defaults to the map downloads directory, which should be the world data directory.")
+@click.option("--workers", type = int, help = "Number of maps to copy in parallel. Defaults to MAP_PROMOTION_WORKERS.")
+def promote_maps(target, workers):
+  """
+  Move uploaded maps into the world data directory.
+
+  Each map is verified again and copied with a flush to disk and an atomic rename, before the uploaded file is removed.
+  Progress is saved, so an interrupted promotion continues where it left off when run again.
+  """
+  map_promotion = MapPromotion(
+    current_app.config["MAP_UPLOADS_DIR"],
+    target or current_app.config["MAP_DOWNLOADS_DIR"],
+    current_app.config["MAP_PROMOTION_MANIFEST_FILE"],
+    workers or current_app.config["MAP_PROMOTION_WORKERS"])
+
+  if map_promotion.load_or_build_manifest():
+    click.echo("Resuming interrupted promotion of {}.".format(pluralize(len(map_promotion.manifest["files"]), "map", "maps")))
+
+  status_counts = map_promotion.run()
+
+  for filename, reason in map_promotion.get_rejected_files():
+    click.echo("Rejected {}: {}".format(filename, reason))
+
+  click.echo("Promoted {}, rejected {}.".format(pluralize(status_counts[PROMOTED], "map", "maps"), status_counts[REJECTED]))
+
+@map_cli.command("lock")
+@click.argument("map_ids", nargs = -1)
+@click.option("--all", "all_maps", is_flag = True, help = "Lock every map in the map downloads directory.")
+@click.option("--workers", type = int, help = "Number of maps to change in parallel. Defaults to MAP_LOCK_WORKERS.")
+def lock_maps(map_ids, all_maps, workers):
+  """
+  Lock maps in the map downloads directory, so that they can no longer be replaced by uploads.
+
+  MAP_IDS are map IDs or inclusive ranges of map IDs, e.g. "1500 2000-2999".
+  """
+  set_maps_locked(map_ids, all_maps, workers, True)
+
+@map_cli.command("unlock")
+@click.argument("map_ids", nargs = -1)
+@click.option("--all", "all_maps", is_flag = True, help = "Unlock every map in the map downloads directory.")
+@click.option("--workers", type = int, help = "Number of maps to change in parallel. Defaults to MAP_LOCK_WORKERS.")
+def unlock_maps(map_ids, all_maps, workers):
+  """
+  Unlock maps in the map downloads directory, so that they can be replaced by uploads.
+
+  MAP_IDS are map IDs or inclusive ranges of map IDs, e.g. "1500 2000-2999".
+  """
+  set_maps_locked(map_ids, all_maps, workers, False)
+
+def set_maps_locked(map_id_args, all_maps, workers, locked):
+  maps_dir = current_app.config["MAP_DOWNLOADS_DIR"]
+  action = "Locked" if locked else "Unlocked"
+
+  if all_maps:
+    filenames = sorted(filename for filename in os.listdir(maps_dir) if get_file_map_id(filename) is not None)
+  elif map_id_args:
+    try:
+      filenames = [get_map_filename(map_id) for map_id in parse_map_id_ranges(map_id_args)]
+    except ValueError as e:
+      raise click.BadParameter(str(e), param_hint = "MAP_IDS")
+  else:
+    raise click.UsageError("Specify the map IDs to change, or --all.")
+
+  def set_map_locked(filename):
+    try:
+      changed = set_map_file_locked(os.path.join(maps_dir, filename), locked)
+    except FileNotFoundError:
+      return filename, None, "File does not exist"
+    except Exception as e:
+      changed = None
+
+    if changed is None:
+      return filename, None, "File is not a valid map format"
+    return filename, changed, None
+
+  # Decompressing and compressing the maps releases the GIL, so the maps are changed in parallel threads
+  with ThreadPoolExecutor(max_workers = workers or current_app.config["MAP_LOCK_WORKERS"]) as executor:
+    results = list(executor.map(set_map_locked, filenames))
+
+  changed_count = 0
+  unchanged_count = 0
+  for filename, changed, reason in results:
+    if reason is not None:
+      click.echo("Skipped {}: {}".format(filename, reason))
+    elif changed:
+      changed_count += 1
+    else:
+      unchanged_count += 1
+
+  click.echo("{} {}, {} already {}, skipped {}.".format(
+    action, pluralize(changed_count, "map", "maps"), unchanged_count, action.lower(), len(results) - changed_count - unchanged_count))
+
+def pluralize(count, singular, plural):
+  return "{} {}".format(count, singular if count == 1 else plural)
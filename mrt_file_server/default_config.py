@@ -4,12 +4,35 @@ SCHEMATIC_UPLOAD_MAX_NUMBER_OF_FILES = 10
 # Maximum number of bytes that can be uploaded per schematic file
 SCHEMATIC_UPLOAD_MAX_FILE_SIZE = 100 * 1024 # 100 kilobytes
 
+# Set to True to store each distinct uploaded schematic once, with uploaded files as hardlinks to the stored copy
+SCHEMATIC_UPLOAD_DEDUPLICATION = False
+
+# Number of results per page returned by the schematic search
+SCHEMATIC_SEARCH_RESULTS_PER_PAGE = 20
+
 # Maximum number of map files that can be uploaded at one time
 MAP_UPLOAD_MAX_NUMBER_OF_FILES = 10
 
 # Maximum number of bytes that can be uploaded per map file
 MAP_UPLOAD_MAX_FILE_SIZE = 100 * 1024 # 100 kilobytes
 
+# Maximum number of bytes that each uploaded map file may decompress to. Maps made by Minecraft are about 20 kilobytes uncompressed.
+MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE = 1024 * 1024 # 1 megabyte
+
+# Number of worker processes used to validate and prepare the files of a map upload in parallel
+# Set to 0 to prepare each file in the request thread instead
+MAP_UPLOAD_PROCESS_POOL_WORKERS = 0
+
+# Set to True to queue map and schematic uploads, which are then processed by background worker threads
+# The upload responds as soon as the files are queued, and the results are shown at /jobs/<job ID>
+UPLOAD_JOB_QUEUE_ENABLED = False
+
+# Number of background threads that process queued uploads in each worker process
+UPLOAD_JOB_WORKERS = 2
+
+# Number of seconds that the results of a finished upload job are kept
+UPLOAD_JOB_RETENTION = 24 * 60 * 60 # 1 day
+
 # Maximum number of bytes that can be uploaded at one time
 MAX_CONTENT_LENGTH = 10 * 100 * 1024 # 1 megabyte
 
@@ -19,5 +42,62 @@ MAX_CONTENT_LENGTH = 10 * 100 * 1024 # 1 megabyte
 # then the range of allowed map IDs is 1501 to 2500.
 MAP_UPLOAD_LAST_ALLOWED_ID_RANGE = 1000
 
+# Number of maps copied in parallel by the "flask map promote-maps" command
+MAP_PROMOTION_WORKERS = 8
+
+# Number of maps changed in parallel by the "flask map lock" and "flask map unlock" commands
+MAP_LOCK_WORKERS = 8
+
+# Maximum number of consecutive map IDs that can be downloaded in one ZIP archive
+MAP_DOWNLOAD_RANGE_MAX_NUMBER_OF_MAPS = 100
+
+# Maximum number of map IDs whose status can be requested at once from /api/maps/status
+MAP_STATUS_MAX_NUMBER_OF_MAPS = 1000
+
+# Maximum number of seconds before /api/maps/status checks the map downloads directory again for maps changed in place
+# The check runs in a background thread, and requests are answered from the last sync meanwhile
+# Maps that are added, removed or replaced by a rename are picked up straight away
+MAP_CATALOG_MAX_AGE = 300
+
+# Number of map preview images kept in memory by each worker (previews are also cached on disk)
+MAP_PREVIEW_CACHE_SIZE = 256
+
+# How files are delivered by the world, map and schematic download routes:
+# "direct"           - The application streams the file itself (use uWSGI's offload-threads option to move the copying out of the worker)
+# "x-accel-redirect" - nginx streams the file from the internal location DOWNLOAD_X_ACCEL_REDIRECT_PREFIX, which must map to the downloads directory
+# "x-sendfile"       - Apache or lighttpd streams the file from its absolute path
+DOWNLOAD_DELIVERY_MODE = "direct"
+
+# Internal nginx location that serves the downloads directory when DOWNLOAD_DELIVERY_MODE is "x-accel-redirect"
+DOWNLOAD_X_ACCEL_REDIRECT_PREFIX = "/protected-downloads/"
+
+# Files up to this many bytes are hashed to produce their download ETags, and larger files use their inode, modification time and size instead
+DOWNLOAD_CONTENT_HASH_MAX_FILE_SIZE = 64 * 1024 * 1024 # 64 megabytes
+
+# Cache-Control header sent with each type of download, or an empty string to use Flask's default
+# World archives are never modified once published, while maps and schematics can be replaced and should be revalidated
+# Downloads are private by default, so that shared caches such as proxies and CDNs never serve them past basic authentication
+WORLD_DOWNLOAD_CACHE_CONTROL = "private, max-age=31536000, immutable"
+MAP_DOWNLOAD_CACHE_CONTROL = "no-cache"
+SCHEMATIC_DOWNLOAD_CACHE_CONTROL = "no-cache"
+
+# Set to True to write log records from a background thread, so that requests do not wait for the log file to be written
+LOG_QUEUE_ENABLED = False
+
+# Maximum number of queued log records written to the log file before it is flushed
+LOG_QUEUE_BATCH_SIZE = 64
+
+# Rotate the log file once it reaches this many bytes, or 0 to never rotate it
+LOG_FILE_MAX_BYTES = 0
+
+# Number of rotated log files to keep
+LOG_FILE_BACKUP_COUNT = 5
+
+# Set to True to record request and operation metrics, and serve them in the Prometheus text format at /metrics
+METRICS_ENABLED = True
+
+# Minimum number of seconds between each worker process writing its metrics to the spool directory
+METRICS_SPOOL_INTERVAL = 5
+
 # Disable basic authentication by default
 BASIC_AUTH_FORCE = False
\ No newline at end of file
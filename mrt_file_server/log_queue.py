@@ -0,0 +1,127 @@
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+import atexit
+import os
+import queue
+import threading
+
+# Listeners that have been started and not yet stopped. The fork and exit hooks are registered once for all of them.
+running_listeners = set()
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+  """
+  RotatingFileHandler whose flushes can be deferred, so that a batch of records reaches the disk in a single write.
+  """
+
+  def __init__(self, *args, **kwargs):
+    RotatingFileHandler.__init__(self, *args, **kwargs)
+    self.flush_deferred = False
+
+  def flush(self):
+    if not self.flush_deferred:
+      RotatingFileHandler.flush(self)
+
+class BatchingQueueListener:
+  """
+  Writes the log records placed on a queue by a QueueHandler from a background thread.
+  Records that are already waiting are taken from the queue together, up to batch_size at a time,
+  and each handler is flushed once per batch instead of once per record.
+  """
+
+  _sentinel = None
+
+  def __init__(self, log_queue, handlers, batch_size):
+    self.log_queue = log_queue
+    self.handlers = handlers
+    self.batch_size = batch_size
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target = self._run, name = "log-queue-listener", daemon = True)
+    self._thread.start()
+    running_listeners.add(self)
+
+  def stop(self):
+    # Records logged before stopping are still written, then every handler is flushed
+    if self._thread is None:
+      return
+
+    running_listeners.discard(self)
+    self.log_queue.put(self._sentinel)
+    self._thread.join()
+    self._thread = None
+
+  def _run(self):
+    while True:
+      records = [self.log_queue.get()]
+      while len(records) < self.batch_size and records[-1] is not self._sentinel:
+        try:
+          records.append(self.log_queue.get_nowait())
+        except queue.Empty:
+          break
+
+      stopping = records[-1] is self._sentinel
+      if stopping:
+        records.pop()
+
+      self.handle_batch(records)
+
+      if stopping:
+        return
+
+  def handle_batch(self, records):
+    for handler in self.handlers:
+      set_flush_deferred(handler, True)
+      try:
+        for record in records:
+          if record.levelno >= handler.level:
+            handler.handle(record)
+      finally:
+        set_flush_deferred(handler, False)
+        handler.flush()
+
+def set_flush_deferred(handler, flush_deferred):
+  if isinstance(handler, BatchedRotatingFileHandler):
+    handler.flush_deferred = flush_deferred
+
+class BatchingQueueHandler(QueueHandler):
+  """
+  QueueHandler that puts records on the queue of its listener. Closing it stops the listener, which writes
+  the records still on the queue, and closes the handlers that the listener passed the records on to.
+  """
+
+  def __init__(self, listener):
+    QueueHandler.__init__(self, listener.log_queue)
+    self.listener = listener
+
+  def enqueue(self, record):
+    # The listener's queue is replaced in a forked worker process, so it is looked up for each record
+    self.listener.log_queue.put_nowait(record)
+
+  def close(self):
+    self.listener.stop()
+    for handler in self.listener.handlers:
+      handler.close()
+    QueueHandler.close(self)
+
+def create_log_queue(handlers, batch_size):
+  """
+  Return a QueueHandler that puts records on a new queue, and a started listener that passes them on to the given handlers.
+  """
+  listener = BatchingQueueListener(queue.SimpleQueue(), handlers, batch_size)
+  queue_handler = BatchingQueueHandler(listener)
+  listener.start()
+  return queue_handler, listener
+
+def restart_listeners_after_fork():
+  # Only the forking thread exists in a forked worker process, so each running listener gets a new queue and thread of its own
+  for listener in list(running_listeners):
+    listener.log_queue = queue.SimpleQueue()
+    listener.start()
+
+def stop_listeners():
+  for listener in list(running_listeners):
+    listener.stop()
+
+os.register_at_fork(after_in_child = restart_listeners_after_fork)
+atexit.register(stop_listeners)
@@ -0,0 +1,204 @@
+from collections import namedtuple
+
+from mrt_file_server.utils.map_utils import get_file_map_id, get_map_filename
+from mrt_file_server.utils.nbt_utils import scan_compressed_nbt_file
+
+import os
+import sqlite3
+import threading
+import time
+
+# Maximum number of map IDs in each query of get_many, below SQLite's limit on the number of query parameters
+GET_MANY_CHUNK_SIZE = 500
+
+MAP_CATALOG_TAG_PATHS = ["data/locked", "data/scale", "data/dimension", "data/xCenter", "data/zCenter"]
+
+MapCatalogEntry = namedtuple("MapCatalogEntry", ["map_id", "locked", "scale", "dimension", "x_center", "z_center", "size", "mtime_ns"])
+
+class MapCatalog:
+  """
+  Persistent index of the map files in the map downloads directory.
+
+  Each map's metadata is stored in an SQLite database together with the file's size and modification time,
+  so a map file is only decoded again after it changes on disk, and restarts do not have to rescan every map.
+  """
+
+  def __init__(self, database_path, maps_dir):
+    self.database_path = database_path
+    self.maps_dir = maps_dir
+    self._local = threading.local()
+    self._sync_lock = threading.Lock()
+    self._last_sync_time = None
+    self._last_sync_dir_mtime_ns = None
+    self._refresh_thread = None
+
+    connection = self._get_connection()
+    connection.execute("PRAGMA journal_mode = WAL")
+    with connection:
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS maps (
+          map_id    INTEGER PRIMARY KEY,
+          locked    INTEGER,
+          scale     INTEGER,
+          dimension TEXT,
+          x_center  INTEGER,
+          z_center  INTEGER,
+          size      INTEGER NOT NULL,
+          mtime_ns  INTEGER NOT NULL
+        )""")
+
+    # A forked worker process must not use the SQLite connection of its parent
+    os.register_at_fork(after_in_child = self._reset_after_fork)
+
+  def sync(self):
+    """Bring the whole catalog up to date, decoding only the map files that were added or changed. Returns the number of maps decoded."""
+    connection = self._get_connection()
+    known_stats = { row[0]: (row[1], row[2]) for row in connection.execute("SELECT map_id, size, mtime_ns FROM maps") }
+    changed_entries = []
+    seen_map_ids = set()
+
+    for dir_entry in scan_map_files(self.maps_dir):
+      map_id = get_file_map_id(dir_entry.name)
+      stat = dir_entry.stat()
+      seen_map_ids.add(map_id)
+
+      if known_stats.get(map_id) != (stat.st_size, stat.st_mtime_ns):
+        changed_entries.append(read_map_catalog_entry(map_id, dir_entry.path, stat))
+
+    removed_map_ids = [(map_id,) for map_id in known_stats if map_id not in seen_map_ids]
+
+    with connection:
+      connection.executemany("INSERT OR REPLACE INTO maps VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed_entries)
+      connection.executemany("DELETE FROM maps WHERE map_id = ?", removed_map_ids)
+
+    return len(changed_entries)
+
+  def sync_if_stale(self, max_age):
+    """
+    Sync the catalog if maps have been added or removed since this process last synced it, or if it has not synced it yet.
+    Maps rewritten in place do not change the directory, so once the last sync is older than max_age seconds,
+    the catalog is synced again in a background thread, and callers are answered from the last sync meanwhile.
+    Returns True if the catalog was synced before returning.
+    """
+    with self._sync_lock:
+      dir_mtime_ns = get_dir_mtime_ns(self.maps_dir)
+
+      if self._last_sync_time is None or dir_mtime_ns != self._last_sync_dir_mtime_ns:
+        self._sync_locked(dir_mtime_ns)
+        return True
+
+      if time.monotonic() - self._last_sync_time >= max_age and self._refresh_thread is None:
+        self._refresh_thread = threading.Thread(target = self._refresh, name = "map-catalog-refresh", daemon = True)
+        self._refresh_thread.start()
+
+      return False
+
+  def _refresh(self):
+    try:
+      with self._sync_lock:
+        self._sync_locked(get_dir_mtime_ns(self.maps_dir))
+    finally:
+      self._refresh_thread = None
+      self._close_connection()
+
+  def _sync_locked(self, dir_mtime_ns):
+    # The directory's modification time is read before the sync, so changes made during the sync are picked up by the next one
+    now = time.monotonic()
+    self.sync()
+    self._last_sync_time = now
+    self._last_sync_dir_mtime_ns = dir_mtime_ns
+
+  def get_many(self, map_ids):
+    """Return the catalog entries of the given map IDs that exist, by map ID, as of the last sync. No map files are read."""
+    connection = self._get_connection()
+    map_ids = sorted(set(map_ids))
+    entries = {}
+
+    for start in range(0, len(map_ids), GET_MANY_CHUNK_SIZE):
+      chunk = map_ids[start:start + GET_MANY_CHUNK_SIZE]
+      query = "SELECT * FROM maps WHERE map_id IN ({})".format(", ".join("?" * len(chunk)))
+      for row in connection.execute(query, chunk):
+        entries[row[0]] = MapCatalogEntry(*row)
+
+    return entries
+
+  def get(self, map_id):
+    """Return the catalog entry for the given map ID, or None if the map file does not exist."""
+    connection = self._get_connection()
+    filepath = os.path.join(self.maps_dir, get_map_filename(map_id))
+
+    try:
+      stat = os.stat(filepath)
+    except FileNotFoundError:
+      # Most missing maps were never catalogued, so a write transaction is only needed to remove a map that was deleted
+      if connection.execute("SELECT 1 FROM maps WHERE map_id = ?", (map_id,)).fetchone() is not None:
+        with connection:
+          connection.execute("DELETE FROM maps WHERE map_id = ?", (map_id,))
+      return None
+
+    row = connection.execute("SELECT * FROM maps WHERE map_id = ?", (map_id,)).fetchone()
+    if row is not None and (row[6], row[7]) == (stat.st_size, stat.st_mtime_ns):
+      return MapCatalogEntry(*row)
+
+    entry = read_map_catalog_entry(map_id, filepath, stat)
+    with connection:
+      connection.execute("INSERT OR REPLACE INTO maps VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entry)
+    return entry
+
+  def count(self):
+    return self._get_connection().execute("SELECT COUNT(*) FROM maps").fetchone()[0]
+
+  def _reset_after_fork(self):
+    self._local = threading.local()
+    self._sync_lock = threading.Lock()
+    self._refresh_thread = None
+
+  def _close_connection(self):
+    # Closes the SQLite connection of this thread, such as a refresh thread that is about to exit
+    connection = getattr(self._local, "connection", None)
+    if connection is not None:
+      connection.close()
+      self._local.connection = None
+
+  def _get_connection(self):
+    # SQLite connections cannot be shared between threads, so each thread gets its own.
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.database_path, timeout = 30)
+      self._local.connection = connection
+    return connection
+
+def get_dir_mtime_ns(dir):
+  try:
+    return os.stat(dir).st_mtime_ns
+  except FileNotFoundError:
+    return None
+
+def scan_map_files(maps_dir):
+  try:
+    with os.scandir(maps_dir) as dir_entries:
+      return [dir_entry for dir_entry in dir_entries if get_file_map_id(dir_entry.name) is not None and dir_entry.is_file()]
+  except FileNotFoundError:
+    return []
+
+def read_map_catalog_entry(map_id, filepath, stat):
+  try:
+    map_tags = scan_compressed_nbt_file(filepath, MAP_CATALOG_TAG_PATHS)
+    dimension = get_scanned_tag_value(map_tags, "data/dimension")
+    return MapCatalogEntry(
+      map_id,
+      get_scanned_tag_value(map_tags, "data/locked"),
+      get_scanned_tag_value(map_tags, "data/scale"),
+      str(dimension) if dimension is not None else None,
+      get_scanned_tag_value(map_tags, "data/xCenter"),
+      get_scanned_tag_value(map_tags, "data/zCenter"),
+      stat.st_size,
+      stat.st_mtime_ns)
+
+  # Files that cannot be decoded are still catalogued, but without any map metadata
+  except Exception:
+    return MapCatalogEntry(map_id, None, None, None, None, None, stat.st_size, stat.st_mtime_ns)
+
+def get_scanned_tag_value(scanned_tags, tag_path):
+  scanned_tag = scanned_tags.get(tag_path)
+  return scanned_tag.value if scanned_tag is not None else None
@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import multiprocessing
+import os
+import threading
+
+class MapPreparationPool:
+  """
+  Worker processes that validate and prepare the files of a map upload in parallel.
+
+  The workers are started by a forkserver, a separate single-threaded process, instead of being forked from the
+  application process, which may already be running threads such as upload job workers and the log listener.
+  If a worker dies, the pool is broken for good, so it is discarded and a new one is started when it is next used.
+  """
+
+  def __init__(self, workers):
+    self.workers = workers
+    self._executor = None
+    self._lock = threading.Lock()
+
+    # A forked child, such as a uWSGI worker, does not own the parent's pool and starts its own
+    os.register_at_fork(after_in_child = self._reset_after_fork)
+
+  def submit(self, function, *args):
+    # Raises BrokenProcessPool if the pool is broken, after discarding it
+    with self._lock:
+      if self._executor is None:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["mrt_file_server.utils.map_utils"])
+        self._executor = ProcessPoolExecutor(max_workers = self.workers, mp_context = context)
+      executor = self._executor
+
+    try:
+      return executor.submit(function, *args)
+    except BrokenProcessPool:
+      self.discard()
+      raise
+
+  def discard(self):
+    # Called when a worker died, so that the next upload starts a new pool instead of failing to submit to the broken one
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor is not None:
+      executor.shutdown(wait = False)
+
+  def shutdown(self):
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor is not None:
+      executor.shutdown()
+
+  def _reset_after_fork(self):
+    self._executor = None
+    self._lock = threading.Lock()
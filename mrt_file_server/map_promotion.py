@@ -0,0 +1,181 @@
+from mrt_file_server.utils.map_utils import get_file_map_id, is_invalid_map_format
+from mrt_file_server.utils.nbt_utils import decompress_nbt_buffer, scan_compressed_nbt_file
+
+from concurrent.futures import ThreadPoolExecutor
+
+import hashlib
+import json
+import os
+import threading
+
+# Statuses of the files in a promotion manifest
+PENDING = "pending"
+COPIED = "copied"
+PROMOTED = "promoted"
+REJECTED = "rejected"
+
+# The manifest is saved after this many files are copied, so an interrupted promotion repeats little work
+MANIFEST_SAVE_INTERVAL = 50
+
+class MapPromotion:
+  """
+  Moves uploaded maps into the world data directory, in a way that can be resumed after an interruption.
+
+  A manifest of the maps to promote is saved before any are moved. Each map is verified again, copied to a temporary
+  file in the target directory, flushed to disk and renamed over the old map, with several maps copied in parallel.
+  Only once the target directory itself has been flushed to disk are the uploaded files removed, so a map is never lost
+  if the machine crashes part way through. Running the promotion again continues from the saved manifest.
+  """
+
+  def __init__(self, uploads_dir, target_dir, manifest_file_path, workers):
+    self.uploads_dir = uploads_dir
+    self.target_dir = target_dir
+    self.manifest_file_path = manifest_file_path
+    self.workers = workers
+    self.manifest = None
+    self._manifest_lock = threading.RLock()
+    self._unsaved_count = 0
+
+  def load_or_build_manifest(self):
+    # Returns True if an interrupted promotion is being resumed
+    if os.path.isfile(self.manifest_file_path):
+      with open(self.manifest_file_path) as file:
+        self.manifest = json.load(file)
+      return True
+
+    filenames = sorted(filename for filename in os.listdir(self.uploads_dir) if get_file_map_id(filename) is not None)
+    self.manifest = { "files": { filename: { "status": PENDING } for filename in filenames } }
+    self.save_manifest()
+    return False
+
+  def run(self):
+    # Maps that were copied before an interruption are checked again, as the rename may not have reached the disk
+    filenames = [filename for filename, entry in self.manifest["files"].items() if entry["status"] in [PENDING, COPIED]]
+
+    with ThreadPoolExecutor(max_workers = self.workers) as executor:
+      list(executor.map(self.copy_map, filenames))
+    self.save_manifest()
+
+    fsync_directory(self.target_dir)
+
+    for filename, entry in self.manifest["files"].items():
+      if entry["status"] == COPIED:
+        remove_file(os.path.join(self.uploads_dir, filename))
+        entry["status"] = PROMOTED
+    fsync_directory(self.uploads_dir)
+
+    self.save_manifest()
+    os.remove(self.manifest_file_path)
+
+    return self.get_status_counts()
+
+  def copy_map(self, filename):
+    source_path = os.path.join(self.uploads_dir, filename)
+    target_path = os.path.join(self.target_dir, filename)
+    entry = self.manifest["files"][filename]
+
+    if not os.path.isfile(source_path):
+      # The upload was removed after the copy was renamed into place, but before the manifest was saved
+      status, reason = (COPIED, None) if entry.get("sha256") is not None and get_file_hash(target_path) == entry["sha256"] else (REJECTED, "Uploaded file no longer exists")
+      self.set_entry_status(filename, status, reason)
+      return
+
+    with open(source_path, "rb") as file:
+      map_buffer = file.read()
+    content_hash = hashlib.sha256(map_buffer).hexdigest()
+
+    # The map was already copied before an interruption. As uploaded maps are locked, it must not be checked against itself.
+    if get_file_hash(target_path) == content_hash:
+      self.set_entry_status(filename, COPIED, None, content_hash)
+      return
+
+    reason = get_rejection_reason(map_buffer, target_path)
+    if reason is not None:
+      self.set_entry_status(filename, REJECTED, reason)
+      return
+
+    temp_path = os.path.join(self.target_dir, ".{}.{}.tmp".format(filename, os.getpid()))
+    try:
+      with open(temp_path, "wb") as file:
+        file.write(map_buffer)
+        file.flush()
+        os.fsync(file.fileno())
+      os.replace(temp_path, target_path)
+    except BaseException:
+      remove_file(temp_path)
+      raise
+
+    self.set_entry_status(filename, COPIED, None, content_hash)
+
+  def set_entry_status(self, filename, status, reason, content_hash = None):
+    with self._manifest_lock:
+      entry = self.manifest["files"][filename]
+      entry["status"] = status
+      if reason is not None:
+        entry["reason"] = reason
+      if content_hash is not None:
+        entry["sha256"] = content_hash
+
+      self._unsaved_count += 1
+      if self._unsaved_count >= MANIFEST_SAVE_INTERVAL:
+        self.save_manifest()
+
+  def save_manifest(self):
+    with self._manifest_lock:
+      self._unsaved_count = 0
+      temp_path = "{}.tmp".format(self.manifest_file_path)
+      with open(temp_path, "w") as file:
+        json.dump(self.manifest, file, indent = 2)
+        file.flush()
+        os.fsync(file.fileno())
+      os.replace(temp_path, self.manifest_file_path)
+
+  def get_status_counts(self):
+    counts = { PENDING: 0, COPIED: 0, PROMOTED: 0, REJECTED: 0 }
+    for entry in self.manifest["files"].values():
+      counts[entry["status"]] += 1
+    return counts
+
+  def get_rejected_files(self):
+    return [(filename, entry.get("reason")) for filename, entry in self.manifest["files"].items() if entry["status"] == REJECTED]
+
+def get_rejection_reason(map_buffer, target_path):
+  # The same checks as a map upload, as the files may have been changed since they were uploaded
+  try:
+    uncompressed_buffer = decompress_nbt_buffer(map_buffer)
+  except Exception as e:
+    return "File is not a valid map format"
+
+  if is_invalid_map_format(uncompressed_buffer):
+    return "File is not a valid map format"
+
+  if os.path.isfile(target_path):
+    try:
+      locked_tag = scan_compressed_nbt_file(target_path, ["data/locked"]).get("data/locked")
+    except Exception as e:
+      locked_tag = None
+    if locked_tag is not None and locked_tag.value == 1:
+      return "Existing map file is locked"
+
+  return None
+
+def get_file_hash(filepath):
+  try:
+    with open(filepath, "rb") as file:
+      return hashlib.sha256(file.read()).hexdigest()
+  except FileNotFoundError:
+    return None
+
+def fsync_directory(directory):
+  # Makes the renames and removals of the files in the directory durable
+  fd = os.open(directory, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def remove_file(filepath):
+  try:
+    os.remove(filepath)
+  except FileNotFoundError:
+    pass
@@ -0,0 +1,193 @@
+from contextlib import contextmanager
+
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of every metric that can be recorded
+METRIC_DESCRIPTIONS = {
+  "mrt_http_request_duration_seconds": ("histogram", "Time taken to produce a response, by endpoint and method."),
+  "mrt_http_requests_total":           ("counter",   "Number of responses, by endpoint, method and status code."),
+  "mrt_http_response_bytes_total":     ("counter",   "Number of response body bytes sent, by endpoint."),
+  "mrt_operation_duration_seconds":    ("histogram", "Time taken by named internal operations, such as NBT parsing and map file writes.")
+}
+
+class MetricsRegistry:
+  """
+  Counters and latency histograms recorded by this process.
+  A single lock is held only long enough to update a few numbers, so recording a value is cheap even with many threads.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counters = {}
+    self._histograms = {}
+
+  def increment(self, name, labels, amount = 1):
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + amount
+
+  def observe(self, name, labels, value):
+    key = (name, tuple(sorted(labels.items())))
+    bucket_index = bisect.bisect_left(LATENCY_BUCKETS, value)
+
+    with self._lock:
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = { "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0 }
+      histogram["buckets"][bucket_index] += 1
+      histogram["sum"] += value
+      histogram["count"] += 1
+
+  def reset(self):
+    with self._lock:
+      self._counters.clear()
+      self._histograms.clear()
+
+  def snapshot(self):
+    # Returns a copy of all values that can be serialized to JSON and merged with the snapshots of other processes
+    with self._lock:
+      return {
+        "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+        "histograms": [[name, dict(labels), dict(histogram, buckets = list(histogram["buckets"]))] for (name, labels), histogram in self._histograms.items()]
+      }
+
+class MetricsSpool:
+  """
+  Shares the metrics of each process through a spool directory, so that every uWSGI worker's values are included in /metrics.
+  Each process periodically writes its snapshot to <pid>.json, and the snapshots of all processes are merged when they are read.
+  """
+
+  def __init__(self, spool_dir, registry, interval):
+    self.spool_dir = spool_dir
+    self.registry = registry
+    self.interval = interval
+    self._last_write_time = None
+
+  def write_if_due(self):
+    now = time.monotonic()
+    if self._last_write_time is None or now - self._last_write_time >= self.interval:
+      self._last_write_time = now
+      self.write()
+
+  def write(self):
+    spool_file_path = os.path.join(self.spool_dir, "{}.json".format(os.getpid()))
+    temp_file_path = "{}.{}.tmp".format(spool_file_path, threading.get_ident())
+
+    with open(temp_file_path, "w") as file:
+      json.dump(self.registry.snapshot(), file)
+    os.replace(temp_file_path, spool_file_path)
+
+  def collect(self):
+    # This process's snapshot is written first, so the result is up to date for at least the process serving the request
+    self.write()
+
+    snapshots = []
+    for spool_file_path in glob.glob(os.path.join(self.spool_dir, "*.json")):
+      try:
+        with open(spool_file_path) as file:
+          snapshots.append(json.load(file))
+      except (OSError, ValueError):
+        continue
+
+    return merge_snapshots(snapshots)
+
+  def remove_stale_files(self):
+    # Snapshots of processes that no longer exist are left over from before a restart
+    for spool_file_path in glob.glob(os.path.join(self.spool_dir, "*.json")):
+      pid = os.path.splitext(os.path.basename(spool_file_path))[0]
+      if pid.isdigit() and not is_process_running(int(pid)):
+        os.remove(spool_file_path)
+
+def is_process_running(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
+
+def merge_snapshots(snapshots):
+  counters = {}
+  histograms = {}
+
+  for snapshot in snapshots:
+    for name, labels, value in snapshot["counters"]:
+      key = (name, tuple(sorted(labels.items())))
+      counters[key] = counters.get(key, 0) + value
+
+    for name, labels, histogram in snapshot["histograms"]:
+      key = (name, tuple(sorted(labels.items())))
+      merged_histogram = histograms.get(key)
+      if merged_histogram is None:
+        histograms[key] = dict(histogram, buckets = list(histogram["buckets"]))
+      else:
+        merged_histogram["buckets"] = [a + b for a, b in zip(merged_histogram["buckets"], histogram["buckets"])]
+        merged_histogram["sum"] += histogram["sum"]
+        merged_histogram["count"] += histogram["count"]
+
+  return {
+    "counters": [[name, dict(labels), value] for (name, labels), value in sorted(counters.items())],
+    "histograms": [[name, dict(labels), histogram] for (name, labels), histogram in sorted(histograms.items())]
+  }
+
+def format_prometheus_text(snapshot):
+  lines = []
+  samples_by_name = {}
+
+  for name, labels, value in snapshot["counters"]:
+    samples_by_name.setdefault(name, []).append("{}{} {}".format(name, format_labels(labels), format_value(value)))
+
+  for name, labels, histogram in snapshot["histograms"]:
+    samples = samples_by_name.setdefault(name, [])
+    cumulative_count = 0
+    for upper_bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), histogram["buckets"]):
+      cumulative_count += bucket_count
+      samples.append("{}_bucket{} {}".format(name, format_labels(dict(labels, le = str(upper_bound))), cumulative_count))
+    samples.append("{}_sum{} {}".format(name, format_labels(labels), format_value(histogram["sum"])))
+    samples.append("{}_count{} {}".format(name, format_labels(labels), histogram["count"]))
+
+  for name in sorted(samples_by_name):
+    metric_type, help_text = METRIC_DESCRIPTIONS.get(name, ("untyped", ""))
+    lines.append("# HELP {} {}".format(name, help_text))
+    lines.append("# TYPE {} {}".format(name, metric_type))
+    lines.extend(samples_by_name[name])
+
+  return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+  if not labels:
+    return ""
+  return "{" + ",".join("{}=\"{}\"".format(name, escape_label_value(value)) for name, value in sorted(labels.items())) + "}"
+
+def escape_label_value(value):
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def format_value(value):
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+@contextmanager
+def timed(operation):
+  """
+  Record the time taken by the enclosed block in the operation duration histogram.
+  Also usable as a function decorator, e.g. @timed("load_compressed_nbt_buffer").
+  """
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    registry.observe("mrt_operation_duration_seconds", { "operation": operation }, time.perf_counter() - start)
+
+# Metrics recorded by this process
+registry = MetricsRegistry()
+
+# Values recorded by the parent before a fork belong to the parent, and must not be counted again by each worker
+os.register_at_fork(after_in_child = registry.reset)
@@ -0,0 +1,115 @@
+from collections import Counter, defaultdict
+
+from mrt_file_server.utils.file_utils import split_file_root_and_extension
+
+import bisect
+import os
+import threading
+
+SCHEMATIC_EXTENSIONS = [".schematic", ".schem"]
+
+# Minimum fraction of the query's trigrams that a file name must share to be a fuzzy match
+FUZZY_MATCH_THRESHOLD = 0.5
+
+class SchematicIndex:
+  """
+  In-memory search index of the schematic files in a directory.
+
+  File names are kept in a sorted list for prefix matches, with trigram postings for fuzzy matches.
+  The index is only updated when the directory's modification time changes, and then only for the files that were added or removed.
+  """
+
+  def __init__(self, schematics_dir):
+    self.schematics_dir = schematics_dir
+    self._dir_mtime_ns = None
+    self._sorted_keys = []
+    self._trigram_postings = defaultdict(set)
+    self._lock = threading.Lock()
+
+  def refresh(self):
+    try:
+      dir_mtime_ns = os.stat(self.schematics_dir).st_mtime_ns
+    except FileNotFoundError:
+      dir_mtime_ns = None
+
+    with self._lock:
+      if dir_mtime_ns == self._dir_mtime_ns and dir_mtime_ns is not None:
+        return
+
+      filenames = set(list_schematic_filenames(self.schematics_dir)) if dir_mtime_ns is not None else set()
+      indexed_filenames = set(filename for key, filename in self._sorted_keys)
+
+      for filename in indexed_filenames - filenames:
+        self._remove(filename)
+      for filename in filenames - indexed_filenames:
+        self._add(filename)
+
+      self._dir_mtime_ns = dir_mtime_ns
+
+  def search(self, query, offset, limit):
+    """
+    Return the total number of matches and the file names of the requested slice of them.
+    Names that start with the query come first in alphabetical order, followed by fuzzy matches from the most to the least similar.
+    """
+    self.refresh()
+    query = query.lower()
+
+    with self._lock:
+      prefix_matches = self._find_prefix_matches(query)
+      fuzzy_matches = self._find_fuzzy_matches(query, set(prefix_matches))
+
+    matches = prefix_matches + fuzzy_matches
+    return len(matches), matches[offset:offset + limit]
+
+  def _find_prefix_matches(self, query):
+    start = bisect.bisect_left(self._sorted_keys, (query, ""))
+    matches = []
+
+    for key, filename in self._sorted_keys[start:]:
+      if not key.startswith(query):
+        break
+      matches.append(filename)
+
+    return matches
+
+  def _find_fuzzy_matches(self, query, excluded_filenames):
+    query_trigrams = get_trigrams(query)
+    if not query_trigrams:
+      return []
+
+    shared_trigram_counts = Counter()
+    for trigram in query_trigrams:
+      shared_trigram_counts.update(self._trigram_postings.get(trigram, ()))
+
+    minimum_count = len(query_trigrams) * FUZZY_MATCH_THRESHOLD
+    candidates = [(-count, filename) for filename, count in shared_trigram_counts.items() if count >= minimum_count and filename not in excluded_filenames]
+    return [filename for negative_count, filename in sorted(candidates)]
+
+  def _add(self, filename):
+    key = get_search_key(filename)
+    bisect.insort(self._sorted_keys, (key, filename))
+    for trigram in get_trigrams(key):
+      self._trigram_postings[trigram].add(filename)
+
+  def _remove(self, filename):
+    key = get_search_key(filename)
+    index = bisect.bisect_left(self._sorted_keys, (key, filename))
+    del self._sorted_keys[index]
+    for trigram in get_trigrams(key):
+      postings = self._trigram_postings[trigram]
+      postings.discard(filename)
+      if not postings:
+        del self._trigram_postings[trigram]
+
+def list_schematic_filenames(schematics_dir):
+  with os.scandir(schematics_dir) as dir_entries:
+    return [dir_entry.name for dir_entry in dir_entries if split_file_root_and_extension(dir_entry.name)[1] in SCHEMATIC_EXTENSIONS and dir_entry.is_file()]
+
+def get_search_key(filename):
+  # Names are searched without their extension, ignoring case
+  return split_file_root_and_extension(filename)[0].lower()
+
+def get_trigrams(text):
+  # Padding lets the start of the text and short queries produce trigrams too
+  padded_text = "  {} ".format(text)
+  return set(padded_text[index:index + 3] for index in range(len(padded_text) - 2))
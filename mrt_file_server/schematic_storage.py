@@ -0,0 +1,188 @@
+from collections import namedtuple
+
+import errno
+import hashlib
+import os
+import stat
+import threading
+import uuid
+
+READ_CHUNK_SIZE = 64 * 1024
+
+DuplicateGroup = namedtuple("DuplicateGroup", ["content_hash", "size", "filenames", "inode_count"])
+
+class SchematicBlobStore:
+  """
+  Content-addressed storage for schematic files.
+
+  Each distinct file content is stored once as a blob named after its SHA-256 hash, and the user-facing files
+  are hardlinks to their blob. A blob whose only remaining link is itself is no longer used by any file.
+  The blob directory must be on the same filesystem as the directories whose files link to it.
+
+  Every link shares the blob's content, so editing one file in place would change every file with the same
+  content. Blobs are made read-only to prevent this, and files must be replaced with link_blob or a new file instead.
+  """
+
+  def __init__(self, blobs_dir):
+    self.blobs_dir = blobs_dir
+
+  def get_blob_path(self, content_hash):
+    return os.path.join(self.blobs_dir, content_hash[:2], content_hash)
+
+  def save_stream(self, stream, dir, filename, exclusive = False):
+    """
+    Hash the stream while writing it to a temporary blob, then link the file to the blob for its content.
+    If a blob with the same content already exists, the new copy is discarded.
+    If exclusive is True, FileExistsError is raised instead of replacing an existing file.
+    Returns the content hash.
+    """
+    os.makedirs(self.blobs_dir, exist_ok = True)
+    content_hash = hashlib.sha256()
+
+    # The temporary blob is created with the same permissions as a file created by open, so web servers can still read the linked files
+    temp_blob_path = os.path.join(self.blobs_dir, ".{}.tmp".format(uuid.uuid4().hex))
+    fd = os.open(temp_blob_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+      with os.fdopen(fd, "wb") as temp_blob:
+        for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+          content_hash.update(chunk)
+          temp_blob.write(chunk)
+        make_read_only(temp_blob.fileno())
+
+      content_hash = content_hash.hexdigest()
+      blob_path = self.get_blob_path(content_hash)
+      os.makedirs(os.path.dirname(blob_path), exist_ok = True)
+
+      # The file is linked while the temporary blob still exists, so a blob in use never has only one link and
+      # remove_orphaned_blobs cannot remove it. An existing blob can still be removed as orphaned just before the
+      # file is linked to it, in which case the temporary blob takes its place.
+      while True:
+        # Linking fails if the blob exists, so when the same content is uploaded at the same time, every file links to the first blob
+        try:
+          os.link(temp_blob_path, blob_path)
+        except FileExistsError:
+          pass
+
+        try:
+          self.link_blob(blob_path, dir, filename, exclusive = exclusive)
+          break
+        except FileNotFoundError:
+          if os.path.lexists(blob_path):
+            raise
+    finally:
+      if os.path.lexists(temp_blob_path):
+        os.remove(temp_blob_path)
+
+    return content_hash
+
+  def adopt_file(self, filepath, content_hash):
+    """
+    Make the existing file at filepath the blob for its content, or replace it with a link to the existing blob.
+    Returns True if the file was replaced by a link, freeing its disk space.
+    """
+    blob_path = self.get_blob_path(content_hash)
+
+    if not os.path.isfile(blob_path):
+      os.makedirs(os.path.dirname(blob_path), exist_ok = True)
+      make_read_only(filepath)
+      os.link(filepath, blob_path)
+      return False
+
+    if os.path.samefile(filepath, blob_path):
+      return False
+
+    self.link_blob(blob_path, os.path.dirname(filepath), os.path.basename(filepath), allow_copy = False)
+    return True
+
+  def link_blob(self, blob_path, dir, filename, allow_copy = True, exclusive = False):
+    # A temporary link is renamed over the destination, so the file is replaced atomically and never missing.
+    # If exclusive is True, it is linked to the destination instead, which raises FileExistsError if the destination exists.
+    temp_link_path = os.path.join(dir, ".{}.{}.{}.link".format(filename, os.getpid(), threading.get_ident()))
+    try:
+      os.link(blob_path, temp_link_path)
+    except OSError as e:
+      if e.errno != errno.EXDEV or not allow_copy:
+        raise
+      # The blob directory is on another filesystem, so the file is stored as a full copy instead
+      copy_file(blob_path, temp_link_path)
+
+    try:
+      if exclusive:
+        os.link(temp_link_path, os.path.join(dir, filename))
+      else:
+        os.replace(temp_link_path, os.path.join(dir, filename))
+    finally:
+      # A rename does nothing if the destination is already a link to the same blob, which leaves the temporary link behind
+      if os.path.lexists(temp_link_path):
+        os.remove(temp_link_path)
+
+  def remove_orphaned_blobs(self):
+    # Returns the number of blobs and bytes freed
+    removed_count = 0
+    removed_size = 0
+
+    for blob_dir_path, dirnames, filenames in os.walk(self.blobs_dir):
+      for filename in filenames:
+        # Temporary blobs of uploads in progress are not blobs yet
+        if filename.startswith("."):
+          continue
+
+        # Blobs can be removed by another process running this at the same time
+        blob_path = os.path.join(blob_dir_path, filename)
+        try:
+          stat = os.stat(blob_path)
+          if stat.st_nlink == 1:
+            os.remove(blob_path)
+            removed_count += 1
+            removed_size += stat.st_size
+        except FileNotFoundError:
+          pass
+
+    return removed_count, removed_size
+
+def make_read_only(path):
+  # Removes the write permissions of a file, given its path or file descriptor, and keeps its other permissions
+  os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def copy_file(src_path, dest_path):
+  with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+    for chunk in iter(lambda: src.read(READ_CHUNK_SIZE), b""):
+      dest.write(chunk)
+
+def hash_file(filepath):
+  content_hash = hashlib.sha256()
+  with open(filepath, "rb") as file:
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b""):
+      content_hash.update(chunk)
+  return content_hash.hexdigest()
+
+def find_duplicate_groups(directory):
+  """
+  Return the groups of files in the directory that have identical content.
+  Only files whose size matches another file's are hashed.
+  """
+  filenames_by_size = {}
+  with os.scandir(directory) as dir_entries:
+    for dir_entry in dir_entries:
+      if dir_entry.is_file(follow_symlinks = False) and not dir_entry.name.startswith("."):
+        filenames_by_size.setdefault(dir_entry.stat().st_size, []).append(dir_entry.name)
+
+  duplicate_groups = []
+  for size, filenames in sorted(filenames_by_size.items()):
+    if len(filenames) < 2:
+      continue
+
+    filenames_by_hash = {}
+    for filename in sorted(filenames):
+      filenames_by_hash.setdefault(hash_file(os.path.join(directory, filename)), []).append(filename)
+
+    for content_hash, hash_filenames in sorted(filenames_by_hash.items()):
+      if len(hash_filenames) > 1:
+        inode_count = len(set(os.stat(os.path.join(directory, filename)).st_ino for filename in hash_filenames))
+        duplicate_groups.append(DuplicateGroup(content_hash, size, hash_filenames, inode_count))
+
+  return duplicate_groups
+
+def get_reclaimable_size(duplicate_groups):
+  # Every copy beyond the first takes up disk space that linking to a shared blob would free
+  return sum(group.size * (group.inode_count - 1) for group in duplicate_groups)
@@ -0,0 +1,254 @@
+from flask import get_flashed_messages
+from werkzeug.datastructures import FileStorage
+
+from mrt_file_server.metrics import timed
+from mrt_file_server.utils.file_utils import get_filesize
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+# Statuses of an upload job. Each file of a job is "pending" until it has been processed, then has the category of its flash message.
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+PENDING = "pending"
+
+# A running job that has not been updated for this many seconds was left behind by a process that exited, and is queued again
+RUNNING_JOB_TIMEOUT = 60
+
+# Seconds that idle worker threads wait before checking again for jobs queued by other processes
+POLL_INTERVAL = 1
+
+# Result of a file whose processing raised an exception
+FAILURE_CATEGORY = "failure"
+FAILURE_MESSAGE = "Upload Failed! Please contact the admins for assistance."
+
+class UploadJobQueue:
+  """
+  Queue of uploads that are processed by background worker threads, instead of in the request that uploaded them.
+
+  The uploaded files are written to a spool directory and the job is recorded in an SQLite database, so the jobs are shared
+  by all uWSGI worker processes, and a job left unfinished by a process that exited is picked up again by another.
+  Each file is processed by the same function as an upload in the request, in a request context of its own,
+  and the message that would have been flashed to the uploader is saved as the file's result.
+  """
+
+  def __init__(self, app, database_path, spool_dir, workers, retention):
+    self.app = app
+    self.database_path = database_path
+    self.spool_dir = spool_dir
+    self.workers = workers
+    self.retention = retention
+    self._processors = {}
+    self._local = threading.local()
+    self._wakeup = threading.Event()
+    self._threads = []
+    self._threads_lock = threading.Lock()
+
+    connection = self._get_connection()
+    connection.execute("PRAGMA journal_mode = WAL")
+    with connection:
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+          job_id      TEXT PRIMARY KEY,
+          kind        TEXT NOT NULL,
+          username    TEXT NOT NULL,
+          remote_addr TEXT,
+          status      TEXT NOT NULL,
+          claim       TEXT,
+          created     REAL NOT NULL,
+          updated     REAL NOT NULL
+        )""")
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS job_files (
+          job_id        TEXT NOT NULL,
+          position      INTEGER NOT NULL,
+          filename      TEXT NOT NULL,
+          received_size INTEGER NOT NULL,
+          status        TEXT NOT NULL,
+          message       TEXT,
+          PRIMARY KEY (job_id, position)
+        )""")
+
+    # Worker threads do not survive a fork, so each uWSGI worker starts its own when it is first needed
+    os.register_at_fork(after_in_child = self._reset_after_fork)
+
+  def register_processor(self, kind, processor):
+    # The processor is called with the username and a FileStorage for each file, like upload_single_map
+    self._processors[kind] = processor
+
+  def submit(self, kind, username, remote_addr, files):
+    """Write the files to the spool directory and queue a job to process them. Returns the job ID."""
+    job_id = uuid.uuid4().hex
+    job_spool_dir = os.path.join(self.spool_dir, job_id)
+    os.makedirs(job_spool_dir)
+
+    file_rows = []
+    for position, file in enumerate(files):
+      # Files that were too large were discarded while they were received, so only their size is kept
+      received_size = get_filesize(file)
+      file.stream.seek(0)
+      with open(os.path.join(job_spool_dir, str(position)), "wb") as spool_file:
+        shutil.copyfileobj(file.stream, spool_file)
+      file_rows.append((job_id, position, file.filename, received_size, PENDING, None))
+
+    now = time.time()
+    connection = self._get_connection()
+    with connection:
+      connection.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, NULL, ?, ?)", (job_id, kind, username, remote_addr, QUEUED, now, now))
+      connection.executemany("INSERT INTO job_files VALUES (?, ?, ?, ?, ?, ?)", file_rows)
+
+    self.remove_expired_jobs()
+    self.start()
+    self._wakeup.set()
+    return job_id
+
+  def get(self, job_id):
+    """Return the status and per-file results of the job, or None if there is no such job."""
+    self.start()
+    connection = self._get_connection()
+
+    job_row = connection.execute("SELECT kind, status, created, updated FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if job_row is None:
+      return None
+
+    file_rows = connection.execute("SELECT filename, received_size, status, message FROM job_files WHERE job_id = ? ORDER BY position", (job_id,))
+
+    return {
+      "id": job_id,
+      "type": job_row[0],
+      "status": job_row[1],
+      "created": job_row[2],
+      "updated": job_row[3],
+      "files": [{ "fileName": filename, "size": received_size, "status": status, "message": message } for filename, received_size, status, message in file_rows]
+    }
+
+  def start(self):
+    # Worker threads are only started if the queue is enabled, even if another process left jobs in the database
+    with self._threads_lock:
+      if self._threads or not self.workers or not self.app.config["UPLOAD_JOB_QUEUE_ENABLED"]:
+        return
+
+      for index in range(self.workers):
+        thread = threading.Thread(target = self._run, name = "upload-job-worker-{}".format(index), daemon = True)
+        thread.start()
+        self._threads.append(thread)
+
+  def process_next_job(self):
+    """Claim the oldest queued job and process its remaining files. Returns False if there were no jobs to process."""
+    job_row = self.claim_next_job()
+    if job_row is None:
+      return False
+
+    job_id, kind, username, remote_addr, claim = job_row
+    processor = self._processors[kind]
+    connection = self._get_connection()
+    file_rows = connection.execute("SELECT position, filename, received_size FROM job_files WHERE job_id = ? AND status = ? ORDER BY position", (job_id, PENDING)).fetchall()
+
+    with timed("upload_job"):
+      for position, filename, received_size in file_rows:
+        status, message = self.process_file(processor, username, remote_addr, os.path.join(self.spool_dir, job_id, str(position)), filename, received_size)
+
+        # Every update is made only while this worker still holds the claim. If the job took so long that it was
+        # queued again and claimed by another worker, this worker stops and leaves the remaining files to that worker.
+        with connection:
+          if connection.execute("UPDATE jobs SET updated = ? WHERE job_id = ? AND claim = ?", (time.time(), job_id, claim)).rowcount == 0:
+            self.app.logger.warning("Upload job was claimed by another worker, stopping: '%s'", job_id)
+            return True
+          connection.execute("UPDATE job_files SET status = ?, message = ? WHERE job_id = ? AND position = ?", (status, message, job_id, position))
+
+    with connection:
+      if connection.execute("UPDATE jobs SET status = ?, updated = ? WHERE job_id = ? AND claim = ?", (FINISHED, time.time(), job_id, claim)).rowcount == 0:
+        self.app.logger.warning("Upload job was claimed by another worker, stopping: '%s'", job_id)
+        return True
+    shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors = True)
+
+    return True
+
+  def claim_next_job(self):
+    # Returns the job ID, kind, username, remote address and claim of the claimed job, or None if there were no jobs to claim
+    now = time.time()
+    claim = uuid.uuid4().hex
+    connection = self._get_connection()
+
+    # Idle workers poll every POLL_INTERVAL, so they only read until there is a job to claim, and never take the database write lock
+    if connection.execute("SELECT 1 FROM jobs WHERE status = ? OR (status = ? AND updated < ?) LIMIT 1", (QUEUED, RUNNING, now - RUNNING_JOB_TIMEOUT)).fetchone() is None:
+      return None
+
+    with connection:
+      # The claim is cleared, so a worker that is still processing the job finds it has lost the job
+      connection.execute("UPDATE jobs SET status = ?, claim = NULL WHERE status = ? AND updated < ?", (QUEUED, RUNNING, now - RUNNING_JOB_TIMEOUT))
+
+      # A single statement both finds and claims the job, so two workers can never claim the same job
+      connection.execute("""
+        UPDATE jobs SET status = ?, claim = ?, updated = ?
+        WHERE job_id = (SELECT job_id FROM jobs WHERE status = ? ORDER BY created LIMIT 1)""", (RUNNING, claim, now, QUEUED))
+
+    return connection.execute("SELECT job_id, kind, username, remote_addr, claim FROM jobs WHERE claim = ?", (claim,)).fetchone()
+
+  def process_file(self, processor, username, remote_addr, spool_file_path, filename, received_size):
+    # Returns the category and text of the message flashed while processing the file
+    try:
+      with open(spool_file_path, "rb") as spool_file, self.app.test_request_context(environ_base = { "REMOTE_ADDR": remote_addr }):
+        processor(username, FileStorage(stream = SpooledFileStream(spool_file, received_size), filename = filename))
+        flashes = get_flashed_messages(with_categories = True)
+    except Exception:
+      self.app.logger.exception("Upload job failed to process file: '%s' (Username: '%s')", filename, username)
+      return FAILURE_CATEGORY, FAILURE_MESSAGE
+
+    if not flashes:
+      return FAILURE_CATEGORY, FAILURE_MESSAGE
+
+    category, message = flashes[-1]
+    return category, str(message)
+
+  def remove_expired_jobs(self):
+    connection = self._get_connection()
+    with connection:
+      connection.execute("DELETE FROM job_files WHERE job_id IN (SELECT job_id FROM jobs WHERE status = ? AND updated < ?)", (FINISHED, time.time() - self.retention))
+      connection.execute("DELETE FROM jobs WHERE status = ? AND updated < ?", (FINISHED, time.time() - self.retention))
+
+  def _run(self):
+    while True:
+      try:
+        if self.process_next_job():
+          continue
+      except Exception:
+        self.app.logger.exception("Upload job worker failed.")
+
+      self._wakeup.wait(POLL_INTERVAL)
+      self._wakeup.clear()
+
+  def _reset_after_fork(self):
+    self._local = threading.local()
+    self._wakeup = threading.Event()
+    self._threads = []
+    self._threads_lock = threading.Lock()
+
+  def _get_connection(self):
+    # SQLite connections cannot be shared between threads, so each thread gets its own.
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.database_path, timeout = 30)
+      self._local.connection = connection
+    return connection
+
+class SpooledFileStream:
+  """
+  Readable stream of a spooled upload, which reports the size of the file as it was received,
+  so a file that was discarded for being too large is still rejected as too large.
+  """
+
+  def __init__(self, file, received_size):
+    self._file = file
+    self.received_size = received_size
+
+  def __iter__(self):
+    return iter(self._file)
+
+  def __getattr__(self, name):
+    return getattr(self._file, name)
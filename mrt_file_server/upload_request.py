@@ -0,0 +1,65 @@
+from flask import Request, current_app
+
+import io
+import tempfile
+
+# Upload routes, and the config variables that hold the maximum size of each file uploaded to them
+MAX_FILE_SIZE_CONFIG_KEYS = {
+  "map.route_map_upload":             "MAP_UPLOAD_MAX_FILE_SIZE",
+  "schematic.route_schematic_upload": "SCHEMATIC_UPLOAD_MAX_FILE_SIZE"
+}
+
+# Parts up to this many bytes are kept in memory, and larger ones are moved to a temporary file, the same threshold as Werkzeug's
+MAX_IN_MEMORY_PART_SIZE = 500 * 1024
+
+class UploadRequest(Request):
+  """
+  Request that streams each uploaded file part to a spooled temporary file while it is being received.
+  On upload routes, the content of a part is discarded as soon as it grows past the route's maximum file size,
+  so oversized files never occupy memory or disk no matter how many are sent. The rest of the part is still
+  received, only counted, so that the request can report which files were too large.
+  """
+
+  def _get_file_stream(self, total_content_length, content_type, filename = None, content_length = None):
+    max_file_size = self.max_file_size
+
+    if max_file_size is None:
+      return Request._get_file_stream(self, total_content_length, content_type, filename, content_length)
+
+    return SizeLimitedFileStream(max_file_size)
+
+  @property
+  def max_file_size(self):
+    config_key = MAX_FILE_SIZE_CONFIG_KEYS.get(self.endpoint)
+    return current_app.config[config_key] if config_key else None
+
+class SizeLimitedFileStream:
+  """
+  Writable and readable file stream backed by a temporary file, which is kept in memory while it is small.
+  Once more than max_size bytes have been written, the content is discarded and further writes are only counted.
+  """
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.received_size = 0
+    self.exceeded = False
+    self._file = tempfile.SpooledTemporaryFile(max_size = MAX_IN_MEMORY_PART_SIZE)
+
+  def write(self, data):
+    self.received_size += len(data)
+
+    if not self.exceeded and self.received_size > self.max_size:
+      self.exceeded = True
+      self._file.close()
+      self._file = io.BytesIO()
+
+    if not self.exceeded:
+      self._file.write(data)
+
+    return len(data)
+
+  def __iter__(self):
+    return iter(self._file)
+
+  def __getattr__(self, name):
+    return getattr(self._file, name)
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+import os
+import threading
+
+class FileStatCache:
+  """
+  Caches a value derived from a file, and only reloads it when the file's inode, size or modification time changes.
+  Hit and miss counters are kept so the effectiveness of the cache can be monitored.
+  """
+
+  def __init__(self, loader):
+    self.loader = loader
+    self.hits = 0
+    self.misses = 0
+    self._entries = {}
+    self._lock = threading.Lock()
+
+  def get(self, filepath):
+    signature = get_file_signature(filepath)
+
+    with self._lock:
+      entry = self._entries.get(filepath)
+      if entry is not None and entry[0] == signature:
+        self.hits += 1
+        return entry[1]
+
+    value = self.loader(filepath)
+
+    with self._lock:
+      self.misses += 1
+      self._entries[filepath] = (signature, value)
+
+    return value
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    with self._lock:
+      return { "hits": self.hits, "misses": self.misses, "entries": len(self._entries) }
+
+class LRUCache:
+  """
+  Thread-safe mapping that holds at most max_size items, discarding the least recently used item when full.
+  """
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      value = self._entries.get(key)
+      if value is None:
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last = False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    with self._lock:
+      return { "hits": self.hits, "misses": self.misses, "entries": len(self._entries) }
+
+def get_file_signature(filepath):
+  stat = os.stat(filepath)
+  return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,169 @@
+from flask import Response, abort, current_app, request, send_from_directory
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.security import safe_join
+
+from mrt_file_server.utils.cache_utils import LRUCache
+
+from urllib.parse import quote
+
+import hashlib
+import mimetypes
+import os
+import secrets
+
+# Requests for more byte ranges than this are answered with the whole file instead
+MAX_BYTE_RANGES = 16
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Maximum number of file content hashes kept in memory for use as ETags
+CONTENT_HASH_CACHE_SIZE = 1024
+
+def send_download(directory, filename, cache_control = None):
+  filepath = safe_join(directory, filename)
+  if filepath is None or not os.path.isfile(filepath):
+    abort(404)
+
+  stat = os.stat(filepath)
+  etag, weak_etag = get_file_etag(filepath, stat)
+  last_modified = http_date(stat.st_mtime)
+
+  # Clients and proxies revalidating a copy they already have are answered without opening the file
+  if not is_resource_modified(request.environ, etag, last_modified = last_modified):
+    response = Response(status = 304)
+    response.set_etag(etag, weak_etag)
+    response.headers["Last-Modified"] = last_modified
+    return set_cache_control(response, cache_control)
+
+  return set_cache_control(send_file_response(directory, filename, filepath, stat, etag, weak_etag, last_modified), cache_control)
+
+def send_file_response(directory, filename, filepath, stat, etag, weak_etag, last_modified):
+  delivery_mode = current_app.config["DOWNLOAD_DELIVERY_MODE"]
+
+  # In the offloaded modes, the front-end server reads the file and handles byte ranges itself, so the worker is free straight away
+  if delivery_mode == "x-accel-redirect":
+    relative_path = os.path.relpath(filepath, current_app.config["DOWNLOADS_DIR"]).replace(os.sep, "/")
+    return send_offloaded(filepath, stat, etag, weak_etag, last_modified, "X-Accel-Redirect", quote(current_app.config["DOWNLOAD_X_ACCEL_REDIRECT_PREFIX"] + relative_path))
+  elif delivery_mode == "x-sendfile":
+    return send_offloaded(filepath, stat, etag, weak_etag, last_modified, "X-Sendfile", filepath)
+
+  # Single byte ranges, If-Range and conditional requests are handled by werkzeug.
+  # Requests for several ranges at once are answered here with a multipart/byteranges response.
+  byte_range = request.range
+  if byte_range is not None and 1 < len(byte_range.ranges) <= MAX_BYTE_RANGES and is_range_request_processable(etag, weak_etag, last_modified):
+    return send_byte_ranges(filepath, stat, etag, weak_etag, last_modified, byte_range.ranges)
+
+  # Werkzeug rejects requests for several ranges as unsatisfiable, so the Range header of requests for too many is ignored.
+  # Conditional requests were already answered above, so nothing else is lost by skipping werkzeug's conditional handling.
+  conditional = byte_range is None or len(byte_range.ranges) <= MAX_BYTE_RANGES
+
+  # Werkzeug only sends strong ETags, and would match a weak one against If-Range. Without an ETag of its own,
+  # it sends the whole file for an If-Range with any entity tag, as a weak ETag requires.
+  response = send_from_directory(directory, filename, as_attachment = True, etag = False if weak_etag else etag, conditional = conditional)
+  response.set_etag(etag, weak_etag)
+  response.headers["Accept-Ranges"] = "bytes"
+  return response
+
+def set_cache_control(response, cache_control):
+  if cache_control:
+    response.headers["Cache-Control"] = cache_control
+  return response
+
+def get_file_etag(filepath, stat):
+  # Returns the ETag of the file, and whether it is weak.
+  # Files too large to hash on demand use a validator that changes whenever the file is replaced or modified, and can be computed without reading it.
+  # It is weak, since a file rewritten in place within the filesystem's timestamp resolution keeps its ETag, so it must not be used to combine byte ranges.
+  if stat.st_size > current_app.config["DOWNLOAD_CONTENT_HASH_MAX_FILE_SIZE"]:
+    return "{:x}-{:x}-{:x}".format(stat.st_ino, stat.st_mtime_ns, stat.st_size), True
+
+  # Otherwise the content is hashed once per version of the file, so identical files share an ETag
+  key = (filepath, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+  etag = content_hash_cache.get(key)
+  if etag is None:
+    etag = hash_file_content(filepath)
+    content_hash_cache.put(key, etag)
+
+  return etag, False
+
+def hash_file_content(filepath):
+  content_hash = hashlib.blake2b(digest_size = 16)
+  with open(filepath, "rb") as file:
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b""):
+      content_hash.update(chunk)
+  return content_hash.hexdigest()
+
+def is_range_request_processable(etag, weak_etag, last_modified):
+  # A Range request with a stale If-Range validator must be answered with the whole file, and a weak ETag never matches If-Range
+  if "HTTP_IF_RANGE" not in request.environ:
+    return True
+  if weak_etag and request.if_range.etag is not None:
+    return False
+  return not is_resource_modified(request.environ, etag, last_modified = last_modified, ignore_if_range = False)
+
+def send_offloaded(filepath, stat, etag, weak_etag, last_modified, header_name, header_value):
+  filename = os.path.basename(filepath)
+
+  response = Response(mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream")
+  response.headers[header_name] = header_value
+  response.headers["Last-Modified"] = last_modified
+  response.headers.set("Content-Disposition", "attachment", filename = filename)
+  response.set_etag(etag, weak_etag)
+  response.make_conditional(request)
+
+  # The body is filled in by the front-end server, but the length is known here
+  response.content_length = stat.st_size
+  return response
+
+def send_byte_ranges(filepath, stat, etag, weak_etag, last_modified, ranges):
+  file_size = stat.st_size
+  resolved_ranges = [resolved_range for resolved_range in (resolve_byte_range(begin, end, file_size) for begin, end in ranges) if resolved_range is not None]
+
+  if not resolved_ranges:
+    raise RequestedRangeNotSatisfiable(length = file_size)
+
+  filename = os.path.basename(filepath)
+  content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+  boundary = secrets.token_hex(16)
+
+  part_headers = [
+    "\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(boundary, content_type, start, stop - 1, file_size).encode("latin-1")
+    for start, stop in resolved_ranges]
+  closing_boundary = "\r\n--{}--\r\n".format(boundary).encode("latin-1")
+
+  content_length = sum(len(part_header) + stop - start for part_header, (start, stop) in zip(part_headers, resolved_ranges)) + len(closing_boundary)
+
+  def generate():
+    with open(filepath, "rb") as file:
+      for part_header, (start, stop) in zip(part_headers, resolved_ranges):
+        yield part_header
+        file.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+          chunk = file.read(min(READ_CHUNK_SIZE, remaining))
+          if not chunk:
+            return
+          remaining -= len(chunk)
+          yield chunk
+    yield closing_boundary
+
+  response = Response(generate(), status = 206, mimetype = "multipart/byteranges; boundary={}".format(boundary))
+  response.headers["Content-Length"] = str(content_length)
+  response.headers["Accept-Ranges"] = "bytes"
+  response.headers["Last-Modified"] = last_modified
+  response.headers.set("Content-Disposition", "attachment", filename = filename)
+  response.set_etag(etag, weak_etag)
+  return response
+
+def resolve_byte_range(begin, end, file_size):
+  # Converts a parsed range into absolute (start, stop) offsets, or None if it lies outside the file
+  if begin < 0:
+    start = max(file_size + begin, 0)
+    stop = file_size
+  else:
+    start = begin
+    stop = file_size if end is None else min(end, file_size)
+
+  return (start, stop) if start < stop else None
+
+content_hash_cache = LRUCache(CONTENT_HASH_CACHE_SIZE)
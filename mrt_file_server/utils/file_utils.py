@@ -1,14 +1,76 @@
+from contextlib import contextmanager
+
+import fcntl
 import os
+import tempfile
+import uuid
+import zlib
+
+# Names are spread over this many lock files in each namespace, so the number of lock files stays bounded
+LOCK_FILE_COUNT = 256
 
 def get_filesize(file):
+  # Streams created by UploadRequest know the full size of the part, even if its content was discarded for being too large
+  received_size = getattr(file.stream, "received_size", None)
+  if received_size is not None:
+    return received_size
+
   file.seek(0, os.SEEK_END)
   filesize = file.tell()
   file.seek(0)
   return filesize
 
+def read_file(filepath):
+  with open(filepath, "rb") as file:
+    return file.read()
+
 def split_file_root_and_extension(filename):
   return os.path.splitext(filename)
 
 def file_exists_in_dir(dir, filename):
   filepath = os.path.join(dir, filename)
-  return os.path.isfile(filepath)
\ No newline at end of file
+  return os.path.isfile(filepath)
+
+@contextmanager
+def open_atomic_file(dir, filename):
+  # Write to a hidden temporary file in the same directory, then rename it into place so that the file never appears partially written.
+  fd, temp_filepath = tempfile.mkstemp(dir = dir, prefix = ".", suffix = ".tmp")
+  try:
+    with os.fdopen(fd, "wb") as file:
+      yield file
+    os.replace(temp_filepath, os.path.join(dir, filename))
+  except BaseException:
+    if os.path.isfile(temp_filepath):
+      os.remove(temp_filepath)
+    raise
+
+@contextmanager
+def open_exclusive_file(dir, filename):
+  # Like open_atomic_file, but the file is linked into place instead of renamed, which raises FileExistsError rather than replacing an existing file.
+  # The temporary file is created with the same permissions as a file created by open, so web servers can still read it.
+  temp_filepath = os.path.join(dir, ".{}.{}.tmp".format(filename, uuid.uuid4().hex))
+  fd = os.open(temp_filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+  try:
+    with os.fdopen(fd, "wb") as file:
+      yield file
+    os.link(temp_filepath, os.path.join(dir, filename))
+  finally:
+    if os.path.isfile(temp_filepath):
+      os.remove(temp_filepath)
+
+@contextmanager
+def lock_name(locks_dir, namespace, name):
+  """
+  Hold an exclusive lock on a name, such as the filename of an upload, while checking for and creating the file.
+  The lock is an flock on a file in locks_dir, so it is shared by every thread and uWSGI worker process,
+  and is released by the operating system if the process exits. Different names rarely share a lock file,
+  so uploads of different files do not wait for each other.
+  """
+  lock_filename = "{}-{:02x}.lock".format(namespace, zlib.crc32(name.encode("utf-8")) % LOCK_FILE_COUNT)
+  fd = os.open(os.path.join(locks_dir, lock_filename), os.O_RDWR | os.O_CREAT, 0o644)
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    yield
+  finally:
+    # Closing the file releases the lock
+    os.close(fd)
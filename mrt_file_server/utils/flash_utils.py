@@ -10,4 +10,8 @@ def flash_by_key(app, key, filename = None):
   if filename:
     flash(Markup("{}: {}".format(filename, flash_message.message.format(filename))), flash_message.category)
   else:
-    flash(Markup(flash_message.message), flash_message.category)
\ No newline at end of file
+    flash(Markup(flash_message.message), flash_message.category)
+
+def flash_formatted_by_key(app, key, *args):
+  flash_message = get_flash_message(app, key)
+  flash(Markup(flash_message.message.format(*args)), flash_message.category)
@@ -1,4 +1,10 @@
-from mrt_file_server import app, logger, log_adapter
+from flask import current_app, request
+
+from mrt_file_server.request_log_adapter import RequestLogAdapter
+
+import logging
+
+log_adapter = RequestLogAdapter(logging.getLogger("mrt_file_server"), request)
 
 def log_info(key, *args, **kwargs):
   log(log_adapter.info, key, *args, **kwargs)
@@ -13,4 +19,4 @@ def log(log_function, key, *args, **kwargs):
   log_function(get_log_message(key), *args, **kwargs)
 
 def get_log_message(key):
-  return app.config["LOG_MESSAGES"][key]
\ No newline at end of file
+  return current_app.config["LOG_MESSAGES"][key]
\ No newline at end of file
@@ -0,0 +1,61 @@
+import numpy
+import struct
+import zlib
+
+MAP_SIZE = 128
+
+# Base map colors by color ID, from the Minecraft Java Edition map item format.
+# Color ID 0 is transparent.
+MAP_BASE_COLORS = [
+  (0, 0, 0),       (127, 178, 56),  (247, 233, 163), (199, 199, 199), (255, 0, 0),     (160, 160, 255), (167, 167, 167), (0, 124, 0),
+  (255, 255, 255), (164, 168, 184), (151, 109, 77),  (112, 112, 112), (64, 64, 255),   (143, 119, 72),  (255, 252, 245), (216, 127, 51),
+  (178, 76, 216),  (102, 153, 216), (229, 229, 51),  (127, 204, 25),  (242, 127, 165), (76, 76, 76),    (153, 153, 153), (76, 127, 153),
+  (127, 63, 178),  (51, 76, 178),   (102, 76, 51),   (102, 127, 51),  (153, 51, 51),   (25, 25, 25),    (250, 238, 77),  (92, 219, 213),
+  (74, 128, 255),  (0, 217, 58),    (129, 86, 49),   (112, 2, 0),     (209, 177, 161), (159, 82, 36),   (149, 87, 108),  (112, 108, 138),
+  (186, 133, 36),  (103, 117, 53),  (160, 77, 78),   (57, 41, 35),    (135, 107, 98),  (87, 92, 92),    (122, 73, 88),   (76, 62, 92),
+  (76, 50, 35),    (76, 82, 42),    (142, 60, 46),   (37, 22, 16),    (189, 48, 49),   (148, 63, 97),   (92, 25, 29),    (22, 126, 134),
+  (58, 142, 140),  (86, 44, 62),    (20, 180, 133),  (100, 100, 100), (216, 175, 147), (127, 167, 150)
+]
+
+# Each base color is drawn in four shades. The lower two bits of a map color byte select the shade.
+MAP_SHADE_MULTIPLIERS = [180, 220, 255, 135]
+
+def build_map_palette():
+  # Returns a 256 x 4 RGBA lookup table indexed by the unsigned map color byte.
+  # Color bytes beyond the known base colors are left transparent.
+  palette = numpy.zeros((256, 4), dtype = numpy.uint8)
+  base_colors = numpy.array(MAP_BASE_COLORS, dtype = numpy.uint32)
+
+  for shade, multiplier in enumerate(MAP_SHADE_MULTIPLIERS):
+    color_bytes = numpy.arange(len(MAP_BASE_COLORS)) * 4 + shade
+    palette[color_bytes, :3] = base_colors * multiplier // 255
+    palette[color_bytes, 3] = 255
+
+  # The first base color is transparent in every shade
+  palette[0:4] = 0
+  return palette
+
+MAP_PALETTE = build_map_palette()
+
+def render_map_png(colors):
+  """Convert the 128 x 128 colors byte array of a map into a PNG image."""
+  color_bytes = numpy.frombuffer(colors, dtype = numpy.uint8)
+  if color_bytes.size != MAP_SIZE * MAP_SIZE:
+    raise ValueError("Map colors must contain {} bytes, not {}".format(MAP_SIZE * MAP_SIZE, color_bytes.size))
+
+  rgba = MAP_PALETTE[color_bytes].reshape(MAP_SIZE, MAP_SIZE * 4)
+  return encode_rgba_png(rgba, MAP_SIZE, MAP_SIZE)
+
+def encode_rgba_png(rgba, width, height):
+  # Each PNG scanline starts with a filter type byte, which is 0 (no filter) for every row here
+  scanlines = numpy.zeros((height, width * 4 + 1), dtype = numpy.uint8)
+  scanlines[:, 1:] = rgba
+
+  header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+  return b"\x89PNG\r\n\x1a\n" + \
+    encode_png_chunk(b"IHDR", header) + \
+    encode_png_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 9)) + \
+    encode_png_chunk(b"IEND", b"")
+
+def encode_png_chunk(chunk_type, data):
+  return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
@@ -0,0 +1,130 @@
+from mrt_file_server.utils.file_utils import open_atomic_file
+from mrt_file_server.utils.nbt_utils import compress_nbt_buffer, decompress_nbt_buffer, decompress_nbt_stream, load_uncompressed_nbt_buffer, patch_scanned_byte_tag, save_compressed_nbt_buffer, scan_nbt_buffer, set_compressed_nbt_map_byte_value, set_nbt_map_byte_value
+
+import io
+import os
+import re
+import stat
+
+# NBT map fields that must exist for a file to be accepted as a map
+REQUIRED_MAP_TAG_PATHS = [
+  "data/dimension",
+  "data/locked",
+  "data/colors",
+  "data/scale",
+  "data/trackingPosition",
+  "data/xCenter",
+  "data/zCenter"
+]
+
+# These functions do not depend on the Flask application, so they can also be run in worker processes.
+
+def get_file_map_id(filename):
+  match = re.search(r"(?<=^map_)\d+(?=\.dat$)", filename)
+  if match:
+    return int(match.group())
+  return None
+
+def get_map_filename(map_id):
+  return "map_{}.dat".format(map_id)
+
+def parse_map_id_ranges(values, max_count = None):
+  """
+  Return the sorted, distinct map IDs of a list of map IDs and inclusive ranges of map IDs, e.g. [1500, "2000-2999"].
+  Raises ValueError for a value that is not a map ID or a valid range, or if there are more than max_count map IDs.
+  """
+  map_ids = set()
+  for value in values:
+    try:
+      first, _, last = str(value).strip().partition("-")
+      first = int(first)
+      last = int(last) if last else first
+    except ValueError:
+      raise ValueError("\"{}\" is not a map ID or range of map IDs.".format(value))
+
+    if first < 0 or last < first:
+      raise ValueError("\"{}\" is not a valid range of map IDs.".format(value))
+
+    # A huge range is rejected before it is expanded
+    if max_count is not None and last - first + 1 > max_count:
+      raise ValueError("More than {} map IDs were requested.".format(max_count))
+
+    map_ids.update(range(first, last + 1))
+    if max_count is not None and len(map_ids) > max_count:
+      raise ValueError("More than {} map IDs were requested.".format(max_count))
+
+  return sorted(map_ids)
+
+def prepare_map_buffer(compressed_buffer, max_uncompressed_size = None):
+  # Used by worker processes, which are sent the bytes of the upload. The stream wraps the bytes without copying them.
+  return prepare_map_stream(io.BytesIO(compressed_buffer), max_uncompressed_size)
+
+def prepare_map_stream(compressed_stream, max_uncompressed_size = None):
+  # Decompress the uploaded map once, validate it, lock it, and return the compressed result.
+  # Returns None if the stream is not a valid map, or decompresses to more than max_uncompressed_size bytes.
+  try:
+    uncompressed_buffer = decompress_nbt_stream(compressed_stream, max_uncompressed_size)
+  except Exception as e:
+    return None
+
+  map_tags = scan_map_tags(uncompressed_buffer)
+  if map_tags is None:
+    return None
+
+  # Usually the locked byte can be patched where it is, without building the full NBT tree or copying the buffer
+  patched_buffer = patch_scanned_byte_tag(uncompressed_buffer, map_tags["data/locked"], 1, in_place = True)
+  if patched_buffer is not None:
+    return compress_nbt_buffer(patched_buffer)
+
+  try:
+    nbt_file = load_uncompressed_nbt_buffer(io.BytesIO(uncompressed_buffer))
+  except Exception as e:
+    return None
+
+  set_nbt_map_byte_value(nbt_file, "locked", 1)
+  return save_compressed_nbt_buffer(nbt_file)
+
+def is_invalid_map_format(uncompressed_buffer):
+  return scan_map_tags(uncompressed_buffer) is None
+
+def scan_map_tags(uncompressed_buffer):
+  # Check that all the required NBT map fields in the file exist, without decoding the rest of the file.
+  # Returns the scanned fields, or None if the file is not a valid map.
+  try:
+    map_tags = scan_nbt_buffer(uncompressed_buffer, REQUIRED_MAP_TAG_PATHS)
+
+  # If there are any errors scanning the file as an NBT, then the file is invalid
+  except Exception as e:
+    return None
+
+  if any(tag_path not in map_tags for tag_path in REQUIRED_MAP_TAG_PATHS):
+    return None
+
+  return map_tags
+
+def set_map_file_locked(map_file_path, locked):
+  # Returns True if the map was changed, False if it was already locked or unlocked, or None if the file is not a map.
+  # Maps from before Minecraft 1.14 have no locked field, which is added to them.
+  with open(map_file_path, "rb") as file:
+    compressed_buffer = file.read()
+
+  uncompressed_buffer = decompress_nbt_buffer(compressed_buffer)
+  map_tags = scan_nbt_buffer(uncompressed_buffer, ["data/colors", "data/locked"])
+  if "data/colors" not in map_tags:
+    return None
+
+  locked_tag = map_tags.get("data/locked")
+  if locked_tag is not None and locked_tag.value == int(locked):
+    return False
+
+  patched_buffer = patch_scanned_byte_tag(uncompressed_buffer, locked_tag, int(locked))
+  if patched_buffer is not None:
+    map_buffer = compress_nbt_buffer(patched_buffer)
+  else:
+    map_buffer = set_compressed_nbt_map_byte_value(compressed_buffer, "locked", int(locked))
+  file_mode = stat.S_IMODE(os.stat(map_file_path).st_mode)
+  with open_atomic_file(os.path.dirname(map_file_path), os.path.basename(map_file_path)) as file:
+    os.fchmod(file.fileno(), file_mode)
+    file.write(map_buffer)
+
+  return True
@@ -1,22 +1,97 @@
+from collections import namedtuple
 from nbt.nbt import *
 
+from mrt_file_server.metrics import timed
+
 import io
 import gzip
+import struct
+import zlib
+
+# zlib's default level, which Minecraft also uses. Level 9 takes almost twice as long for files no smaller.
+NBT_COMPRESS_LEVEL = 6
+
+# Number of bytes read from a compressed stream, and the most that each step of its decompression outputs
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
 
+# zlib window bits for decompressing the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+@timed("load_compressed_nbt_file")
 def load_compressed_nbt_file(filename):
   return NBTFile(filename)
 
+@timed("load_compressed_nbt_buffer")
 def load_compressed_nbt_buffer(compressed_buffer):
-  uncompresssed_buffer = gzip.decompress(compressed_buffer)
+  uncompresssed_buffer = decompress_nbt_buffer(compressed_buffer)
   bytes_io = io.BytesIO(uncompresssed_buffer)
   return load_uncompressed_nbt_buffer(bytes_io)
 
+def decompress_nbt_buffer(compressed_buffer):
+  return gzip.decompress(compressed_buffer)
+
+@timed("decompress_nbt_stream")
+def decompress_nbt_stream(stream, max_size = None):
+  """
+  Decompress a gzip stream into a single bytearray, a chunk at a time, so the compressed file never has to be read
+  into memory at once and no intermediate copies of the decompressed data are made.
+  Raises MalformedFileError if the stream is not valid gzip, or if it decompresses to more than max_size bytes.
+  """
+  uncompressed_buffer = bytearray()
+  decompressor = zlib.decompressobj(GZIP_WBITS)
+
+  try:
+    for chunk in iter(lambda: stream.read(DECOMPRESS_CHUNK_SIZE), b""):
+      while chunk:
+        decompress_nbt_chunk(decompressor, chunk, uncompressed_buffer, max_size)
+        chunk = decompressor.unconsumed_tail
+
+        # A gzip file may have several members, which are decompressed one after another the same as gzip.decompress
+        if decompressor.eof:
+          chunk = decompressor.unused_data
+          if chunk:
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+
+    # Output held back by the size limit of the last step
+    while not decompressor.eof and decompress_nbt_chunk(decompressor, b"", uncompressed_buffer, max_size):
+      pass
+  except zlib.error as e:
+    raise MalformedFileError("Invalid gzip data: {}".format(e))
+
+  if not decompressor.eof:
+    raise MalformedFileError("Partial File Parse: file possibly truncated.")
+
+  return uncompressed_buffer
+
+def decompress_nbt_chunk(decompressor, chunk, uncompressed_buffer, max_size):
+  # Appends the output to the buffer, and returns its length. One byte over max_size is enough to know the file is too large.
+  max_length = DECOMPRESS_CHUNK_SIZE if max_size is None else min(DECOMPRESS_CHUNK_SIZE, max_size + 1 - len(uncompressed_buffer))
+  output = decompressor.decompress(chunk, max_length)
+  uncompressed_buffer += output
+
+  if max_size is not None and len(uncompressed_buffer) > max_size:
+    raise MalformedFileError("File decompresses to more than {} bytes.".format(max_size))
+
+  return len(output)
+
+@timed("compress_nbt_buffer")
+def compress_nbt_buffer(uncompressed_buffer):
+  return gzip.compress(uncompressed_buffer, compresslevel = NBT_COMPRESS_LEVEL)
+
+@timed("load_uncompressed_nbt_buffer")
 def load_uncompressed_nbt_buffer(uncompresssed_buffer):
   return NBTFile(buffer=uncompresssed_buffer)
 
+@timed("save_compressed_nbt_file")
 def save_compressed_nbt_file(nbt):
   nbt.write_file()
 
+@timed("save_compressed_nbt_buffer")
+def save_compressed_nbt_buffer(nbt):
+  bytes_io = io.BytesIO()
+  nbt.write_file(fileobj=bytes_io)
+  return bytes_io.getvalue()
+
 def get_nbt_map_value(nbt, tag_name):
   data = get_nbt_tag(nbt, "data")
   if data is None:
@@ -39,3 +114,152 @@ def set_nbt_byte_value(parent, name, value):
   tag.name = name
   tag.value = int(value)
   parent.__setitem__(name, tag)
+
+@timed("set_compressed_nbt_map_byte_value")
+def set_compressed_nbt_map_byte_value(compressed_buffer, tag_name, value):
+  """
+  Return the compressed map with the given byte field of its data compound set to value.
+  If the field exists as a TAG_Byte, only that byte is patched. Otherwise, the full NBT tree is loaded and saved again.
+  """
+  uncompressed_buffer = decompress_nbt_buffer(compressed_buffer)
+  tag_path = "data/{}".format(tag_name)
+
+  patched_buffer = patch_scanned_byte_tag(uncompressed_buffer, scan_nbt_buffer(uncompressed_buffer, [tag_path]).get(tag_path), value)
+  if patched_buffer is not None:
+    return compress_nbt_buffer(patched_buffer)
+
+  nbt_file = load_uncompressed_nbt_buffer(io.BytesIO(uncompressed_buffer))
+  set_nbt_map_byte_value(nbt_file, tag_name, value)
+  return save_compressed_nbt_buffer(nbt_file)
+
+def patch_scanned_byte_tag(uncompressed_buffer, scanned_tag, value, in_place = False):
+  # Returns a copy of the buffer with the byte of the scanned tag set to value, or None if the tag is missing or is not a TAG_Byte.
+  # If in_place is True, the buffer must be a bytearray, and is patched and returned instead of a copy.
+  if scanned_tag is None or scanned_tag.tag_type != TAG_BYTE:
+    return None
+
+  patched_buffer = uncompressed_buffer if in_place else bytearray(uncompressed_buffer)
+  patched_buffer[scanned_tag.offset] = int(value) & 0xFF
+  return patched_buffer
+
+# Streaming NBT scanner
+#
+# Walks an uncompressed NBT buffer without building a tree of tag objects. Only the tags at the requested paths
+# (e.g. "data/locked") are recorded, with their type and payload offset, and array payloads are skipped without being copied.
+# Use this for read-only checks, and only build a full NBTFile when the file needs to be modified.
+
+ScannedTag = namedtuple("ScannedTag", ["tag_type", "offset", "length", "value"])
+
+SCALAR_TAG_STRUCTS = {
+  TAG_BYTE:   struct.Struct(">b"),
+  TAG_SHORT:  struct.Struct(">h"),
+  TAG_INT:    struct.Struct(">i"),
+  TAG_LONG:   struct.Struct(">q"),
+  TAG_FLOAT:  struct.Struct(">f"),
+  TAG_DOUBLE: struct.Struct(">d")
+}
+
+ARRAY_TAG_ITEM_SIZES = {
+  TAG_BYTE_ARRAY: 1,
+  TAG_INT_ARRAY:  4,
+  TAG_LONG_ARRAY: 8
+}
+
+UNSIGNED_SHORT_STRUCT = struct.Struct(">H")
+INT_STRUCT = struct.Struct(">i")
+
+def scan_compressed_nbt_file(filename, tag_paths):
+  with open(filename, "rb") as file:
+    return scan_nbt_buffer(decompress_nbt_buffer(file.read()), tag_paths)
+
+@timed("scan_nbt_buffer")
+def scan_nbt_buffer(uncompressed_buffer, tag_paths):
+  """
+  Return a dict of tag path to ScannedTag for each of the given paths that exist in the buffer.
+  Raises MalformedFileError if the buffer is not a complete NBT file.
+  """
+  view = memoryview(uncompressed_buffer)
+  found_tags = {}
+
+  try:
+    if len(view) == 0 or view[0] != TAG_COMPOUND:
+      raise MalformedFileError("First record is not a Compound Tag")
+
+    name_length = UNSIGNED_SHORT_STRUCT.unpack_from(view, 1)[0]
+    end_offset = scan_nbt_payload(view, 3 + name_length, TAG_COMPOUND, "", frozenset(tag_paths), found_tags)
+  except (struct.error, IndexError, UnicodeDecodeError):
+    raise MalformedFileError("Partial File Parse: file possibly truncated.")
+
+  if end_offset > len(view):
+    raise MalformedFileError("Partial File Parse: file possibly truncated.")
+
+  return found_tags
+
+def scan_nbt_payload(view, offset, tag_type, path, tag_paths, found_tags):
+  # Returns the offset just after the payload. Tags inside lists have no path and are never recorded.
+  scalar_struct = SCALAR_TAG_STRUCTS.get(tag_type)
+
+  if scalar_struct is not None:
+    if path in tag_paths:
+      found_tags[path] = ScannedTag(tag_type, offset, scalar_struct.size, scalar_struct.unpack_from(view, offset)[0])
+    return offset + scalar_struct.size
+
+  if tag_type in ARRAY_TAG_ITEM_SIZES:
+    count = INT_STRUCT.unpack_from(view, offset)[0]
+    start = offset + INT_STRUCT.size
+    end = start + count * ARRAY_TAG_ITEM_SIZES[tag_type]
+    if count < 0 or end > len(view):
+      raise MalformedFileError("Partial File Parse: file possibly truncated.")
+    if path in tag_paths:
+      found_tags[path] = ScannedTag(tag_type, start, end - start, None)
+    return end
+
+  if tag_type == TAG_STRING:
+    length = UNSIGNED_SHORT_STRUCT.unpack_from(view, offset)[0]
+    start = offset + UNSIGNED_SHORT_STRUCT.size
+    end = start + length
+    if end > len(view):
+      raise MalformedFileError("Partial File Parse: file possibly truncated.")
+    if path in tag_paths:
+      found_tags[path] = ScannedTag(tag_type, start, length, view[start:end].tobytes().decode("utf-8"))
+    return end
+
+  if tag_type == TAG_LIST:
+    item_type = view[offset]
+    count = INT_STRUCT.unpack_from(view, offset + 1)[0]
+    start = offset + 1 + INT_STRUCT.size
+    if path in tag_paths:
+      found_tags[path] = ScannedTag(tag_type, start, count, None)
+
+    # Lists of fixed size items can be skipped in one step
+    item_struct = SCALAR_TAG_STRUCTS.get(item_type)
+    if item_struct is not None:
+      return start + max(count, 0) * item_struct.size
+
+    offset = start
+    for _ in range(count):
+      offset = scan_nbt_payload(view, offset, item_type, None, tag_paths, found_tags)
+    return offset
+
+  if tag_type == TAG_COMPOUND:
+    start = offset
+    while True:
+      child_type = view[offset]
+      offset += 1
+      if child_type == TAG_END:
+        break
+
+      name_length = UNSIGNED_SHORT_STRUCT.unpack_from(view, offset)[0]
+      offset += UNSIGNED_SHORT_STRUCT.size
+      if path is None:
+        child_path = None
+      else:
+        name = view[offset:offset + name_length].tobytes().decode("utf-8")
+        child_path = "{}/{}".format(path, name) if path else name
+      offset = scan_nbt_payload(view, offset + name_length, child_type, child_path, tag_paths, found_tags)
+
+    if path in tag_paths:
+      found_tags[path] = ScannedTag(tag_type, start, offset - start, None)
+    return offset
+
+  raise MalformedFileError("Unknown tag type: {}".format(tag_type))
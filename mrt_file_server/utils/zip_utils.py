@@ -0,0 +1,54 @@
+import zipfile
+
+READ_CHUNK_SIZE = 64 * 1024
+
+class ZipStreamBuffer:
+  """
+  Write-only, unseekable sink for zipfile. Written bytes are collected until they are drained,
+  so an archive can be streamed piece by piece without being held in memory or written to a temporary file.
+  """
+
+  def __init__(self):
+    self._chunks = []
+
+  def write(self, data):
+    self._chunks.append(bytes(data))
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def drain(self):
+    data = b"".join(self._chunks)
+    self._chunks.clear()
+    return data
+
+def generate_stored_zip(entries):
+  """
+  Generate a ZIP archive from (filepath, archive name) pairs. Files are stored without compression.
+  Files that no longer exist when their turn comes are left out.
+  """
+  buffer = ZipStreamBuffer()
+
+  with zipfile.ZipFile(buffer, "w", compression = zipfile.ZIP_STORED) as zip_file:
+    for filepath, archive_name in entries:
+      try:
+        zip_info = zipfile.ZipInfo.from_file(filepath, archive_name)
+        source_file = open(filepath, "rb")
+      except FileNotFoundError:
+        continue
+
+      zip_info.compress_type = zipfile.ZIP_STORED
+
+      with source_file, zip_file.open(zip_info, "w") as archive_file:
+        while True:
+          chunk = source_file.read(READ_CHUNK_SIZE)
+          if not chunk:
+            break
+          archive_file.write(chunk)
+          yield buffer.drain()
+
+      yield buffer.drain()
+
+  # Central directory
+  yield buffer.drain()
@@ -0,0 +1,56 @@
+from tests.test_base import TestBase
+from unittest.mock import patch
+
+from mrt_file_server.log_queue import BatchedRotatingFileHandler
+from types import SimpleNamespace
+
+import modes
+import pytest
+import subprocess
+import sys
+
+class TestAppFactory(TestBase):
+
+  # Tests
+
+  def test_create_app_registers_blueprints(self):
+    assert set(["world", "map", "schematic", "api"]) <= set(self.app.blueprints)
+    assert self.app.extensions["mrt_file_server"].map_catalog is not None
+
+  def test_create_app_without_upload_job_queue_does_not_serve_jobs(self):
+    # Upload jobs are disabled by default, so the jobs pages are not registered and no job worker threads are started
+    upload_job_queue = self.app.extensions["mrt_file_server"].upload_job_queue
+
+    assert "jobs" not in self.app.blueprints
+    assert self.client.get("/jobs/0123456789abcdef").status_code == 404
+    assert upload_job_queue.get("0123456789abcdef") is None
+    assert upload_job_queue._threads == []
+
+  def test_create_app_returns_independent_apps(self):
+    from mrt_file_server import create_app
+
+    other_app = create_app(modes.TEST)
+
+    assert other_app is not self.app
+    assert other_app.extensions["mrt_file_server"] is not self.app.extensions["mrt_file_server"]
+
+  @pytest.mark.parametrize("worker_process_count, expected_max_bytes", [(1, 1024), (4, 0)])
+  def test_create_app_only_rotates_log_file_with_single_process(self, worker_process_count, expected_max_bytes):
+    from mrt_file_server import create_app, logger
+
+    with patch.dict(sys.modules, { "uwsgi": SimpleNamespace(numproc = worker_process_count) }), \
+         patch("mrt_file_server.default_config.LOG_FILE_MAX_BYTES", 1024):
+      create_app(modes.TEST)
+
+    try:
+      assert [handler.maxBytes for handler in logger.handlers if isinstance(handler, BatchedRotatingFileHandler)] == [expected_max_bytes]
+    finally:
+      # The log handlers are shared by the whole process, so those of the default configuration are restored
+      create_app(modes.TEST)
+
+  def test_import_does_not_load_heavy_modules(self):
+    # The map preview renderer and its NumPy dependency are only imported when a preview is first rendered
+    script = "import sys, mrt_file_server; mrt_file_server.create_app(); print(' '.join(sorted(name for name in ['numpy', 'mrt_file_server.utils.map_preview_utils'] if name in sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", script], capture_output = True, text = True, check = True)
+
+    assert result.stdout.strip() == ""
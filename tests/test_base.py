@@ -5,14 +5,14 @@ import glob
 import modes
 import os
 
+# Created once, and shared by all tests
+app = None
+
 class TestBase:
   def setup(self):
-    os.environ[modes.ENVIRONMENT_VARIABLE] = modes.TEST
-
     self.TEST_DATA_ROOT = os.path.dirname(os.path.realpath(__file__))
 
-    import mrt_file_server
-    self.app = mrt_file_server.app
+    self.app = get_test_app()
     self.app.testing = True
     self.client = self.app.test_client()
 
@@ -74,3 +74,12 @@ class TestBase:
 
   def flash_message_html(self, message, category):
     return "<li class=\"flash-{}\" name=\"flash_message\">{}</li>".format(category, message)
+
+def get_test_app():
+  global app
+
+  if app is None:
+    from mrt_file_server import create_app
+    app = create_app(modes.TEST)
+
+  return app
@@ -0,0 +1,123 @@
+from mrt_file_server.log_queue import BatchedRotatingFileHandler, BatchingQueueListener, create_log_queue, running_listeners
+from unittest.mock import patch
+
+import logging
+import os
+import queue
+import tempfile
+
+class TestLogQueue:
+  def setup(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.log_file_path = os.path.join(self.temp_dir.name, "server.log")
+
+    self.logger = logging.getLogger("test_log_queue")
+    self.logger.setLevel(logging.INFO)
+    self.logger.propagate = False
+
+  def teardown(self):
+    for handler in list(self.logger.handlers):
+      self.logger.removeHandler(handler)
+    self.temp_dir.cleanup()
+
+  # Tests
+
+  def test_queued_records_should_be_written_on_stop(self):
+    file_handler = self.create_file_handler()
+    listener = self.configure_log_queue(file_handler, batch_size = 8)
+
+    for index in range(20):
+      self.logger.info("Record %d", index)
+
+    listener.stop()
+    file_handler.close()
+
+    assert self.read_log_lines() == ["Record {}".format(index) for index in range(20)]
+
+  def test_batch_should_be_flushed_once(self):
+    file_handler = self.create_file_handler()
+    records = [self.logger.makeRecord(self.logger.name, logging.INFO, __file__, 0, "Record %d", (index,), None) for index in range(10)]
+
+    listener = BatchingQueueListener(queue.SimpleQueue(), [file_handler], 64)
+
+    with patch("logging.handlers.RotatingFileHandler.flush") as mock_flush:
+      listener.handle_batch(records)
+
+    mock_flush.assert_called_once_with(file_handler)
+    file_handler.close()
+
+    assert len(self.read_log_lines()) == 10
+
+  def test_records_below_handler_level_should_be_skipped(self):
+    file_handler = self.create_file_handler()
+    file_handler.setLevel(logging.WARNING)
+    listener = self.configure_log_queue(file_handler, batch_size = 8)
+
+    self.logger.info("Information")
+    self.logger.warning("Warning")
+
+    listener.stop()
+    file_handler.close()
+
+    assert self.read_log_lines() == ["Warning"]
+
+  def test_log_file_should_rotate_by_size(self):
+    file_handler = self.create_file_handler(max_bytes = 100, backup_count = 2)
+    listener = self.configure_log_queue(file_handler, batch_size = 8)
+
+    for index in range(50):
+      self.logger.info("Record %d", index)
+
+    listener.stop()
+    file_handler.close()
+
+    assert sorted(os.listdir(self.temp_dir.name)) == ["server.log", "server.log.1", "server.log.2"]
+    assert all(os.path.getsize(os.path.join(self.temp_dir.name, filename)) <= 100 for filename in os.listdir(self.temp_dir.name))
+
+  def test_closing_queue_handler_should_stop_listener(self):
+    file_handler = self.create_file_handler()
+    queue_handler, listener = create_log_queue([file_handler], 8)
+    self.logger.addHandler(queue_handler)
+
+    self.logger.info("Record")
+
+    # The same as configure_logger replacing the handlers of an application created earlier
+    self.logger.removeHandler(queue_handler)
+    queue_handler.close()
+
+    assert listener not in running_listeners
+    assert file_handler.stream is None
+    assert self.read_log_lines() == ["Record"]
+
+  def test_forked_process_should_restart_listener(self):
+    file_handler = self.create_file_handler()
+    queue_handler, listener = create_log_queue([file_handler], 8)
+    self.logger.addHandler(queue_handler)
+
+    pid = os.fork()
+    if pid == 0:
+      try:
+        self.logger.info("Child")
+        queue_handler.close()
+      finally:
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    self.logger.info("Parent")
+    queue_handler.close()
+
+    assert sorted(self.read_log_lines()) == ["Child", "Parent"]
+
+  # Helper Functions
+
+  def create_file_handler(self, max_bytes = 0, backup_count = 0):
+    return BatchedRotatingFileHandler(self.log_file_path, maxBytes = max_bytes, backupCount = backup_count)
+
+  def configure_log_queue(self, handler, batch_size):
+    queue_handler, listener = create_log_queue([handler], batch_size)
+    self.logger.addHandler(queue_handler)
+    return listener
+
+  def read_log_lines(self):
+    with open(self.log_file_path) as file:
+      return file.read().splitlines()
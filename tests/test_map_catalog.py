@@ -0,0 +1,142 @@
+from test_map_base import TestMapBase
+from unittest.mock import patch
+
+from mrt_file_server.map_catalog import MapCatalog
+
+import os
+import shutil
+import tempfile
+
+class TestMapCatalog(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.temp_dir = tempfile.mkdtemp()
+    self.maps_dir = os.path.join(self.temp_dir, "maps")
+    self.database_path = os.path.join(self.temp_dir, "map_catalog.sqlite3")
+    os.makedirs(self.maps_dir)
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    shutil.rmtree(self.temp_dir)
+
+  # Tests
+
+  def test_sync_should_catalog_map_files_only(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+    self.copy_test_data_file("existing_locked.dat", self.maps_dir, "map_1501.dat")
+    self.copy_test_data_file("idcounts.dat", self.maps_dir)
+
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+
+    assert catalog.sync() == 2
+    assert catalog.count() == 2
+
+    unlocked_map = catalog.get(1500)
+    assert unlocked_map.locked == 0
+    assert unlocked_map.scale == 0
+    assert unlocked_map.size == os.path.getsize(os.path.join(self.maps_dir, "map_1500.dat"))
+
+    assert catalog.get(1501).locked == 1
+
+  def test_sync_should_only_decode_changed_files(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+    self.copy_test_data_file("map_1501.dat", self.maps_dir)
+
+    MapCatalog(self.database_path, self.maps_dir).sync()
+
+    # A new catalog on the same database simulates an application restart
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+    assert catalog.sync() == 0
+
+    self.copy_test_data_file("existing_locked.dat", self.maps_dir, "map_1501.dat")
+    assert catalog.sync() == 1
+    assert catalog.get(1501).locked == 1
+
+  def test_sync_should_remove_deleted_files(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+    catalog.sync()
+
+    os.remove(os.path.join(self.maps_dir, "map_1500.dat"))
+    catalog.sync()
+
+    assert catalog.count() == 0
+
+  def test_get_missing_map_should_only_write_if_catalogued(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+    catalog.sync()
+    os.remove(os.path.join(self.maps_dir, "map_1500.dat"))
+
+    statements = []
+    catalog._get_connection().set_trace_callback(statements.append)
+
+    assert catalog.get(1501) is None
+    assert not [statement for statement in statements if statement.startswith("DELETE")]
+
+    assert catalog.get(1500) is None
+    assert [statement for statement in statements if statement.startswith("DELETE")]
+    assert catalog.count() == 0
+
+  def test_get_should_refresh_changed_file_without_sync(self):
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+    catalog.sync()
+
+    assert catalog.get(1500) is None
+
+    self.copy_test_data_file("existing_unlocked.dat", self.maps_dir, "map_1500.dat")
+    assert catalog.get(1500).locked == 0
+
+    self.copy_test_data_file("existing_locked.dat", self.maps_dir, "map_1500.dat")
+    assert catalog.get(1500).locked == 1
+
+  def test_get_should_not_decode_unchanged_file(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+    catalog.sync()
+
+    with patch("mrt_file_server.map_catalog.read_map_catalog_entry") as mock_read:
+      assert catalog.get(1500).locked == 0
+      mock_read.assert_not_called()
+
+  def test_sync_if_stale_should_only_sync_after_directory_changes(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+
+    assert catalog.sync_if_stale(60)
+    assert not catalog.sync_if_stale(60)
+
+    self.copy_test_data_file("existing_locked.dat", self.maps_dir, "map_1501.dat")
+    os.utime(self.maps_dir, ns = (0, os.stat(self.maps_dir).st_mtime_ns + 1))
+
+    assert catalog.sync_if_stale(60)
+    assert catalog.count() == 2
+
+    # Once the catalog is older than the maximum age, it is synced again in the background to pick up maps changed in place
+    self.copy_test_data_file("existing_locked.dat", self.maps_dir, "map_1500.dat")
+    os.utime(os.path.join(self.maps_dir, "map_1500.dat"), ns = (0, os.stat(os.path.join(self.maps_dir, "map_1500.dat")).st_mtime_ns + 1))
+    os.utime(self.maps_dir, ns = (0, os.stat(self.maps_dir).st_mtime_ns))
+
+    with patch("mrt_file_server.map_catalog.threading.Thread.start") as mock_start:
+      assert not catalog.sync_if_stale(0)
+      mock_start.assert_called_once()
+
+    assert catalog.get_many([1500])[1500].locked == 0
+    catalog._refresh()
+    assert catalog.get_many([1500])[1500].locked == 1
+
+  def test_get_many_should_return_existing_maps_only(self):
+    self.copy_test_data_file("map_1500.dat", self.maps_dir)
+    self.copy_test_data_file("existing_locked.dat", self.maps_dir, "map_1502.dat")
+
+    catalog = MapCatalog(self.database_path, self.maps_dir)
+    catalog.sync()
+
+    entries = catalog.get_many(range(1000, 2000))
+
+    assert sorted(entries) == [1500, 1502]
+    assert entries[1502].locked == 1
@@ -1,9 +1,13 @@
 from test_map_base import TestMapBase
 from unittest.mock import patch
 
+from mrt_file_server.utils import download_utils
 from werkzeug.datastructures import OrderedMultiDict
+from io import BytesIO
 
+import hashlib
 import pytest
+import zipfile
 
 class TestMapDownload(TestMapBase):
   def setup(self):
@@ -107,6 +111,195 @@ class TestMapDownload(TestMapBase):
 
     mock_logger.warn.assert_called_with(self.get_log_message("MAP_DOWNLOAD_FORBIDDEN"), filename)
 
+  def test_download_should_have_strong_etag_and_accept_ranges(self):
+    filename = "map_1500.dat"
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename)
+
+    assert response.status_code == 200
+    assert response.headers.get("Accept-Ranges") == "bytes"
+    assert response.get_etag()[0] is not None
+    assert response.get_etag()[1] == False
+
+  def test_download_etag_should_be_content_hash(self):
+    filename = "map_1500.dat"
+    file_content = self.load_test_data_file(filename)
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename)
+
+    assert response.get_etag()[0] == hashlib.blake2b(file_content, digest_size = 16).hexdigest()
+    assert response.headers.get("Cache-Control") == self.app.config["MAP_DOWNLOAD_CACHE_CONTROL"]
+
+  def test_download_content_hash_should_be_computed_once(self):
+    filename = "map_1500.dat"
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    with patch("mrt_file_server.utils.download_utils.hash_file_content", wraps = download_utils.hash_file_content) as mock_hash_file_content:
+      download_utils.content_hash_cache.clear()
+      first_etag = self.start_download(filename).get_etag()[0]
+      second_etag = self.start_download(filename).get_etag()[0]
+
+    assert first_etag == second_etag
+    assert mock_hash_file_content.call_count == 1
+
+  def test_download_with_current_if_none_match_should_not_be_modified(self):
+    filename = "map_1500.dat"
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    first_response = self.start_download(filename)
+
+    with patch("mrt_file_server.utils.download_utils.send_file_response") as mock_send_file_response:
+      second_response = self.start_download(filename, headers = { "If-None-Match": first_response.headers.get("ETag") })
+
+    assert second_response.status_code == 304
+    assert second_response.data == b""
+    assert second_response.headers.get("ETag") == first_response.headers.get("ETag")
+    assert second_response.headers.get("Cache-Control") == self.app.config["MAP_DOWNLOAD_CACHE_CONTROL"]
+    mock_send_file_response.assert_not_called()
+
+  def test_download_with_current_if_modified_since_should_not_be_modified(self):
+    filename = "map_1500.dat"
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    first_response = self.start_download(filename)
+    second_response = self.start_download(filename, headers = { "If-Modified-Since": first_response.headers.get("Last-Modified") })
+
+    assert second_response.status_code == 304
+
+  def test_download_with_stale_if_none_match_should_return_whole_file(self):
+    filename = "map_1500.dat"
+    file_content = self.load_test_data_file(filename)
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename, headers = { "If-None-Match": "\"stale\"" })
+
+    assert response.status_code == 200
+    assert response.data == file_content
+
+  def test_download_single_range_should_return_partial_content(self):
+    filename = "map_1500.dat"
+    file_content = self.load_test_data_file(filename)
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename, headers = { "Range": "bytes=10-19" })
+
+    assert response.status_code == 206
+    assert response.headers.get("Content-Range") == "bytes 10-19/{}".format(len(file_content))
+    assert response.data == file_content[10:20]
+
+  def test_download_multiple_ranges_should_return_multipart_byteranges(self):
+    filename = "map_1500.dat"
+    file_content = self.load_test_data_file(filename)
+    file_size = len(file_content)
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename, headers = { "Range": "bytes=0-4, -6" })
+
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+    assert int(response.headers.get("Content-Length")) == len(response.data)
+
+    boundary = response.mimetype_params["boundary"].encode("latin-1")
+    expected_data = \
+      b"\r\n--" + boundary + b"\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 0-4/" + str(file_size).encode() + b"\r\n\r\n" + file_content[0:5] + \
+      b"\r\n--" + boundary + b"\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes " + "{}-{}/{}".format(file_size - 6, file_size - 1, file_size).encode() + b"\r\n\r\n" + file_content[-6:] + \
+      b"\r\n--" + boundary + b"--\r\n"
+
+    assert response.data == expected_data
+
+  def test_download_too_many_ranges_should_return_whole_file(self):
+    from mrt_file_server.utils.download_utils import MAX_BYTE_RANGES
+
+    filename = "map_1500.dat"
+    file_content = self.load_test_data_file(filename)
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    ranges = ", ".join("{0}-{0}".format(index * 2) for index in range(MAX_BYTE_RANGES + 1))
+    response = self.start_download(filename, headers = { "Range": "bytes={}".format(ranges) })
+
+    assert response.status_code == 200
+    assert response.headers.get("Content-Range") is None
+    assert response.data == file_content
+
+  def test_download_range_with_stale_if_range_should_return_whole_file(self):
+    filename = "map_1500.dat"
+    file_content = self.load_test_data_file(filename)
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename, headers = { "Range": "bytes=0-4, 10-14", "If-Range": "\"stale\"" })
+
+    assert response.status_code == 200
+    assert response.data == file_content
+
+  def test_download_range_with_current_if_range_should_return_partial_content(self):
+    filename = "map_1500.dat"
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    etag = self.start_download(filename).get_etag()[0]
+    response = self.start_download(filename, headers = { "Range": "bytes=0-4, 10-14", "If-Range": "\"{}\"".format(etag) })
+
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+
+  def test_download_unsatisfiable_ranges_should_fail(self):
+    filename = "map_1500.dat"
+    file_size = len(self.load_test_data_file(filename))
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.start_download(filename, headers = { "Range": "bytes={}-{}, {}-".format(file_size, file_size + 10, file_size + 20) })
+
+    assert response.status_code == 416
+    assert response.headers.get("Content-Range") == "bytes */{}".format(file_size)
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_download_range_should_be_successful(self, mock_logger):
+    test_data_file_names = ["map_1500.dat", "map_1501.dat", "map_1502.dat"]
+
+    # Map 1501 is missing from the range, and is left out of the archive
+    self.copy_test_data_file(test_data_file_names[0], self.downloads_dir)
+    self.copy_test_data_file(test_data_file_names[2], self.downloads_dir)
+
+    response = self.start_range_download("1500", "1502")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    assert response.headers.get("Content-Disposition") == "attachment; filename=maps_1500-1502.zip"
+
+    with zipfile.ZipFile(BytesIO(response.data)) as zip_file:
+      assert zip_file.namelist() == ["map_1500.dat", "map_1502.dat"]
+
+      for zip_info in zip_file.infolist():
+        assert zip_info.compress_type == zipfile.ZIP_STORED
+        assert zip_file.read(zip_info) == self.load_test_data_file(zip_info.filename)
+
+    mock_logger.info.assert_called_with(self.get_log_message("MAP_DOWNLOAD_RANGE_SUCCESS"), "maps_1500-1502.zip")
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  @pytest.mark.parametrize("first_map_id, last_map_id", [
+    ("",     "1502"),
+    ("abc",  "1502"),
+    ("-1",   "5"),
+    ("1502", "1500"),  # Range is reversed
+    ("1999", "2001"),  # Past the last map ID in idcounts.dat
+    ("1000", "1100")   # More maps than allowed in one archive
+  ])
+  def test_download_range_with_invalid_range_should_fail(self, mock_logger, first_map_id, last_map_id):
+    self.copy_test_data_file("map_1500.dat", self.downloads_dir, "map_1999.dat")
+
+    response = self.start_range_download(first_map_id, last_map_id)
+
+    assert response.status_code == 400
+    mock_logger.warn.assert_called_with(self.get_log_message("MAP_DOWNLOAD_RANGE_INVALID"), first_map_id, last_map_id)
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_download_range_with_no_existing_maps_should_fail(self, mock_logger):
+    response = self.start_range_download("1500", "1502")
+
+    assert response.status_code == 404
+    mock_logger.warn.assert_called_with(self.get_log_message("MAP_DOWNLOAD_RANGE_NOT_FOUND"), "1500", "1502")
+
   # Helper Functions
 
   def clean_map_downloads_dir(self):
@@ -116,8 +309,11 @@ class TestMapDownload(TestMapBase):
   def create_download_link(self, data):
     return self.client.post("/map/download", data = data)
 
-  def start_download(self, filename):
-    return self.client.get("/map/download/{}".format(filename))
+  def start_download(self, filename, headers = None):
+    return self.client.get("/map/download/{}".format(filename), headers = headers)
+
+  def start_range_download(self, first_map_id, last_map_id):
+    return self.client.get("/map/download/range", query_string = { "from": first_map_id, "to": last_map_id })
 
   def create_request_data(self, map_id):
     data = OrderedMultiDict()
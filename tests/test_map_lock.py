@@ -0,0 +1,85 @@
+from test_map_base import TestMapBase
+
+from mrt_file_server.utils.nbt_utils import load_compressed_nbt_file, get_nbt_map_value
+
+import os
+
+class TestMapLock(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.reset_directories()
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    self.reset_directories()
+
+  # Tests
+
+  def test_lock_should_lock_maps_in_ranges(self):
+    for map_id in range(1500, 1505):
+      self.copy_test_data_file("existing_unlocked.dat", self.downloads_dir, "map_{}.dat".format(map_id))
+    self.copy_test_data_file("existing_locked.dat", self.downloads_dir, "map_1505.dat")
+    self.copy_test_data_file("existing_unlocked.dat", self.downloads_dir, "map_1506.dat")
+
+    result = self.run_command("lock", "1500-1503", "1505")
+
+    assert result.exit_code == 0
+    assert "Locked 4 maps, 1 already locked, skipped 0." in result.output
+
+    for map_id in range(1500, 1504):
+      assert self.get_locked_value("map_{}.dat".format(map_id)) == 1
+    assert self.get_locked_value("map_1504.dat") == 0
+    assert self.get_locked_value("map_1506.dat") == 0
+    assert [filename for filename in os.listdir(self.downloads_dir) if filename.startswith(".")] == []
+
+  def test_unlock_should_unlock_all_maps(self):
+    self.copy_test_data_file("existing_locked.dat", self.downloads_dir, "map_1500.dat")
+    self.copy_test_data_file("existing_locked.dat", self.downloads_dir, "map_1501.dat")
+    self.copy_test_data_file("existing_unlocked.dat", self.downloads_dir, "map_1502.dat")
+
+    result = self.run_command("unlock", "--all")
+
+    assert result.exit_code == 0
+    assert "Unlocked 2 maps, 1 already unlocked, skipped 0." in result.output
+
+    for filename in ["map_1500.dat", "map_1501.dat", "map_1502.dat"]:
+      assert self.get_locked_value(filename) == 0
+
+  def test_lock_should_add_missing_locked_tag(self):
+    # Map without the locked tag
+    self.copy_test_data_file("map_1534.dat", self.downloads_dir)
+
+    result = self.run_command("lock", "1534")
+
+    assert result.exit_code == 0
+    assert "Locked 1 map, 0 already locked, skipped 0." in result.output
+    assert self.get_locked_value("map_1534.dat") == 1
+
+  def test_lock_should_skip_missing_and_invalid_maps(self):
+    self.copy_test_data_file("villages.dat", self.downloads_dir, "map_1501.dat")
+
+    result = self.run_command("lock", "1500-1501")
+
+    assert result.exit_code == 0
+    assert "Skipped map_1500.dat: File does not exist" in result.output
+    assert "Skipped map_1501.dat: File is not a valid map format" in result.output
+    assert "Locked 0 maps, 0 already locked, skipped 2." in result.output
+    self.verify_file_content(self.downloads_dir, "map_1501.dat", self.load_test_data_file("villages.dat"))
+
+  def test_lock_should_reject_invalid_map_ids(self):
+    for args in [[], ["abc"], ["1510-1500"]]:
+      result = self.run_command("lock", *args)
+      assert result.exit_code == 2
+
+  # Helper Functions
+
+  def run_command(self, *args):
+    return self.app.test_cli_runner().invoke(args = ["map", *args])
+
+  def get_locked_value(self, filename):
+    return get_nbt_map_value(load_compressed_nbt_file(os.path.join(self.downloads_dir, filename)), "locked")
+
+  def reset_directories(self):
+    self.remove_files(self.downloads_dir, "dat")
+    self.copy_test_data_file("idcounts.dat", self.downloads_dir)
@@ -0,0 +1,115 @@
+from test_map_base import TestMapBase
+
+from mrt_file_server.utils.map_preview_utils import MAP_BASE_COLORS, MAP_SHADE_MULTIPLIERS, MAP_SIZE
+from mrt_file_server.utils.nbt_utils import load_compressed_nbt_file, get_nbt_map_value
+
+import os
+import pytest
+import struct
+import zlib
+
+class TestMapPreview(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.preview_cache_dir = self.app.config["MAP_PREVIEW_CACHE_DIR"]
+    self.reset_directories()
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    self.reset_directories()
+
+  # Tests
+
+  def test_preview_should_render_map_colors(self):
+    filename = "map_1500.dat"
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    response = self.client.get("/map/preview/1500.png")
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+
+    width, height, pixels = self.decode_png(response.data)
+    assert (width, height) == (MAP_SIZE, MAP_SIZE)
+
+    colors = get_nbt_map_value(load_compressed_nbt_file(os.path.join(self.TEST_DATA_DIR, filename)), "colors")
+    for index in [0, 1000, MAP_SIZE * MAP_SIZE - 1]:
+      assert pixels[index] == self.expected_pixel(colors[index])
+
+  def test_preview_should_be_cached_on_disk(self):
+    self.copy_test_data_file("map_1500.dat", self.downloads_dir)
+
+    first_response = self.client.get("/map/preview/1500.png")
+    preview_files = os.listdir(self.preview_cache_dir)
+
+    assert len(preview_files) == 1
+
+    second_response = self.client.get("/map/preview/1500.png", headers = { "If-None-Match": first_response.headers.get("ETag") })
+
+    assert second_response.status_code == 304
+    assert os.listdir(self.preview_cache_dir) == preview_files
+
+  def test_preview_should_be_regenerated_when_map_changes(self):
+    self.copy_test_data_file("map_1500.dat", self.downloads_dir)
+    first_response = self.client.get("/map/preview/1500.png")
+
+    self.copy_test_data_file("map_1501.dat", self.downloads_dir, "map_1500.dat")
+    second_response = self.client.get("/map/preview/1500.png")
+
+    assert second_response.status_code == 200
+    assert second_response.headers.get("ETag") != first_response.headers.get("ETag")
+
+    # The preview of the previous version of the map is removed from the disk cache
+    assert len(os.listdir(self.preview_cache_dir)) == 1
+
+  @pytest.mark.parametrize("map_id, filename", [
+    ("1500", None),             # Map file does not exist
+    ("1500", "map_1535.dat"),   # Map without colors
+    ("abc", None)               # Map ID is not a number
+  ])
+  def test_preview_should_fail(self, map_id, filename):
+    if filename:
+      self.copy_test_data_file(filename, self.downloads_dir, "map_{}.dat".format(map_id))
+
+    response = self.client.get("/map/preview/{}.png".format(map_id))
+
+    assert response.status_code == 404
+
+  # Helper Functions
+
+  def reset_directories(self):
+    self.remove_files(self.downloads_dir, "dat")
+    self.remove_files(self.preview_cache_dir, "png")
+    self.copy_test_data_file("idcounts.dat", self.downloads_dir)
+
+  def expected_pixel(self, color_byte):
+    color_byte = color_byte & 0xFF
+    base_color_id = color_byte >> 2
+    if base_color_id == 0 or base_color_id >= len(MAP_BASE_COLORS):
+      return (0, 0, 0, 0)
+    multiplier = MAP_SHADE_MULTIPLIERS[color_byte & 3]
+    return tuple(component * multiplier // 255 for component in MAP_BASE_COLORS[base_color_id]) + (255,)
+
+  def decode_png(self, data):
+    # Only supports the unfiltered 8-bit RGBA images produced by the preview route
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+
+    offset = 8
+    chunks = {}
+    while offset < len(data):
+      length, = struct.unpack(">I", data[offset:offset + 4])
+      chunk_type = data[offset + 4:offset + 8]
+      chunks[chunk_type] = chunks.get(chunk_type, b"") + data[offset + 8:offset + 8 + length]
+      offset += 12 + length
+
+    width, height = struct.unpack(">II", chunks[b"IHDR"][:8])
+    raw = zlib.decompress(chunks[b"IDAT"])
+    stride = width * 4 + 1
+
+    pixels = []
+    for row in range(height):
+      scanline = raw[row * stride + 1:(row + 1) * stride]
+      pixels.extend(tuple(scanline[column * 4:column * 4 + 4]) for column in range(width))
+
+    return width, height, pixels
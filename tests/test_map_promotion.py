@@ -0,0 +1,94 @@
+from test_map_base import TestMapBase
+
+import hashlib
+import json
+import os
+
+class TestMapPromotion(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.uploads_dir = self.app.config["MAP_UPLOADS_DIR"]
+    self.downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.manifest_file_path = self.app.config["MAP_PROMOTION_MANIFEST_FILE"]
+    self.reset_directories()
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    self.reset_directories()
+
+  # Tests
+
+  def test_promote_maps_should_move_valid_maps(self):
+    filenames = ["map_1500.dat", "map_1501.dat", "map_1502.dat"]
+    for filename in filenames:
+      self.copy_test_data_file(filename, self.uploads_dir)
+
+    # An unlocked map with the same ID already exists in the world data directory
+    self.copy_test_data_file("existing_unlocked.dat", self.downloads_dir, "map_1500.dat")
+
+    result = self.promote_maps()
+
+    assert result.exit_code == 0
+    assert "Promoted 3 maps, rejected 0." in result.output
+
+    for filename in filenames:
+      self.verify_file_content(self.downloads_dir, filename, self.load_test_data_file(filename))
+    assert os.listdir(self.uploads_dir) == []
+    assert not os.path.exists(self.manifest_file_path)
+    assert [filename for filename in os.listdir(self.downloads_dir) if filename.startswith(".")] == []
+
+  def test_promote_maps_should_reject_invalid_and_locked_maps(self):
+    self.copy_test_data_file("map_1500.dat", self.uploads_dir)
+    self.copy_test_data_file("villages.dat", self.uploads_dir, "map_1501.dat")
+    self.copy_test_data_file("map_1502.dat", self.uploads_dir)
+    self.copy_test_data_file("existing_locked.dat", self.downloads_dir, "map_1502.dat")
+
+    result = self.promote_maps()
+
+    assert result.exit_code == 0
+    assert "Rejected map_1501.dat: File is not a valid map format" in result.output
+    assert "Rejected map_1502.dat: Existing map file is locked" in result.output
+    assert "Promoted 1 map, rejected 2." in result.output
+
+    # Rejected maps are left in the uploads directory, and the locked map is not replaced
+    assert sorted(os.listdir(self.uploads_dir)) == ["map_1501.dat", "map_1502.dat"]
+    self.verify_file_content(self.downloads_dir, "map_1502.dat", self.load_test_data_file("existing_locked.dat"))
+
+  def test_promote_maps_should_resume_interrupted_promotion(self):
+    copied_content = self.load_test_data_file("map_1500.dat")
+
+    # The previous promotion was interrupted after map_1500.dat was renamed into place, but before its upload was removed.
+    # The uploaded map is locked, so it must not be rejected for replacing a locked map.
+    self.copy_test_data_file("map_1500.dat", self.uploads_dir)
+    self.copy_test_data_file("map_1500.dat", self.downloads_dir)
+    self.copy_test_data_file("map_1501.dat", self.uploads_dir)
+
+    manifest = { "files": {
+      "map_1500.dat": { "status": "copied", "sha256": hashlib.sha256(copied_content).hexdigest() },
+      "map_1501.dat": { "status": "pending" }
+    } }
+    with open(self.manifest_file_path, "w") as file:
+      json.dump(manifest, file)
+
+    # Maps uploaded after the interruption are left for the next promotion
+    self.copy_test_data_file("map_1502.dat", self.uploads_dir)
+
+    result = self.promote_maps()
+
+    assert result.exit_code == 0
+    assert "Resuming interrupted promotion of 2 maps." in result.output
+    assert "Promoted 2 maps, rejected 0." in result.output
+    assert os.listdir(self.uploads_dir) == ["map_1502.dat"]
+    self.verify_file_content(self.downloads_dir, "map_1501.dat", self.load_test_data_file("map_1501.dat"))
+
+  # Helper Functions
+
+  def promote_maps(self):
+    return self.app.test_cli_runner().invoke(args = ["map", "promote-maps"])
+
+  def reset_directories(self):
+    self.remove_files(self.uploads_dir, "dat")
+    self.remove_files(self.downloads_dir, "dat")
+    self.copy_test_data_file("idcounts.dat", self.downloads_dir)
+    if os.path.exists(self.manifest_file_path):
+      os.remove(self.manifest_file_path)
@@ -0,0 +1,74 @@
+from test_map_base import TestMapBase
+
+import os
+
+class TestMapStatusApi(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.reset_directories()
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    self.reset_directories()
+
+  # Tests
+
+  def test_status_should_report_each_map(self):
+    self.copy_test_data_file("existing_unlocked.dat", self.downloads_dir, "map_1000.dat")
+    self.copy_test_data_file("existing_locked.dat", self.downloads_dir, "map_1500.dat")
+
+    response = self.client.get("/api/maps/status", query_string = { "ids": "1000,1500-1501,2001" })
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+
+    status = response.get_json()
+    assert status["lastMapId"] == 2000
+    assert status["uploadableRange"] == { "from": 1001, "to": 2000 }
+    assert status["maps"] == [
+      { "id": 1000, "exists": True, "locked": False, "size": self.get_file_size("map_1000.dat"), "inUploadableRange": False },
+      { "id": 1500, "exists": True, "locked": True, "size": self.get_file_size("map_1500.dat"), "inUploadableRange": True },
+      { "id": 1501, "exists": False, "locked": None, "size": None, "inUploadableRange": True },
+      { "id": 2001, "exists": False, "locked": None, "size": None, "inUploadableRange": False }
+    ]
+
+  def test_status_should_accept_json_body(self):
+    self.copy_test_data_file("existing_locked.dat", self.downloads_dir, "map_1500.dat")
+
+    response = self.client.post("/api/maps/status", json = { "ids": [1500, "1600-1699"] })
+
+    assert response.status_code == 200
+
+    maps = response.get_json()["maps"]
+    assert len(maps) == 101
+    assert maps[0]["locked"] == True
+    assert not any(map_status["exists"] for map_status in maps[1:])
+
+  def test_status_should_show_maps_added_since_last_request(self):
+    self.client.get("/api/maps/status", query_string = { "ids": "1500" })
+    self.copy_test_data_file("existing_unlocked.dat", self.downloads_dir, "map_1500.dat")
+
+    response = self.client.get("/api/maps/status", query_string = { "ids": "1500" })
+
+    assert response.get_json()["maps"][0]["exists"] == True
+
+  def test_status_should_reject_invalid_map_ids(self):
+    max_number_of_maps = self.app.config["MAP_STATUS_MAX_NUMBER_OF_MAPS"]
+
+    for query_string in [{}, { "ids": "abc" }, { "ids": "1500-1400" }, { "ids": "-5" }, { "ids": "0-{}".format(max_number_of_maps) }]:
+      response = self.client.get("/api/maps/status", query_string = query_string)
+      assert response.status_code == 400
+      assert "error" in response.get_json()
+
+    response = self.client.post("/api/maps/status", json = { "ids": "1500" })
+    assert response.status_code == 400
+
+  # Helper Functions
+
+  def get_file_size(self, filename):
+    return os.path.getsize(os.path.join(self.downloads_dir, filename))
+
+  def reset_directories(self):
+    self.remove_files(self.downloads_dir, "dat")
+    self.copy_test_data_file("idcounts.dat", self.downloads_dir)
@@ -1,12 +1,17 @@
 from test_map_base import TestMapBase
-from unittest.mock import call, patch
+from unittest.mock import ANY, call, patch
 
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from werkzeug.datastructures import OrderedMultiDict
 from io import BytesIO
-from mrt_file_server.utils.nbt_utils import load_compressed_nbt_file, get_nbt_map_value
+from mrt_file_server.map_preparation import MapPreparationPool
+from mrt_file_server.utils.nbt_utils import load_compressed_nbt_file, save_compressed_nbt_file, get_nbt_map_value, get_nbt_tag
 
+import modes
 import os
 import pytest
+import tempfile
 
 class TestMapUpload(TestMapBase):
   def setup(self):
@@ -35,6 +40,50 @@ class TestMapUpload(TestMapBase):
     assert expected_lower_map_id_html in actual_html
     assert expected_upper_map_id_html in actual_html
 
+  def test_upload_page_should_show_updated_map_id_range_when_idcounts_changes(self):
+    self.client.get("/map/upload")
+
+    # Simulate the Minecraft server creating new maps
+    last_map_id = 2500
+    self.set_last_map_id(last_map_id)
+
+    response = self.client.get("/map/upload")
+
+    actual_html = response.data.decode('utf-8')
+
+    expected_upper_map_id_html = "<span id=\"upper_map_id\" style=\"color: green;\">{}</span>".format(last_map_id)
+
+    assert expected_upper_map_id_html in actual_html
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_upload_multiple_files_should_only_load_idcounts_once(self, mock_logger):
+    from mrt_file_server.blueprints.map import last_map_id_cache
+
+    username = "Frumple"
+    filenames = [
+      "map_1500.dat",
+      "map_1501.dat",
+      "map_1502.dat"]
+
+    original_files = self.load_test_data_files(filenames)
+
+    data = OrderedMultiDict()
+    data.add("userName", username)
+
+    for filename in original_files:
+      data.add("map", (BytesIO(original_files[filename]), filename))
+
+    misses_before = last_map_id_cache.misses
+    hits_before = last_map_id_cache.hits
+
+    response = self.perform_upload(data)
+
+    assert response.status_code == 200
+
+    # One load after idcounts.dat was reset, then cache hits for each remaining file and the page render
+    assert last_map_id_cache.misses - misses_before <= 1
+    assert last_map_id_cache.hits - hits_before >= len(filenames)
+
   @patch("mrt_file_server.utils.log_utils.log_adapter")
   def test_upload_single_file_should_be_successful(self, mock_logger):
     username = "Frumple"
@@ -59,6 +108,9 @@ class TestMapUpload(TestMapBase):
 
     assert get_nbt_map_value(uploaded_nbt_file, "locked") == 1
 
+    # Verify that no temporary files were left behind in the uploads directory
+    assert os.listdir(self.uploads_dir) == [filename]
+
     self.verify_flash_message_by_key(message_key, response.data, filename)
     mock_logger.info.assert_called_with(self.get_log_message(message_key), filename, username)
 
@@ -105,6 +157,97 @@ class TestMapUpload(TestMapBase):
 
     mock_logger.info.assert_has_calls(logger_calls, any_order = True)
 
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_upload_multiple_files_with_process_pool_should_keep_original_order(self, mock_logger):
+    username = "Frumple"
+
+    # Mix of valid and invalid files, in an order that the results must be reported in
+    uploads = [
+      ("map_1500.dat", "MAP_UPLOAD_SUCCESS"),
+      ("map_1533.dat", "MAP_UPLOAD_MAP_FORMAT_INVALID"),
+      ("map_1501.dat", "MAP_UPLOAD_SUCCESS"),
+      ("map_1520.dat", "MAP_UPLOAD_FILE_TOO_LARGE"),
+      ("map_1502.dat", "MAP_UPLOAD_SUCCESS")]
+
+    data = OrderedMultiDict()
+    data.add("userName", username)
+
+    for filename, message_key in uploads:
+      data.add("map", (BytesIO(self.load_test_data_file(filename)), filename))
+
+    with self.map_preparation_pool(2):
+      response = self.perform_upload(data)
+
+    assert response.status_code == 200
+
+    actual_html = response.data.decode("utf-8")
+    last_position = -1
+
+    for filename, message_key in uploads:
+      self.verify_flash_message_by_key(message_key, response.data, filename)
+
+      position = actual_html.index("{}: ".format(filename))
+      assert position > last_position
+      last_position = position
+
+      if message_key == "MAP_UPLOAD_SUCCESS":
+        assert get_nbt_map_value(self.load_uploaded_nbt_file(filename), "locked") == 1
+      else:
+        self.verify_file_does_not_exist(self.uploads_dir, filename)
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_upload_with_broken_process_pool_should_prepare_maps_in_request(self, mock_logger):
+    username = "Frumple"
+    filenames = ["map_1500.dat", "map_1501.dat"]
+
+    with self.map_preparation_pool(1) as map_preparation_pool:
+      # A worker that dies breaks the pool, and every later submit to it fails
+      with pytest.raises(BrokenProcessPool):
+        map_preparation_pool.submit(os._exit, 1).result()
+
+      for filename in filenames:
+        data = OrderedMultiDict()
+        data.add("userName", username)
+        data.add("map", (BytesIO(self.load_test_data_file(filename)), filename))
+
+        response = self.perform_upload(data)
+
+        assert response.status_code == 200
+        self.verify_flash_message_by_key("MAP_UPLOAD_SUCCESS", response.data, filename)
+        assert get_nbt_map_value(self.load_uploaded_nbt_file(filename), "locked") == 1
+
+    # Only the first upload found the pool broken, and the second was prepared by a new pool
+    mock_logger.error.assert_called_once_with(self.get_log_message("MAP_UPLOAD_PREPARATION_FAILURE"), filenames[0], username, ANY)
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_upload_to_new_instance_should_create_uploads_dir(self, mock_logger):
+    from mrt_file_server import create_app
+
+    username = "Frumple"
+    filename = "map_1500.dat"
+
+    with tempfile.TemporaryDirectory() as instance_dir:
+      # A new instance has only its config file, and the map downloads that uploads are checked against
+      mode_dir = os.path.join(instance_dir, modes.TEST)
+      map_downloads_dir = os.path.join(mode_dir, "downloads", "maps")
+      os.makedirs(map_downloads_dir)
+      with open(os.path.join(mode_dir, "config.py"), "w") as file:
+        file.write("SECRET_KEY = \"test\"\n")
+      self.copy_test_data_file("idcounts.dat", map_downloads_dir)
+
+      with patch.dict(os.environ, { modes.INSTANCE_PATH_ENVIRONMENT_VARIABLE: instance_dir }):
+        app = create_app(modes.TEST)
+
+      data = OrderedMultiDict()
+      data.add("userName", username)
+      data.add("map", (BytesIO(self.load_test_data_file(filename)), filename))
+
+      response = app.test_client().post("/map/upload", content_type = "multipart/form-data", data = data)
+
+      assert response.status_code == 200
+      self.verify_flash_message_by_key("MAP_UPLOAD_SUCCESS", response.data, filename)
+      assert os.path.isfile(os.path.join(mode_dir, "uploads", "maps", filename))
+
   @patch("mrt_file_server.utils.log_utils.log_adapter")
   @pytest.mark.parametrize("username, message_key", [
     ("",               "MAP_UPLOAD_USERNAME_EMPTY"),
@@ -248,6 +391,25 @@ class TestMapUpload(TestMapBase):
     self.verify_flash_message_by_key(message_key, response.data, filename)
     mock_logger.warn.assert_called_with(self.get_log_message(message_key), filename, username)
 
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_upload_map_that_decompresses_too_large_should_fail(self, mock_logger):
+    username = "Frumple"
+    filename = "map_1500.dat"
+    message_key = "MAP_UPLOAD_MAP_FORMAT_INVALID"
+
+    data = OrderedMultiDict()
+    data.add("userName", username)
+    data.add("map", (BytesIO(self.load_test_data_file(filename)), filename))
+
+    # The map is about 16 kilobytes uncompressed
+    with patch.dict(self.app.config, { "MAP_UPLOAD_MAX_UNCOMPRESSED_SIZE": 1024 }):
+      response = self.perform_upload(data)
+
+    assert response.status_code == 200
+    self.verify_file_does_not_exist(self.uploads_dir, filename)
+    self.verify_flash_message_by_key(message_key, response.data, filename)
+    mock_logger.warn.assert_called_with(self.get_log_message(message_key), filename, username)
+
   @patch("mrt_file_server.utils.log_utils.log_adapter")
   @pytest.mark.parametrize("filename, message_key", [
     ("map_1520.dat", "MAP_UPLOAD_FILE_TOO_LARGE"),      # File size too large
@@ -284,6 +446,28 @@ class TestMapUpload(TestMapBase):
     self.verify_flash_message_by_key(message_key, response.data, filename)
     mock_logger.warn.assert_called_with(self.get_log_message(message_key), filename, username)
 
+  def test_upload_should_discard_content_of_file_that_is_too_large(self):
+    small_filename = "map_1500.dat"
+    large_filename = "map_1520.dat"
+
+    data = OrderedMultiDict()
+    data.add("userName", "Frumple")
+    data.add("map", (BytesIO(self.load_test_data_file(small_filename)), small_filename))
+    data.add("map", (BytesIO(self.load_test_data_file(large_filename)), large_filename))
+
+    with self.app.test_request_context("/map/upload", method = "POST", content_type = "multipart/form-data", data = data):
+      from flask import request
+
+      small_file, large_file = request.files.getlist("map")
+
+      assert small_file.stream.exceeded == False
+      assert small_file.read() == self.load_test_data_file(small_filename)
+
+      # The size of the large file is still known, but its content was not kept
+      assert large_file.stream.exceeded == True
+      assert large_file.stream.received_size == len(self.load_test_data_file(large_filename))
+      assert large_file.read() == b""
+
   @patch("mrt_file_server.utils.log_utils.log_adapter")
   def test_upload_where_existing_file_is_already_locked_should_fail(self, mock_logger):
     username = "Frumple"
@@ -353,11 +537,29 @@ class TestMapUpload(TestMapBase):
   def perform_upload(self, data):
     return self.client.post("/map/upload", content_type = "multipart/form-data", data = data)
 
+  @contextmanager
+  def map_preparation_pool(self, workers):
+    # Replaces the application's pool for the duration of the test, and stops its workers afterwards
+    app_state = self.app.extensions["mrt_file_server"]
+    original_pool = app_state.map_preparation_pool
+    app_state.map_preparation_pool = MapPreparationPool(workers)
+
+    try:
+      yield app_state.map_preparation_pool
+    finally:
+      app_state.map_preparation_pool.shutdown()
+      app_state.map_preparation_pool = original_pool
+
   def reset_directories(self):
     self.remove_files(self.uploads_dir, "dat")
     self.remove_files(self.downloads_dir, "dat")
     self.copy_test_data_file("idcounts.dat", self.downloads_dir)
 
+  def set_last_map_id(self, last_map_id):
+    idcounts_nbt = load_compressed_nbt_file(os.path.join(self.downloads_dir, "idcounts.dat"))
+    get_nbt_tag(idcounts_nbt, "data")["map"].value = last_map_id
+    save_compressed_nbt_file(idcounts_nbt)
+
   def load_test_data_nbt_file(self, filename):
     return load_compressed_nbt_file(os.path.join(self.TEST_DATA_DIR, filename))
 
@@ -0,0 +1,121 @@
+from test_map_base import TestMapBase
+from unittest.mock import patch
+
+from werkzeug.datastructures import OrderedMultiDict
+from io import BytesIO
+from mrt_file_server.metrics import MetricsRegistry, format_prometheus_text, merge_snapshots, registry
+
+import json
+import os
+
+class TestMetrics(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.uploads_dir = self.app.config["MAP_UPLOADS_DIR"]
+    self.downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.spool_dir = self.app.config["METRICS_SPOOL_DIR"]
+    self.reset_directories()
+    registry.reset()
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    self.reset_directories()
+    registry.reset()
+
+  # Tests
+
+  def test_metrics_should_record_request_status_and_bytes_sent(self):
+    filename = "map_1500.dat"
+    file_size = len(self.load_test_data_file(filename))
+    self.copy_test_data_file(filename, self.downloads_dir)
+
+    self.client.get("/map/download/{}".format(filename))
+    self.client.get("/map/download/{}".format(filename))
+    not_found_response = self.client.get("/map/download/map_1.dat")
+
+    metrics_text = self.get_metrics_text()
+
+    assert "mrt_http_requests_total{endpoint=\"map.download_map\",method=\"GET\",status=\"200\"} 2" in metrics_text
+    assert "mrt_http_requests_total{endpoint=\"map.download_map\",method=\"GET\",status=\"404\"} 1" in metrics_text
+    assert "mrt_http_request_duration_seconds_count{endpoint=\"map.download_map\",method=\"GET\"} 3" in metrics_text
+    assert "mrt_http_request_duration_seconds_bucket{endpoint=\"map.download_map\",le=\"+Inf\",method=\"GET\"} 3" in metrics_text
+    assert self.get_counter_value(metrics_text, "mrt_http_response_bytes_total{endpoint=\"map.download_map\"}") == file_size * 2 + len(not_found_response.data)
+
+  def test_metrics_should_count_bytes_of_streamed_responses(self):
+    self.copy_test_data_file("map_1500.dat", self.downloads_dir)
+
+    response = self.client.get("/map/download/range", query_string = { "from": 1500, "to": 1500 })
+    zip_size = len(response.data)
+
+    metrics_text = self.get_metrics_text()
+
+    assert self.get_counter_value(metrics_text, "mrt_http_response_bytes_total{endpoint=\"map.download_map_range\"}") == zip_size
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_metrics_should_time_map_upload_operations(self, mock_logger):
+    filename = "map_1500.dat"
+
+    data = OrderedMultiDict()
+    data.add("userName", "Frumple")
+    data.add("map", (BytesIO(self.load_test_data_file(filename)), filename))
+    self.client.post("/map/upload", content_type = "multipart/form-data", data = data)
+
+    metrics_text = self.get_metrics_text()
+
+    for operation in ["get_last_map_id", "prepare_map_buffer", "scan_nbt_buffer", "compress_nbt_buffer", "map_file_write"]:
+      assert "mrt_operation_duration_seconds_count{{operation=\"{}\"}}".format(operation) in metrics_text
+
+  def test_metrics_should_merge_spooled_worker_snapshots(self):
+    other_registry = MetricsRegistry()
+    other_registry.increment("mrt_http_requests_total", { "endpoint": "index", "method": "GET", "status": "200" }, 5)
+    other_spool_file_path = os.path.join(self.spool_dir, "{}.json".format(os.getppid()))
+
+    with open(other_spool_file_path, "w") as file:
+      json.dump(other_registry.snapshot(), file)
+
+    try:
+      self.client.get("/")
+      metrics_text = self.get_metrics_text()
+    finally:
+      os.remove(other_spool_file_path)
+
+    assert "mrt_http_requests_total{endpoint=\"index\",method=\"GET\",status=\"200\"} 6" in metrics_text
+
+  def test_metrics_should_be_disabled(self):
+    with patch.dict(self.app.config, { "METRICS_ENABLED": False }):
+      response = self.client.get("/metrics")
+
+    assert response.status_code == 404
+
+  def test_histogram_buckets_should_be_cumulative(self):
+    test_registry = MetricsRegistry()
+    for value in [0.0005, 0.003, 0.003, 20]:
+      test_registry.observe("mrt_operation_duration_seconds", { "operation": "test" }, value)
+
+    metrics_text = format_prometheus_text(merge_snapshots([test_registry.snapshot(), test_registry.snapshot()]))
+
+    assert "# TYPE mrt_operation_duration_seconds histogram" in metrics_text
+    assert "mrt_operation_duration_seconds_bucket{le=\"0.001\",operation=\"test\"} 2" in metrics_text
+    assert "mrt_operation_duration_seconds_bucket{le=\"0.005\",operation=\"test\"} 6" in metrics_text
+    assert "mrt_operation_duration_seconds_bucket{le=\"10.0\",operation=\"test\"} 6" in metrics_text
+    assert "mrt_operation_duration_seconds_bucket{le=\"+Inf\",operation=\"test\"} 8" in metrics_text
+    assert "mrt_operation_duration_seconds_count{operation=\"test\"} 8" in metrics_text
+
+  # Helper Functions
+
+  def get_metrics_text(self):
+    response = self.client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    return response.data.decode("utf-8")
+
+  def get_counter_value(self, metrics_text, sample_name):
+    for line in metrics_text.split("\n"):
+      if line.startswith(sample_name + " "):
+        return int(line.split(" ")[1])
+    return None
+
+  def reset_directories(self):
+    self.remove_files(self.uploads_dir, "dat")
+    self.remove_files(self.downloads_dir, "dat")
+    self.copy_test_data_file("idcounts.dat", self.downloads_dir)
@@ -0,0 +1,147 @@
+from test_map_base import TestMapBase
+
+from mrt_file_server.utils import nbt_utils
+from mrt_file_server.utils.nbt_utils import decompress_nbt_buffer, decompress_nbt_stream, load_compressed_nbt_buffer, load_compressed_nbt_file, get_nbt_map_value, scan_nbt_buffer, set_compressed_nbt_map_byte_value, MalformedFileError, TAG_BYTE, TAG_BYTE_ARRAY
+
+from io import BytesIO
+from unittest.mock import patch
+
+import gzip
+import os
+import pytest
+
+class TestNbtUtils(TestMapBase):
+
+  # Tests
+
+  @pytest.mark.parametrize("filename", [
+    ("map_1500.dat"),
+    ("existing_locked.dat"),
+    ("existing_unlocked.dat")
+  ])
+  def test_scan_should_match_full_parse(self, filename):
+    tag_names = ["dimension", "locked", "scale", "trackingPosition", "xCenter", "zCenter"]
+
+    nbt_file = self.load_test_data_nbt_file(filename)
+    scanned_tags = scan_nbt_buffer(self.load_uncompressed_test_data_file(filename), ["data/" + tag_name for tag_name in tag_names])
+
+    for tag_name in tag_names:
+      assert scanned_tags["data/" + tag_name].value == get_nbt_map_value(nbt_file, tag_name)
+
+  def test_scan_should_record_array_offset_without_value(self):
+    filename = "map_1500.dat"
+    uncompressed_buffer = self.load_uncompressed_test_data_file(filename)
+
+    colors = scan_nbt_buffer(uncompressed_buffer, ["data/colors"])["data/colors"]
+
+    assert colors.tag_type == TAG_BYTE_ARRAY
+    assert colors.value is None
+    assert uncompressed_buffer[colors.offset:colors.offset + colors.length] == get_nbt_map_value(self.load_test_data_nbt_file(filename), "colors")
+
+  def test_scan_should_record_byte_offset(self):
+    uncompressed_buffer = self.load_uncompressed_test_data_file("existing_locked.dat")
+
+    locked = scan_nbt_buffer(uncompressed_buffer, ["data/locked"])["data/locked"]
+
+    assert locked.tag_type == TAG_BYTE
+    assert uncompressed_buffer[locked.offset] == 1
+
+  def test_scan_should_not_return_missing_tags(self):
+    # Map without the locked tag
+    scanned_tags = scan_nbt_buffer(self.load_uncompressed_test_data_file("map_1534.dat"), ["data/locked", "data/scale"])
+
+    assert "data/locked" not in scanned_tags
+    assert "data/scale" in scanned_tags
+
+  @pytest.mark.parametrize("uncompressed_buffer", [
+    (b""),
+    (b"\x01\x00\x00\x05"),           # Root is not a compound
+    (b"\x0a\x00\x00\x07\x00\x01a"),  # Truncated byte array header
+  ])
+  def test_scan_should_reject_malformed_buffer(self, uncompressed_buffer):
+    with pytest.raises(MalformedFileError):
+      scan_nbt_buffer(uncompressed_buffer, ["data/locked"])
+
+  def test_scan_should_reject_truncated_buffer(self):
+    uncompressed_buffer = self.load_uncompressed_test_data_file("map_1500.dat")
+
+    with pytest.raises(MalformedFileError):
+      scan_nbt_buffer(uncompressed_buffer[:-10], ["data/locked"])
+
+  @pytest.mark.parametrize("filename, value", [
+    ("existing_unlocked.dat", 1),
+    ("existing_locked.dat", 0)
+  ])
+  def test_set_byte_value_should_patch_existing_tag(self, filename, value):
+    compressed_buffer = self.load_test_data_file(filename)
+    uncompressed_buffer = decompress_nbt_buffer(compressed_buffer)
+    locked = scan_nbt_buffer(uncompressed_buffer, ["data/locked"])["data/locked"]
+
+    patched_buffer = decompress_nbt_buffer(set_compressed_nbt_map_byte_value(compressed_buffer, "locked", value))
+
+    # Only the locked byte is changed
+    assert len(patched_buffer) == len(uncompressed_buffer)
+    assert patched_buffer[:locked.offset] == uncompressed_buffer[:locked.offset]
+    assert patched_buffer[locked.offset] == value
+    assert patched_buffer[locked.offset + 1:] == uncompressed_buffer[locked.offset + 1:]
+
+  def test_set_byte_value_should_add_missing_tag(self):
+    # Map without the locked tag
+    compressed_buffer = self.load_test_data_file("map_1534.dat")
+
+    nbt_file = load_compressed_nbt_buffer(set_compressed_nbt_map_byte_value(compressed_buffer, "locked", 1))
+
+    assert get_nbt_map_value(nbt_file, "locked") == 1
+    assert get_nbt_map_value(nbt_file, "scale") == get_nbt_map_value(load_compressed_nbt_buffer(compressed_buffer), "scale")
+
+  @pytest.mark.parametrize("filename", [
+    ("map_1500.dat"),
+    ("existing_locked.dat"),
+    ("idcounts.dat")
+  ])
+  def test_decompress_stream_should_match_decompress_buffer(self, filename):
+    compressed_buffer = self.load_test_data_file(filename)
+
+    assert decompress_nbt_stream(BytesIO(compressed_buffer)) == decompress_nbt_buffer(compressed_buffer)
+
+  @patch.object(nbt_utils, "DECOMPRESS_CHUNK_SIZE", 7)
+  def test_decompress_stream_should_match_decompress_buffer_with_small_chunks(self):
+    compressed_buffer = self.load_test_data_file("map_1500.dat")
+
+    assert decompress_nbt_stream(BytesIO(compressed_buffer), 1024 * 1024) == decompress_nbt_buffer(compressed_buffer)
+
+  def test_decompress_stream_should_decompress_all_members(self):
+    compressed_buffer = gzip.compress(b"first ") + gzip.compress(b"second")
+
+    assert decompress_nbt_stream(BytesIO(compressed_buffer)) == b"first second"
+
+  def test_decompress_stream_should_allow_exactly_max_size(self):
+    uncompressed_buffer = self.load_uncompressed_test_data_file("map_1500.dat")
+
+    assert decompress_nbt_stream(BytesIO(self.load_test_data_file("map_1500.dat")), len(uncompressed_buffer)) == uncompressed_buffer
+
+  def test_decompress_stream_should_reject_more_than_max_size(self):
+    uncompressed_buffer = self.load_uncompressed_test_data_file("map_1500.dat")
+
+    with pytest.raises(MalformedFileError):
+      decompress_nbt_stream(BytesIO(self.load_test_data_file("map_1500.dat")), len(uncompressed_buffer) - 1)
+
+  @pytest.mark.parametrize("compressed_buffer", [
+    (b""),
+    (b"not gzip data"),
+    (gzip.compress(b"truncated" * 100)[:-20])
+  ])
+  def test_decompress_stream_should_reject_invalid_gzip(self, compressed_buffer):
+    with pytest.raises(MalformedFileError):
+      decompress_nbt_stream(BytesIO(compressed_buffer))
+
+  # Helper Functions
+
+  def load_test_data_nbt_file(self, filename):
+    return load_compressed_nbt_file(self.get_test_data_file_path(filename))
+
+  def load_uncompressed_test_data_file(self, filename):
+    return decompress_nbt_buffer(self.load_test_data_file(filename))
+
+  def get_test_data_file_path(self, filename):
+    return os.path.join(self.TEST_DATA_DIR, filename)
@@ -0,0 +1,132 @@
+from test_schematic_base import TestSchematicBase
+from unittest.mock import patch
+
+from werkzeug.datastructures import OrderedMultiDict
+from io import BytesIO
+from mrt_file_server.schematic_storage import SchematicBlobStore
+
+import hashlib
+import os
+import shutil
+import stat
+
+class TestSchematicDedupe(TestSchematicBase):
+  def setup(self):
+    TestSchematicBase.setup(self)
+    self.uploads_dir = self.app.config["SCHEMATIC_UPLOADS_DIR"]
+    self.blobs_dir = self.app.config["SCHEMATIC_BLOBS_DIR"]
+    self.clean_directories()
+
+  def teardown(self):
+    TestSchematicBase.teardown(self)
+    self.clean_directories()
+
+  # Tests
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_upload_same_content_should_be_stored_once(self, mock_logger):
+    filename = "mrt_v5_final_elevated_centre_station.schematic"
+    file_content = self.load_test_data_file(filename)
+
+    data = OrderedMultiDict()
+    data.add("userName", "Frumple")
+    data.add("schematic", (BytesIO(file_content), filename))
+    data.add("schematic", (BytesIO(file_content), "copy_of_station.schematic"))
+    data.add("schematic", (BytesIO(self.load_test_data_file("mrt_v5_final_ground_split1.schematic")), "mrt_v5_final_ground_split1.schematic"))
+
+    with patch.dict(self.app.config, { "SCHEMATIC_UPLOAD_DEDUPLICATION": True }):
+      response = self.perform_upload(data)
+
+    assert response.status_code == 200
+
+    first_path = os.path.join(self.uploads_dir, "Frumple-{}".format(filename))
+    second_path = os.path.join(self.uploads_dir, "Frumple-copy_of_station.schematic")
+    blob_path = os.path.join(self.blobs_dir, self.content_hash(file_content)[:2], self.content_hash(file_content))
+
+    self.verify_file_content(self.uploads_dir, "Frumple-{}".format(filename), file_content)
+    self.verify_file_content(self.uploads_dir, "Frumple-copy_of_station.schematic", file_content)
+    assert os.path.samefile(first_path, second_path)
+    assert os.path.samefile(first_path, blob_path)
+    assert os.stat(blob_path).st_nlink == 3
+
+    # Blobs have the permissions of a file created by open, without write permissions so that no link is edited in place
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(os.stat(first_path).st_mode) == 0o444 & ~umask
+
+    assert sorted(os.listdir(self.uploads_dir)) == ["Frumple-copy_of_station.schematic", "Frumple-{}".format(filename), "Frumple-mrt_v5_final_ground_split1.schematic"]
+
+  def test_dedupe_report_should_list_duplicates(self):
+    filename = "mrt_v5_final_elevated_centre_station.schematic"
+    self.copy_test_data_file(filename, self.uploads_dir, "a-{}".format(filename))
+    self.copy_test_data_file(filename, self.uploads_dir, "b-{}".format(filename))
+    self.copy_test_data_file("admod.schematic", self.uploads_dir)
+    file_size = len(self.load_test_data_file(filename))
+
+    result = self.app.test_cli_runner().invoke(args = ["schematic", "dedupe-report"])
+
+    assert result.exit_code == 0
+    assert "a-{0}, b-{0}".format(filename) in result.output
+    assert "1 content with duplicates, 2 files in total. {} bytes can be reclaimed.".format(file_size) in result.output
+
+  def test_dedupe_reclaim_should_link_duplicates_and_remove_unused_blobs(self):
+    filename = "mrt_v5_final_elevated_centre_station.schematic"
+    for prefix in ["a", "b", "c"]:
+      self.copy_test_data_file(filename, self.uploads_dir, "{}-{}".format(prefix, filename))
+    file_content = self.load_test_data_file(filename)
+
+    # A blob left over from a deleted upload
+    orphaned_blob_path = os.path.join(self.blobs_dir, "ab", "ab" * 32)
+    os.makedirs(os.path.dirname(orphaned_blob_path))
+    with open(orphaned_blob_path, "wb") as file:
+      file.write(b"orphaned")
+
+    runner = self.app.test_cli_runner()
+    dry_run_result = runner.invoke(args = ["schematic", "dedupe-reclaim", "--dry-run"])
+    assert "{} bytes would be reclaimed".format(len(file_content) * 2) in dry_run_result.output
+    assert not os.path.samefile(os.path.join(self.uploads_dir, "a-{}".format(filename)), os.path.join(self.uploads_dir, "b-{}".format(filename)))
+
+    result = runner.invoke(args = ["schematic", "dedupe-reclaim"])
+
+    assert result.exit_code == 0
+    assert "Replaced 2 files with links, reclaiming {} bytes. Removed 1 stored copy no longer in use (8 bytes).".format(len(file_content) * 2) in result.output
+
+    inodes = set(os.stat(os.path.join(self.uploads_dir, "{}-{}".format(prefix, filename))).st_ino for prefix in ["a", "b", "c"])
+    assert len(inodes) == 1
+    for prefix in ["a", "b", "c"]:
+      self.verify_file_content(self.uploads_dir, "{}-{}".format(prefix, filename), file_content)
+    assert not os.path.exists(orphaned_blob_path)
+    assert [filename for filename in os.listdir(self.uploads_dir) if filename.startswith(".")] == []
+
+  def test_remove_orphaned_blobs_should_keep_blobs_of_uploads_in_progress(self):
+    blob_store = SchematicBlobStore(self.blobs_dir)
+    file_content = self.load_test_data_file("admod.schematic")
+    link_blob = blob_store.link_blob
+    removed = []
+
+    # The same as dedupe-reclaim running while the upload is between storing its blob and linking its file
+    def link_blob_after_reclaim(*args, **kwargs):
+      assert [filename for filename in os.listdir(self.blobs_dir) if filename.startswith(".")]
+      removed.append(blob_store.remove_orphaned_blobs())
+      return link_blob(*args, **kwargs)
+
+    with patch.object(blob_store, "link_blob", link_blob_after_reclaim):
+      blob_store.save_stream(BytesIO(file_content), self.uploads_dir, "Frumple-admod.schematic")
+
+    assert removed == [(0, 0)]
+    self.verify_file_content(self.uploads_dir, "Frumple-admod.schematic", file_content)
+    assert os.path.samefile(os.path.join(self.uploads_dir, "Frumple-admod.schematic"), blob_store.get_blob_path(self.content_hash(file_content)))
+    assert [filename for filename in os.listdir(self.blobs_dir) if filename.startswith(".")] == []
+
+  # Helper Functions
+
+  def perform_upload(self, data):
+    return self.client.post("/schematic/upload", content_type = "multipart/form-data", data = data)
+
+  def content_hash(self, content):
+    return hashlib.sha256(content).hexdigest()
+
+  def clean_directories(self):
+    self.remove_files(self.uploads_dir, "schematic")
+    self.remove_files(self.uploads_dir, "schem")
+    shutil.rmtree(self.blobs_dir, ignore_errors = True)
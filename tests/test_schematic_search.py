@@ -0,0 +1,102 @@
+from test_schematic_base import TestSchematicBase
+
+import os
+import pytest
+
+class TestSchematicSearch(TestSchematicBase):
+  def setup(self):
+    TestSchematicBase.setup(self)
+    self.downloads_dir = self.app.config["SCHEMATIC_DOWNLOADS_DIR"]
+    self.clean_schematic_downloads_dir()
+
+    for filename in os.listdir(self.TEST_DATA_DIR):
+      if filename.startswith("mrt_v5_final_"):
+        self.copy_test_data_file(filename, self.downloads_dir)
+
+  def teardown(self):
+    TestSchematicBase.teardown(self)
+    self.clean_schematic_downloads_dir()
+
+  # Tests
+
+  def test_search_should_return_prefix_matches_first(self):
+    response = self.search("MRT_V5_FINAL_GROUND_")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert [result["fileName"] for result in response.json["results"][:6]] == [
+      "mrt_v5_final_ground_centre_station.schematic",
+      "mrt_v5_final_ground_double_curve.schematic",
+      "mrt_v5_final_ground_double_track.schematic",
+      "mrt_v5_final_ground_side_station.schematic",
+      "mrt_v5_final_ground_single_track.schematic",
+      "mrt_v5_final_ground_split1.schematic"
+    ]
+
+    result = response.json["results"][0]
+    assert result["fileRoot"] == "mrt_v5_final_ground_centre_station"
+    assert result["fileExtension"] == "schematic"
+
+  def test_search_should_return_fuzzy_matches(self):
+    response = self.search("elevatd_sidestation")
+
+    assert response.status_code == 200
+    assert response.json["results"][0]["fileName"] == "mrt_v5_final_elevated_side_station.schematic"
+
+  @pytest.mark.parametrize("query", [
+    (""),
+    ("zzzzzz")
+  ])
+  def test_search_should_return_no_results(self, query):
+    response = self.search(query)
+
+    assert response.status_code == 200
+    assert response.json["total"] == 0
+    assert response.json["results"] == []
+
+  def test_search_should_paginate_results(self):
+    results_per_page = self.app.config["SCHEMATIC_SEARCH_RESULTS_PER_PAGE"]
+    self.app.config["SCHEMATIC_SEARCH_RESULTS_PER_PAGE"] = 4
+
+    try:
+      first_page = self.search("mrt_v5_final_", page = 1).json
+      last_page = self.search("mrt_v5_final_", page = 6).json
+    finally:
+      self.app.config["SCHEMATIC_SEARCH_RESULTS_PER_PAGE"] = results_per_page
+
+    assert first_page["total"] == 21
+    assert len(first_page["results"]) == 4
+    assert first_page["results"][0]["fileName"] == "mrt_v5_final_elevated_centre_station.schem"
+    assert [result["fileName"] for result in last_page["results"]] == ["mrt_v5_final_underground_split1.schematic"]
+
+  @pytest.mark.parametrize("page", [
+    ("0"),
+    ("-1"),
+    ("abc")
+  ])
+  def test_search_should_fail_with_invalid_page(self, page):
+    response = self.search("mrt", page = page)
+
+    assert response.status_code == 400
+
+  def test_search_should_reflect_added_and_removed_files(self):
+    assert self.search("admod").json["total"] == 0
+
+    self.copy_test_data_file("admod.schematic", self.downloads_dir)
+    assert [result["fileName"] for result in self.search("admod").json["results"]] == ["admod.schematic"]
+
+    os.remove(os.path.join(self.downloads_dir, "admod.schematic"))
+    assert self.search("admod").json["total"] == 0
+
+  # Helper Functions
+
+  def clean_schematic_downloads_dir(self):
+    self.remove_files(self.downloads_dir, "schematic")
+    self.remove_files(self.downloads_dir, "schem")
+
+  def search(self, query, page = None):
+    query_string = { "q": query }
+    if page is not None:
+      query_string["page"] = page
+
+    return self.client.get("/schematic/search", query_string = query_string)
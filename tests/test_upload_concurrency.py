@@ -0,0 +1,181 @@
+from test_base import TestBase
+from unittest.mock import patch
+
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import OrderedMultiDict
+from io import BytesIO
+from mrt_file_server.blueprints.map import is_map_already_uploaded
+from mrt_file_server.utils.file_utils import file_exists_in_dir, lock_name, open_exclusive_file
+
+import multiprocessing
+import os
+import pytest
+import shutil
+import threading
+import time
+
+# Number of uploads of the same file that are sent at the same time
+PARALLEL_UPLOADS = 16
+
+# Seconds that the checks for an existing file are slowed down by, so that without locking, parallel uploads would all pass the checks
+CHECK_DELAY = 0.02
+
+def slow_check(check):
+  def slow(*args):
+    result = check(*args)
+    time.sleep(CHECK_DELAY)
+    return result
+  return slow
+
+class TestUploadConcurrency(TestBase):
+  def setup(self):
+    TestBase.setup(self)
+    self.map_test_data_dir = os.path.join(self.TEST_DATA_ROOT, "data", "maps")
+    self.schematic_test_data_dir = os.path.join(self.TEST_DATA_ROOT, "data", "schematics")
+    self.map_uploads_dir = self.app.config["MAP_UPLOADS_DIR"]
+    self.map_downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.schematic_uploads_dir = self.app.config["SCHEMATIC_UPLOADS_DIR"]
+    self.reset_directories()
+
+  def teardown(self):
+    TestBase.teardown(self)
+    self.reset_directories()
+
+  # Tests
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  @patch("mrt_file_server.blueprints.map.is_map_already_uploaded", slow_check(is_map_already_uploaded))
+  def test_parallel_uploads_of_same_map_should_create_it_once(self, mock_logger):
+    filename = "map_1500.dat"
+    map_content = self.read_file(os.path.join(self.map_test_data_dir, filename))
+
+    with ThreadPoolExecutor(max_workers = PARALLEL_UPLOADS) as executor:
+      responses = list(executor.map(lambda index: self.upload_map("User{}".format(index), filename, map_content), range(PARALLEL_UPLOADS)))
+
+    keys = [self.get_flash_message_key(response, filename, ["MAP_UPLOAD_SUCCESS", "MAP_UPLOAD_MAP_ALREADY_UPLOADED"]) for response in responses]
+
+    assert keys.count("MAP_UPLOAD_SUCCESS") == 1
+    assert keys.count("MAP_UPLOAD_MAP_ALREADY_UPLOADED") == PARALLEL_UPLOADS - 1
+    assert os.listdir(self.map_uploads_dir) == [filename]
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  @patch("mrt_file_server.blueprints.map.is_map_already_uploaded", slow_check(is_map_already_uploaded))
+  def test_parallel_uploads_of_same_map_from_several_processes_should_create_it_once(self, mock_logger):
+    filename = "map_1501.dat"
+    map_content = self.read_file(os.path.join(self.map_test_data_dir, filename))
+
+    # Worker processes are forked, the same as uWSGI workers, and only share the files in the instance directory
+    context = multiprocessing.get_context("fork")
+    with context.Pool(4) as pool:
+      keys = pool.starmap(upload_map_in_process, [(filename, map_content, index) for index in range(PARALLEL_UPLOADS)])
+
+    assert keys.count("MAP_UPLOAD_SUCCESS") == 1
+    assert keys.count("MAP_UPLOAD_MAP_ALREADY_UPLOADED") == PARALLEL_UPLOADS - 1
+    assert os.listdir(self.map_uploads_dir) == [filename]
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  @patch("mrt_file_server.blueprints.schematic.file_exists_in_dir", slow_check(file_exists_in_dir))
+  @pytest.mark.parametrize("deduplication", [False, True])
+  def test_parallel_uploads_of_same_schematic_should_create_it_once(self, mock_logger, deduplication):
+    username = "Frumple"
+    file_root = "mrt_v5_final_elevated_centre_station"
+    schematic_content = self.read_file(os.path.join(self.schematic_test_data_dir, file_root + ".schematic"))
+
+    # Uploads with either extension have the same name, and only one of them may be uploaded
+    extensions = [".schematic", ".schem"] * (PARALLEL_UPLOADS // 2)
+
+    with patch.dict(self.app.config, { "SCHEMATIC_UPLOAD_DEDUPLICATION": deduplication }):
+      with ThreadPoolExecutor(max_workers = PARALLEL_UPLOADS) as executor:
+        responses = list(executor.map(lambda extension: self.upload_schematic(username, file_root + extension, schematic_content), extensions))
+
+    keys = [self.get_flash_message_key(response, "{}-{}{}".format(username, file_root, extension), ["SCHEMATIC_UPLOAD_SUCCESS", "SCHEMATIC_UPLOAD_FILE_EXISTS"]) for response, extension in zip(responses, extensions)]
+
+    assert keys.count("SCHEMATIC_UPLOAD_SUCCESS") == 1
+    assert keys.count("SCHEMATIC_UPLOAD_FILE_EXISTS") == PARALLEL_UPLOADS - 1
+
+    uploaded_filenames = [filename for filename in os.listdir(self.schematic_uploads_dir) if not filename.startswith(".")]
+    assert len(uploaded_filenames) == 1
+    assert self.read_file(os.path.join(self.schematic_uploads_dir, uploaded_filenames[0])) == schematic_content
+
+  def test_open_exclusive_file_should_not_replace_existing_file(self):
+    with open_exclusive_file(self.map_uploads_dir, "map_1500.dat") as file:
+      file.write(b"first")
+
+    with pytest.raises(FileExistsError):
+      with open_exclusive_file(self.map_uploads_dir, "map_1500.dat") as file:
+        file.write(b"second")
+
+    assert self.read_file(os.path.join(self.map_uploads_dir, "map_1500.dat")) == b"first"
+    assert os.listdir(self.map_uploads_dir) == ["map_1500.dat"]
+
+  def test_lock_name_should_only_block_same_name(self):
+    locks_dir = self.app.config["LOCKS_DIR"]
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+      with lock_name(locks_dir, "test", "map_1500.dat"):
+        locked.set()
+        release.wait(5)
+
+    thread = threading.Thread(target = hold_lock)
+    thread.start()
+    locked.wait(5)
+
+    try:
+      # A different name is not blocked by the held lock
+      with lock_name(locks_dir, "test", "map_1501.dat"):
+        pass
+
+      # The same name waits until the held lock is released
+      threading.Timer(0.1, release.set).start()
+      start = time.perf_counter()
+      with lock_name(locks_dir, "test", "map_1500.dat"):
+        assert release.is_set()
+      assert time.perf_counter() - start >= 0.05
+    finally:
+      release.set()
+      thread.join()
+
+  # Helper Functions
+
+  def upload_map(self, username, filename, content):
+    data = OrderedMultiDict()
+    data.add("userName", username)
+    data.add("map", (BytesIO(content), filename))
+    return self.app.test_client().post("/map/upload", content_type = "multipart/form-data", data = data)
+
+  def upload_schematic(self, username, filename, content):
+    data = OrderedMultiDict()
+    data.add("userName", username)
+    data.add("schematic", (BytesIO(content), filename))
+    return self.app.test_client().post("/schematic/upload", content_type = "multipart/form-data", data = data)
+
+  def get_flash_message_key(self, response, filename, keys):
+    return get_flash_message_key(self.app, response, filename, keys)
+
+  def reset_directories(self):
+    self.remove_files(self.map_uploads_dir, "dat")
+    self.remove_files(self.map_downloads_dir, "dat")
+    self.remove_files(self.schematic_uploads_dir, "schematic")
+    self.remove_files(self.schematic_uploads_dir, "schem")
+    shutil.copyfile(os.path.join(self.map_test_data_dir, "idcounts.dat"), os.path.join(self.map_downloads_dir, "idcounts.dat"))
+
+def get_flash_message_key(app, response, filename, keys):
+  # Returns the key of the message that was flashed for the file
+  response_text = response.data.decode("utf-8")
+  for key in keys:
+    flash_message = app.config["FLASH_MESSAGES"][key]
+    if "{}: {}".format(filename, flash_message.message.format(filename)) in response_text:
+      return key
+  return None
+
+def upload_map_in_process(filename, content, index):
+  from test_base import get_test_app
+
+  app = get_test_app()
+  data = OrderedMultiDict()
+  data.add("userName", "User{}".format(index))
+  data.add("map", (BytesIO(content), filename))
+  response = app.test_client().post("/map/upload", content_type = "multipart/form-data", data = data)
+  return get_flash_message_key(app, response, filename, ["MAP_UPLOAD_SUCCESS", "MAP_UPLOAD_MAP_ALREADY_UPLOADED"])
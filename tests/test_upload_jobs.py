@@ -0,0 +1,201 @@
+from test_map_base import TestMapBase
+from unittest.mock import patch
+
+from werkzeug.datastructures import FileStorage, OrderedMultiDict
+from io import BytesIO
+from mrt_file_server.utils.nbt_utils import load_compressed_nbt_file, get_nbt_map_value
+
+import flask
+import modes
+import os
+import shutil
+import tempfile
+import time
+
+# Created once with the upload job queue enabled, and shared by all upload job tests
+upload_job_app = None
+
+class TestUploadJobs(TestMapBase):
+  def setup(self):
+    TestMapBase.setup(self)
+    self.app = get_upload_job_app()
+    self.app.testing = True
+    self.client = self.app.test_client()
+    self.uploads_dir = self.app.config["MAP_UPLOADS_DIR"]
+    self.downloads_dir = self.app.config["MAP_DOWNLOADS_DIR"]
+    self.schematic_uploads_dir = self.app.config["SCHEMATIC_UPLOADS_DIR"]
+    self.temp_dirs = []
+    self.reset_directories()
+
+  def teardown(self):
+    TestMapBase.teardown(self)
+    self.reset_directories()
+    for temp_dir in self.temp_dirs:
+      shutil.rmtree(temp_dir)
+
+  # Tests
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_map_upload_should_be_queued_and_processed_in_background(self, mock_logger):
+    username = "Frumple"
+    filenames = ["map_1500.dat", "map_-1.dat", "map_1501.dat"]
+
+    data = OrderedMultiDict()
+    data.add("userName", username)
+    for filename, content in self.load_test_data_files(filenames).items():
+      data.add("map", (BytesIO(content), filename))
+
+    response = self.client.post("/map/upload", content_type = "multipart/form-data", data = data)
+
+    assert response.status_code == 202
+    job_url = response.headers["Location"]
+    job_id = job_url.rsplit("/", 1)[-1]
+    assert "<a href=\"{}\">".format(job_url) in response.data.decode("utf-8")
+    mock_logger.info.assert_any_call(self.get_log_message("MAP_UPLOAD_QUEUED"), job_id, 3, username)
+
+    job = self.wait_for_job(job_url)
+
+    assert job["type"] == "map"
+    assert [file["fileName"] for file in job["files"]] == filenames
+    assert [file["status"] for file in job["files"]] == ["success", "failure", "success"]
+    assert job["files"][0]["message"] == "map_1500.dat: {}".format(self.get_flash_message("MAP_UPLOAD_SUCCESS").message)
+    assert job["files"][1]["message"] == "map_-1.dat: {}".format(self.get_flash_message("MAP_UPLOAD_FILENAME_INVALID").message)
+
+    # The files are processed by the same code as an upload in the request
+    for filename in ["map_1500.dat", "map_1501.dat"]:
+      assert get_nbt_map_value(load_compressed_nbt_file(os.path.join(self.uploads_dir, filename)), "locked") == 1
+      mock_logger.info.assert_any_call(self.get_log_message("MAP_UPLOAD_SUCCESS"), filename, username)
+
+    # The spooled files are removed once the job is finished
+    assert not os.path.exists(os.path.join(self.app.config["UPLOAD_JOB_SPOOL_DIR"], job_id))
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_queued_upload_should_reject_file_too_large(self, mock_logger):
+    filename = "map_1500.dat"
+    max_file_size = self.app.config["MAP_UPLOAD_MAX_FILE_SIZE"]
+
+    data = OrderedMultiDict()
+    data.add("userName", "Frumple")
+    data.add("map", (BytesIO(b"\0" * (max_file_size + 1)), filename))
+
+    response = self.client.post("/map/upload", content_type = "multipart/form-data", data = data)
+    job = self.wait_for_job(response.headers["Location"])
+
+    assert job["files"][0]["status"] == "failure"
+    assert job["files"][0]["size"] == max_file_size + 1
+    assert job["files"][0]["message"] == "{}: {}".format(filename, self.get_flash_message("MAP_UPLOAD_FILE_TOO_LARGE").message)
+    self.verify_file_does_not_exist(self.uploads_dir, filename)
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_schematic_upload_should_be_queued_and_processed_in_background(self, mock_logger):
+    username = "Frumple"
+    filename = "mrt_v5_final_ground_split1.schematic"
+    content = self.read_file(os.path.join(self.TEST_DATA_ROOT, "data", "schematics", filename))
+
+    data = OrderedMultiDict()
+    data.add("userName", username)
+    data.add("schematic", (BytesIO(content), filename))
+
+    response = self.client.post("/schematic/upload", content_type = "multipart/form-data", data = data)
+
+    assert response.status_code == 202
+    job = self.wait_for_job(response.headers["Location"])
+
+    assert job["type"] == "schematic"
+    assert job["files"][0]["status"] == "success"
+    self.verify_file_content(self.schematic_uploads_dir, "{}-{}".format(username, filename), content)
+
+  def test_unknown_job_should_return_not_found(self):
+    response = self.client.get("/jobs/0123456789abcdef")
+
+    assert response.status_code == 404
+
+  def test_running_job_of_exited_process_should_be_queued_again(self):
+    from mrt_file_server.upload_jobs import RUNNING_JOB_TIMEOUT
+
+    upload_job_queue = self.app.extensions["mrt_file_server"].upload_job_queue
+    job_id = upload_job_queue.submit("map", "Frumple", "127.0.0.1", [])
+    connection = upload_job_queue._get_connection()
+
+    # The job was claimed by a process that exited without finishing it
+    with connection:
+      connection.execute("UPDATE jobs SET status = 'running', claim = 'exited', updated = ? WHERE job_id = ?", (time.time() - RUNNING_JOB_TIMEOUT - 1, job_id))
+
+    job = self.wait_for_job("/jobs/{}".format(job_id))
+
+    assert job["status"] == "finished"
+
+  def test_idle_worker_should_not_write_to_database(self):
+    upload_job_queue = self.create_upload_job_queue()
+    statements = []
+    upload_job_queue._get_connection().set_trace_callback(statements.append)
+
+    assert upload_job_queue.claim_next_job() is None
+    assert not [statement for statement in statements if not statement.startswith("SELECT")]
+
+  def test_worker_that_lost_its_claim_should_stop_processing(self):
+    upload_job_queue = self.create_upload_job_queue()
+    connection = upload_job_queue._get_connection()
+    processed_filenames = []
+
+    def process_and_lose_claim(username, file):
+      # The job is queued again while its first file is processed, as if the worker had stalled, and claimed by another worker
+      processed_filenames.append(file.filename)
+      with connection:
+        connection.execute("UPDATE jobs SET claim = 'other' WHERE job_id = ?", (job_id,))
+      flask.flash("{}: processed".format(file.filename), "success")
+
+    upload_job_queue.register_processor("map", process_and_lose_claim)
+    files = [FileStorage(stream = BytesIO(b"map"), filename = filename) for filename in ["map_1500.dat", "map_1501.dat"]]
+    with self.app.test_request_context():
+      job_id = upload_job_queue.submit("map", "Frumple", "127.0.0.1", files)
+
+    assert upload_job_queue.process_next_job()
+
+    # The other worker owns the job, and processes the remaining files from the spooled files that are left in place
+    job = upload_job_queue.get(job_id)
+    assert processed_filenames == ["map_1500.dat"]
+    assert job["status"] == "running"
+    assert [file["status"] for file in job["files"]] == ["pending", "pending"]
+    assert os.path.isdir(os.path.join(upload_job_queue.spool_dir, job_id))
+
+  # Helper Functions
+
+  def wait_for_job(self, job_url, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+      response = self.client.get(job_url)
+      assert response.status_code == 200
+
+      job = response.get_json()
+      if job["status"] == "finished" or time.monotonic() > deadline:
+        assert job["status"] == "finished"
+        return job
+
+      time.sleep(0.05)
+
+  def create_upload_job_queue(self):
+    # A queue of its own without worker threads, so that the test decides when jobs are processed
+    from mrt_file_server.upload_jobs import UploadJobQueue
+
+    temp_dir = tempfile.mkdtemp()
+    self.temp_dirs.append(temp_dir)
+    return UploadJobQueue(self.app, os.path.join(temp_dir, "upload_jobs.sqlite3"), os.path.join(temp_dir, "spool"), 0, 3600)
+
+  def reset_directories(self):
+    self.remove_files(self.uploads_dir, "dat")
+    self.remove_files(self.downloads_dir, "dat")
+    self.remove_files(self.schematic_uploads_dir, "schematic")
+    self.copy_test_data_file("idcounts.dat", self.downloads_dir)
+
+def get_upload_job_app():
+  # The jobs blueprint is only registered when the application is created with the queue enabled
+  global upload_job_app
+
+  if upload_job_app is None:
+    from mrt_file_server import create_app
+
+    with patch("mrt_file_server.default_config.UPLOAD_JOB_QUEUE_ENABLED", True):
+      upload_job_app = create_app(modes.TEST)
+
+  return upload_job_app
@@ -37,4 +37,76 @@ class TestWorldDownload(TestBase):
     assert response.headers.get("Content-Disposition") == "attachment; filename={}".format(self.FILE_NAME)
     assert int(response.headers.get("Content-Length")) == self.FILE_SIZE_IN_BYTES
 
-    mock_logger.info.assert_called_with(self.get_log_message("WORLD_DOWNLOAD_SUCCESS"), self.FILE_NAME)
\ No newline at end of file
+    mock_logger.info.assert_called_with(self.get_log_message("WORLD_DOWNLOAD_SUCCESS"), self.FILE_NAME)
+
+  def test_world_download_should_resume_from_range(self):
+    route_to_file = "/world/download/{}".format(self.FILE_NAME)
+    resume_offset = self.FILE_SIZE_IN_BYTES - 24
+
+    response = self.client.get(route_to_file, headers = { "Range": "bytes={}-".format(resume_offset) })
+
+    assert response.status_code == 206
+    assert response.headers.get("Content-Range") == "bytes {}-{}/{}".format(resume_offset, self.FILE_SIZE_IN_BYTES - 1, self.FILE_SIZE_IN_BYTES)
+    assert int(response.headers.get("Content-Length")) == 24
+    assert response.data == b"\0" * 24
+
+  def test_world_download_should_be_cacheable_and_revalidated_without_reading(self):
+    route_to_file = "/world/download/{}".format(self.FILE_NAME)
+
+    with patch("mrt_file_server.utils.download_utils.hash_file_content") as mock_hash_file_content:
+      first_response = self.client.get(route_to_file)
+      second_response = self.client.get(route_to_file, headers = { "If-None-Match": first_response.headers.get("ETag") })
+
+    assert first_response.headers.get("Cache-Control") == self.app.config["WORLD_DOWNLOAD_CACHE_CONTROL"]
+    assert second_response.status_code == 304
+    assert second_response.headers.get("Cache-Control") == self.app.config["WORLD_DOWNLOAD_CACHE_CONTROL"]
+
+    # Files above DOWNLOAD_CONTENT_HASH_MAX_FILE_SIZE are never read to compute their ETag
+    mock_hash_file_content.assert_not_called()
+
+  def test_world_download_range_with_if_range_should_return_whole_file_for_weak_etag(self):
+    route_to_file = "/world/download/{}".format(self.FILE_NAME)
+
+    # Files above DOWNLOAD_CONTENT_HASH_MAX_FILE_SIZE get a weak ETag from their inode, modification time and size
+    etag, weak = self.client.get(route_to_file).get_etag()
+    assert weak
+
+    response = self.client.get(route_to_file, headers = { "Range": "bytes=0-9", "If-Range": "W/\"{}\"".format(etag) })
+
+    # A weak ETag cannot show that the parts of a file are from the same version, so the whole file is sent
+    assert response.status_code == 200
+    assert int(response.headers.get("Content-Length")) == self.FILE_SIZE_IN_BYTES
+    assert response.headers.get("ETag") == "W/\"{}\"".format(etag)
+    response.close()
+
+  @patch("mrt_file_server.utils.log_utils.log_adapter")
+  def test_world_download_with_x_accel_redirect_should_offload_file(self, mock_logger):
+    route_to_file = "/world/download/{}".format(self.FILE_NAME)
+
+    with patch.dict(self.app.config, { "DOWNLOAD_DELIVERY_MODE": "x-accel-redirect" }):
+      response = self.client.get(route_to_file)
+
+    assert response.status_code == 200
+    assert response.headers.get("X-Accel-Redirect") == "/protected-downloads/worlds/{}".format(self.FILE_NAME)
+    assert response.headers.get("Content-Disposition") == "attachment; filename={}".format(self.FILE_NAME)
+    assert int(response.headers.get("Content-Length")) == self.FILE_SIZE_IN_BYTES
+    assert response.data == b""
+
+    mock_logger.info.assert_called_with(self.get_log_message("WORLD_DOWNLOAD_SUCCESS"), self.FILE_NAME)
+
+  def test_world_download_with_x_sendfile_should_offload_file(self):
+    route_to_file = "/world/download/{}".format(self.FILE_NAME)
+
+    with patch.dict(self.app.config, { "DOWNLOAD_DELIVERY_MODE": "x-sendfile" }):
+      response = self.client.get(route_to_file)
+
+    assert response.status_code == 200
+    assert response.headers.get("X-Sendfile") == self.FILE_PATH
+    assert response.data == b""
+
+  def test_world_download_with_x_accel_redirect_should_fail_for_missing_file(self):
+    with patch.dict(self.app.config, { "DOWNLOAD_DELIVERY_MODE": "x-accel-redirect" }):
+      response = self.client.get("/world/download/missing.7z")
+
+    assert response.status_code == 404
+    assert response.headers.get("X-Accel-Redirect") is None
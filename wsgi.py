@@ -0,0 +1,5 @@
+# Entry point for uWSGI and other WSGI servers. The application is created once when this module is loaded,
+# so with uWSGI's default preforking, worker processes are forked from a master that has already created it.
+from mrt_file_server import create_app
+
+app = create_app()